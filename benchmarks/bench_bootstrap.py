@@ -0,0 +1,89 @@
+"""
+Timing of bootstrap confidence intervals for ROC AUC.
+
+Compares a loop calling `sklearn.metrics.roc_auc_score` on every resample,
+timed on a few resamples and extrapolated, with `bootstrap.bootstrap_auc`,
+which draws blocks of resamples as index matrices and spreads them over a
+process pool. Checks both give the same AUC on the same resamples.
+
+    python benchmarks/bench_bootstrap.py --rows 1000000 --resamples 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.metrics import roc_auc_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from bootstrap import (  # noqa: E402
+    _blocks,
+    _index_matrix,
+    bootstrap_auc,
+    confidence_interval,
+)
+
+
+def main(args):
+    rng = np.random.default_rng(args.random_state)
+    y = rng.random(args.rows) < 0.15
+    scores = (0.3 * y + rng.random(args.rows)).astype(np.float32)
+
+    # the same resamples as bootstrap_auc, which resamples rows sorted by score
+    order = np.argsort(scores, kind="mergesort")
+    y_sorted, scores_sorted = y[order], scores[order]
+    seed, size = _blocks(args.rows, args.resamples, args.random_state)[0]
+    index = _index_matrix(seed, size, args.rows)[: args.baseline_resamples]
+    start = time.perf_counter()
+    expected = [roc_auc_score(y_sorted[i], scores_sorted[i]) for i in index]
+    loop_seconds = (time.perf_counter() - start) / len(index) * args.resamples
+
+    start = time.perf_counter()
+    aucs = bootstrap_auc(
+        y,
+        scores,
+        n_resamples=args.resamples,
+        random_state=args.random_state,
+        n_jobs=args.n_jobs,
+    )
+    seconds = time.perf_counter() - start
+    assert np.allclose(aucs[: len(expected)], expected)
+
+    interval = confidence_interval(aucs)
+    results = {
+        "rows": args.rows,
+        "resamples": args.resamples,
+        "workers": args.n_jobs or os.cpu_count(),
+        "loop_seconds_estimated": loop_seconds,
+        "seconds": seconds,
+        "roc_auc": roc_auc_score(y, scores),
+        "interval": interval,
+    }
+    print(f"roc_auc_score loop  {loop_seconds:10.1f}s (from {len(index)} resamples)")
+    print(f"bootstrap_auc       {seconds:10.1f}s on {results['workers']} workers")
+    print(
+        f"AUC {results['roc_auc']:.4f}  "
+        f"{interval['confidence']:.0%} CI [{interval['lower']:.4f}, "
+        f"{interval['upper']:.4f}]"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--resamples", type=int, default=1000)
+    parser.add_argument("--baseline-resamples", type=int, default=3)
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
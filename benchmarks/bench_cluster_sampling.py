@@ -0,0 +1,83 @@
+"""
+Segment agreement and timing of sampled DenseClus fits against a full fit.
+
+Cleans the local source the way `scripts/preprocessing.py` does, clusters it
+once with DenseClus fit on every row, then once per sample size with
+DenseClus fit on a stratified sample and the remaining rows assigned by the
+`SegmentAssigner`. Agreement with the full fit is the adjusted Rand index
+over all rows, 1.0 being identical segments up to relabelling.
+
+    python benchmarks/bench_cluster_sampling.py --source-path data/churn.txt \\
+        --sample-sizes 1000 2000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from sklearn.metrics import adjusted_rand_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from preprocessing import clean_chunk, target_col  # noqa: E402
+from segments import cluster_segments  # noqa: E402
+from sources import read_table  # noqa: E402
+
+
+def run(df, sample_size, random_state):
+    start = time.perf_counter()
+    segments, _ = cluster_segments(
+        df,
+        assign_columns=df.columns.drop(target_col).tolist(),
+        sample_size=sample_size,
+        stratify=target_col,
+        random_state=random_state,
+    )
+    return segments, time.perf_counter() - start
+
+
+def main(args):
+    df = clean_chunk(read_table(None, None, None, source_path=args.source_path))
+    df = df.drop_duplicates()
+    print(f"{len(df)} rows")
+
+    full, full_seconds = run(df, None, args.random_state)
+    results = {
+        "rows": len(df),
+        "full": {"seconds": full_seconds, "segments": len(set(full))},
+        "sampled": [],
+    }
+    print(f"full fit      {full_seconds:8.1f}s  {len(set(full))} segments")
+
+    for sample_size in args.sample_sizes:
+        segments, seconds = run(df, sample_size, args.random_state)
+        agreement = adjusted_rand_score(full, segments)
+        results["sampled"].append(
+            {
+                "sample_size": sample_size,
+                "seconds": seconds,
+                "segments": len(set(segments)),
+                "adjusted_rand_index": agreement,
+            }
+        )
+        print(
+            f"sample {sample_size:>7}{seconds:8.1f}s  {len(set(segments))} segments"
+            f"  ARI {agreement:.3f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source-path", type=str, default="data/churn.txt")
+    parser.add_argument("--sample-sizes", type=int, nargs="+", default=[1000, 2500])
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
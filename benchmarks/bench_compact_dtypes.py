@@ -0,0 +1,140 @@
+"""
+Peak memory of the training preprocessing with and without compact types.
+
+Runs `preprocessing.py` on synthetic churn data once with the default types
+and once with `--compact-dtypes`, each in its own process, and reports the
+peak RSS and wall clock time of both runs and of their phases from the
+`metrics.json` they write. Checks the compact features agree with the
+default ones to float32 precision.
+
+    python benchmarks/bench_compact_dtypes.py --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from bench_pipeline import BENCH_DIR, LOCAL, SCRIPTS_DIR, run_stage  # noqa: E402
+from features_io import (  # noqa: E402
+    OUTPUT_FORMATS,
+    features_path,
+    read_features,
+    read_libsvm,
+)
+from metrics import METRICS_FILE  # noqa: E402
+
+MODES = {"default": [], "compact": ["--compact-dtypes", "True"]}
+
+
+def train_features(base_dir: str, output_format: str) -> np.ndarray:
+    path = features_path(
+        os.path.join(base_dir, "train"), "train_features", output_format
+    )
+    if output_format == "libsvm":
+        X, y = read_libsvm(path)
+        return np.column_stack((y, X.toarray()))
+    return read_features(path).values
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="churn-compact-")
+    env = dict(os.environ, SKIP_DEPENDENCY_CHECK="1")
+    try:
+        source = args.source_path
+        if source is None:
+            # in its own process, a child's peak RSS starts from its parent's
+            source = os.path.join(workdir, "churn.csv")
+            generate = [os.path.join(BENCH_DIR, "synthetic.py")]
+            generate += ["--rows", str(args.rows), "--output", source]
+            generate += ["--random-state", str(args.random_state)]
+            if run_stage("generate", generate, workdir, env)["returncode"]:
+                raise RuntimeError("Generating the synthetic data failed")
+
+        results = {"rows": args.rows, "output_format": args.output_format}
+        for mode, flags in MODES.items():
+            base_dir = os.path.join(workdir, mode)
+            for name in ("train", "test", "transformer"):
+                os.makedirs(os.path.join(base_dir, name), exist_ok=True)
+            command = (
+                [os.path.join(SCRIPTS_DIR, "preprocessing.py")]
+                + LOCAL
+                + ["--source-path", source, "--base-dir", base_dir, "--cluster", ""]
+                + ["--output-format", args.output_format]
+                + (["--chunksize", str(args.chunksize)] if args.chunksize else [])
+                + flags
+            )
+            print(f"Running {mode}", file=sys.stderr)
+            result = run_stage(mode, command, workdir, env)
+            if result["returncode"]:
+                raise RuntimeError(f"{mode} run failed:\n{result['error']}")
+            with open(os.path.join(base_dir, "transformer", METRICS_FILE)) as f:
+                result["spans"] = json.load(f)["spans"]
+            results[mode] = result
+
+        difference = np.abs(
+            train_features(os.path.join(workdir, "default"), args.output_format)
+            - train_features(os.path.join(workdir, "compact"), args.output_format)
+        ).max()
+        # float32 rounding of the inputs, the statistics and the output
+        assert difference < 1e-4, f"compact features differ by {difference}"
+        results["max_abs_difference"] = float(difference)
+    finally:
+        shutil.rmtree(workdir)
+
+    default, compact = results["default"], results["compact"]
+    results["rss_reduction"] = 1 - compact["max_rss_mb"] / default["max_rss_mb"]
+    for mode in MODES:
+        print(
+            f"{mode:16s} peak RSS {results[mode]['max_rss_mb']:.0f} MB"
+            f" in {results[mode]['wall_seconds']:.1f}s"
+        )
+        for span in results[mode]["spans"]:
+            print(
+                f"  {span['name']:14s} {span['wall_seconds']:7.2f}s"
+                f" peak {span['max_rss_mb']:7.0f} MB"
+                f" +{span['rss_growth_mb']:.0f} MB"
+            )
+    print(
+        f"Peak RSS {default['max_rss_mb']:.0f} MB -> {compact['max_rss_mb']:.0f} MB"
+        f" ({results['rss_reduction']:.0%} less),"
+        f" features within {results['max_abs_difference']:.1e}"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--source-path",
+        type=str,
+        default=None,
+        help="Churn CSV/Parquet to preprocess instead of synthetic rows",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="parquet",
+        choices=OUTPUT_FORMATS,
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Run the preprocessing out of core in chunks of this size",
+    )
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,92 @@
+"""
+Latency of the compiled preprocessor against `ColumnTransformer.transform`.
+
+Fits `preprocessing.build_preprocessor` on `data/churn.txt`, compiles it with
+`compiled_transform.CompiledTransform` and times both on batches of several
+sizes, the compiled transform writing into a preallocated float32 buffer.
+The outputs are checked to be equal in `tests/test_compiled_transform.py`.
+
+    python benchmarks/bench_compiled_transform.py --batch-sizes 1 100 10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from compiled_transform import CompiledTransform  # noqa: E402
+from inferpreprocessing import prepare_batch  # noqa: E402
+from preprocessing import build_preprocessor  # noqa: E402
+
+CHURN = os.path.join(os.path.dirname(__file__), "..", "data", "churn.txt")
+
+
+def churn_rows(rows: int, random_state: int) -> pd.DataFrame:
+    """`data/churn.txt` resampled to `rows` rows, ready for the preprocessor"""
+    churn = pd.read_csv(CHURN)
+    churn.columns = [c.lower() for c in churn.columns]
+    churn = churn.sample(rows, replace=True, random_state=random_state)
+    return prepare_batch(churn.reset_index(drop=True))
+
+
+def timed(function, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main(args):
+    df = churn_rows(max(args.batch_sizes), args.random_state)
+    numerical_idx = df.select_dtypes(exclude=["object", "category"]).columns.tolist()
+    categorical_idx = df.select_dtypes(exclude="number").columns.tolist()
+    preprocessor = build_preprocessor(numerical_idx, categorical_idx).fit(df)
+    compiled = CompiledTransform.from_preprocessor(preprocessor)
+
+    results = {"n_features": compiled.n_features, "batches": []}
+    buffer = np.empty((max(args.batch_sizes), compiled.n_features), np.float32)
+    print(f"{'rows':>8s} {'sklearn ms':>12s} {'compiled ms':>12s} {'speedup':>8s}")
+    for size in args.batch_sizes:
+        batch = df.iloc[:size]
+        repeats = max(3, min(1000, args.rows_per_size // size))
+        sklearn_seconds = timed(lambda: preprocessor.transform(batch), repeats)
+        compiled_seconds = timed(lambda: compiled.transform(batch, out=buffer), repeats)
+        results["batches"].append(
+            {
+                "rows": size,
+                "sklearn_seconds": sklearn_seconds,
+                "compiled_seconds": compiled_seconds,
+            }
+        )
+        print(
+            f"{size:8d} {sklearn_seconds * 1e3:12.3f} {compiled_seconds * 1e3:12.3f} "
+            f"{sklearn_seconds / compiled_seconds:7.1f}x"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 100_000]
+    )
+    parser.add_argument(
+        "--rows-per-size",
+        type=int,
+        default=1_000_000,
+        help="Rows transformed per batch size, bounds the repeats",
+    )
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
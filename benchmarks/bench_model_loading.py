@@ -0,0 +1,114 @@
+"""
+Timing of loading the trained model in the evaluation scripts.
+
+Trains a large ensemble, packs it in `model.tar.gz` as the training job does
+and compares extracting the archive and unpickling the booster on every call,
+as the evaluation scripts used to, with `models.load_model`: the first call,
+a new process with the archive already extracted in the cache, and a second
+call in the same process, which only hashes the archive.
+
+    python benchmarks/bench_model_loading.py --trees 2000 --format pickle
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import tarfile
+import tempfile
+import time
+
+import numpy as np
+import xgboost
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import models  # noqa: E402
+
+FILE_NAMES = {
+    "pickle": models.MODEL_NAME,
+    "json": f"{models.MODEL_NAME}.json",
+}
+
+
+def build_archive(directory: str, args) -> str:
+    """Train a booster and save it as `model.tar.gz`"""
+    rng = np.random.default_rng(args.random_state)
+    X = rng.random((args.rows, args.features), dtype=np.float32)
+    y = (X[:, 0] + rng.random(args.rows)) > 1
+    booster = xgboost.train(
+        {"objective": "binary:logistic", "max_depth": 6},
+        xgboost.DMatrix(X, label=y),
+        args.trees,
+    )
+    model_file = os.path.join(directory, FILE_NAMES[args.format])
+    if args.format == "pickle":
+        with open(model_file, "wb") as f:
+            pickle.dump(booster, f)
+    else:
+        booster.save_model(model_file)
+    archive = os.path.join(directory, "model.tar.gz")
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(model_file, arcname=os.path.basename(model_file))
+    return archive
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        archive = build_archive(directory, args)
+        cache_dir = os.path.join(directory, "cache")
+        workdir = os.path.join(directory, "work")
+        os.makedirs(workdir)
+
+        def extract_and_unpickle():
+            with tarfile.open(archive) as tar:
+                tar.extractall(path=workdir)
+            model_file = os.path.join(workdir, FILE_NAMES[args.format])
+            if args.format == "pickle":
+                with open(model_file, "rb") as f:
+                    return pickle.load(f)
+            booster = xgboost.Booster()
+            booster.load_model(model_file)
+            return booster
+
+        def load():
+            models.load_model(archive, cache_dir=cache_dir)
+
+        results = {
+            "trees": args.trees,
+            "format": args.format,
+            "archive_bytes": os.path.getsize(archive),
+            "extract_seconds": timed(extract_and_unpickle),
+            "first_load_seconds": timed(load),
+        }
+        # a new process finds the archive extracted but nothing in memory
+        models._boosters.clear()
+        results["cached_load_seconds"] = timed(load)
+        results["repeat_load_seconds"] = timed(load)
+
+    for name in ("extract", "first_load", "cached_load", "repeat_load"):
+        print(f"{name:12s} {results[f'{name}_seconds']:10.4f}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trees", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--features", type=int, default=20)
+    parser.add_argument("--format", type=str, default="pickle", choices=FILE_NAMES)
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
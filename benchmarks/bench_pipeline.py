@@ -0,0 +1,290 @@
+"""
+End to end benchmark of the processing scripts on synthetic churn data.
+
+Runs the whole pipeline locally, with no AWS: the synthetic generator stands
+in for the Athena table (`--source-path`), local directories for the S3
+inputs and outputs (`--base-dir`), `standins.py` for the training job and
+TreeSHAP from the booster for the Debugger tensors (`--shap-source booster`).
+Every stage runs as its own process, the way the processing jobs run it, and
+is timed with the wall clock time, CPU time and peak RSS of that process and
+the processes it started, and broken down into the phases the script records
+in its `metrics.json`.
+
+Results are written as JSON with the commit they were measured on. Pass the
+JSON of an earlier run as `--baseline` to print the change of every stage.
+
+    python benchmarks/bench_pipeline.py --rows 1000000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from features_io import OUTPUT_FORMATS, features_path  # noqa: E402
+from metrics import METRICS_FILE  # noqa: E402
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+SCRIPTS_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "scripts"))
+STAGES = [
+    "generate",
+    "preprocessing",
+    "train",
+    "evaluation",
+    "inferpreprocessing",
+    "scoring",
+    "coxph_preprocessing",
+    "coxph_train",
+    "coxph_evaluation",
+]
+LOCAL = ["--database", "local", "--region", "local", "--table", "churn"]
+# output directory of the per-phase metrics.json of every script stage
+METRICS_DIRS = {
+    "preprocessing": "classification/transformer",
+    "evaluation": "classification/evaluation",
+    "inferpreprocessing": "classification/infer",
+    "scoring": "classification/scores",
+    "coxph_preprocessing": "coxph/transformer",
+    "coxph_evaluation": "coxph/evaluation",
+}
+
+
+def run_stage(name: str, command: list, workdir: str, env: dict) -> dict:
+    """Run a stage in its own process and measure it
+
+    :param name: stage name, also the name of its log file
+    :type name: str
+    :param command: script and arguments
+    :type command: list
+    :param workdir: working directory of the process
+    :type workdir: str
+    :param env: environment of the process
+    :type env: dict
+    :return: return code, wall clock and CPU seconds, peak RSS in MB and the
+     phases the script recorded
+    :rtype: dict
+    """
+    log_path = os.path.join(workdir, f"{name}.log")
+    metrics_path = None
+    if name in METRICS_DIRS:
+        metrics_path = os.path.join(workdir, METRICS_DIRS[name], METRICS_FILE)
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable] + command, cwd=workdir, env=env, stdout=log, stderr=log
+        )
+        # the resource usage of this process and the ones it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+    result = {
+        "returncode": os.waitstatus_to_exitcode(status),
+        "wall_seconds": time.perf_counter() - start,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": usage.ru_maxrss / 1024,
+    }
+    if result["returncode"]:
+        with open(log_path) as log:
+            result["error"] = log.read()[-2000:]
+    if metrics_path and os.path.exists(metrics_path):
+        # kept up to the failure when the stage failed, see scripts/metrics.py
+        with open(metrics_path) as f:
+            result["spans"] = json.load(f)["spans"]
+    return result
+
+
+def commands(args, workdir: str) -> dict:
+    """Command line of every stage"""
+    source = os.path.join(workdir, "churn.csv")
+    classification = os.path.join(workdir, "classification")
+    coxph = os.path.join(workdir, "coxph")
+    cluster = ["--cluster", "True" if args.cluster else ""]
+    train_features = os.path.basename(
+        features_path("", "train_features", args.output_format)
+    )
+    test_features = os.path.basename(
+        features_path("", "test_features", args.output_format)
+    )
+    chunks = ["--chunksize", str(args.chunksize)] if args.chunksize else []
+    shap = ["--shap-source", "booster", "--shap-sample-size", str(args.shap_rows)]
+    features = ["--train-features", train_features, "--test-features", test_features]
+
+    def script(name):
+        return os.path.join(SCRIPTS_DIR, name)
+
+    return {
+        "generate": [
+            os.path.join(BENCH_DIR, "synthetic.py"),
+            "--rows",
+            str(args.rows),
+            "--output",
+            source,
+            "--random-state",
+            str(args.random_state),
+        ]
+        + (["--n-states", str(args.n_states)] if args.n_states else [])
+        + (["--n-area-codes", str(args.n_area_codes)] if args.n_area_codes else []),
+        "preprocessing": [script("preprocessing.py")]
+        + LOCAL
+        + ["--source-path", source, "--base-dir", classification]
+        + ["--output-format", args.output_format]
+        + cluster
+        + chunks,
+        "train": [
+            os.path.join(BENCH_DIR, "standins.py"),
+            "--base-dir",
+            classification,
+            "--train-features",
+            train_features,
+        ],
+        "evaluation": [script("evaluation.py"), "--base-dir", classification]
+        + features
+        + shap,
+        "inferpreprocessing": [script("inferpreprocessing.py")]
+        + LOCAL
+        + ["--source-path", source, "--base-dir", classification]
+        + cluster,
+        "scoring": [script("scoring.py")]
+        + LOCAL
+        + ["--source-path", source, "--base-dir", classification]
+        + cluster,
+        "coxph_preprocessing": [script("coxph_preprocessing.py")]
+        + LOCAL
+        + ["--source-path", source, "--base-dir", coxph]
+        + ["--output-format", args.output_format]
+        + cluster,
+        "coxph_train": [
+            os.path.join(BENCH_DIR, "standins.py"),
+            "--base-dir",
+            coxph,
+            "--train-features",
+            train_features,
+            "--objective",
+            "survival:cox",
+        ],
+        "coxph_evaluation": [script("coxph_evaluation.py"), "--base-dir", coxph]
+        + features
+        + shap,
+    }
+
+
+def print_results(results: dict, baseline: dict):
+    print(f"{'stage':20s} {'wall s':>9s} {'cpu s':>9s} {'rss MB':>9s}")
+    for name, stage in results["stages"].items():
+        line = (
+            f"{name:20s} {stage['wall_seconds']:9.1f} {stage['cpu_seconds']:9.1f} "
+            f"{stage['max_rss_mb']:9.0f}"
+        )
+        before = baseline.get("stages", {}).get(name)
+        if before:
+            line += (
+                f"  wall {stage['wall_seconds'] / before['wall_seconds'] - 1:+.0%}"
+                f"  rss {stage['max_rss_mb'] / before['max_rss_mb'] - 1:+.0%}"
+            )
+        if stage["returncode"]:
+            line += f"  FAILED ({stage['returncode']}), see {name}.log"
+        print(line)
+        for span in stage.get("spans", []):
+            if "wall_seconds" in span:
+                print(
+                    f"  {span['name']:18s} {span['wall_seconds']:9.1f} "
+                    f"{span['cpu_seconds']:9.1f} {span['max_rss_mb']:9.0f}"
+                )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="churn-bench-")
+    for base in ("classification", "coxph"):
+        for name in ("train", "test", "transformer", "model", "evaluation"):
+            os.makedirs(os.path.join(workdir, base, name), exist_ok=True)
+    env = dict(os.environ)
+    if not args.check_dependencies:
+        env["SKIP_DEPENDENCY_CHECK"] = "1"
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "parameters": vars(args),
+        "stages": {},
+    }
+    stage_commands = commands(args, workdir)
+    for name in args.stages:
+        print(f"Running {name}", file=sys.stderr)
+        stage = run_stage(name, stage_commands[name], workdir, env)
+        if name != "train" and not name.endswith("_train"):
+            stage["rows_per_second"] = args.rows / stage["wall_seconds"]
+        results["stages"][name] = stage
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.workdir is None and not args.keep:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--n-states", type=int, default=None)
+    parser.add_argument("--n-area-codes", type=int, default=None)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument(
+        "--cluster", action="store_true", help="Run the DenseClus segmentation"
+    )
+    parser.add_argument(
+        "--output-format", type=str, default="csv", choices=OUTPUT_FORMATS
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Run the training preprocessing out of core in chunks of this size",
+    )
+    parser.add_argument("--shap-rows", type=int, default=10_000)
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        default=None,
+        help="Directory of the stage inputs, outputs and logs, kept after the run",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the temporary workdir"
+    )
+    parser.add_argument(
+        "--check-dependencies",
+        action="store_true",
+        help="Run the scripts' dependency check instead of skipping it",
+    )
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--baseline", type=str, default=None)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,125 @@
+"""
+Timing of the SHAP feature importance plots.
+
+Times `shap_plot`'s density plot, the histograms of every feature and their
+colors from a stratified sample of rows, on synthetic SHAP values of growing
+size, and checks its counts against `np.histogram`, up to values on a bin
+edge. When shap is installed, times `shap.summary_plot`'s beeswarm on the
+same rows too, up to `--beeswarm-rows`.
+
+    python benchmarks/bench_shap_plot.py --rows 10000 100000 1000000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import shap_plot  # noqa: E402
+
+
+def synthetic(rows: int, n_features: int, rng: np.random.Generator):
+    """Feature rows, a rare churn label and SHAP values that follow them"""
+    features = rng.normal(size=(rows, n_features)).astype(np.float32)
+    weights = rng.normal(size=n_features) / np.arange(1, n_features + 1)
+    shap_values = features * weights + rng.normal(scale=0.1, size=features.shape)
+    churn = rng.random(rows) < 0.15
+    names = [f"f{i}" for i in range(n_features)]
+    return shap_values.astype(np.float32), pd.DataFrame(features, columns=names), churn
+
+
+def time_density(shap_values, features, churn, args, path) -> dict:
+    start = time.perf_counter()
+    rows, sample = shap_plot.sample_frame(
+        features, churn, args.sample_size, random_state=args.random_state
+    )
+    density = shap_plot.shap_density(shap_values, rows, sample.values, bins=args.bins)
+    aggregated = time.perf_counter()
+    shap_plot.plot_density(density, sample.columns.tolist(), path)
+    end = time.perf_counter()
+    for k in range(shap_values.shape[1]):
+        expected, _ = np.histogram(shap_values[:, k], bins=density["edges"][k])
+        assert density["counts"][k].sum() == len(shap_values)
+        # only values on a bin edge may round into the neighbouring bin
+        assert np.abs(density["counts"][k] - expected).sum() <= 1e-4 * len(shap_values)
+    return {
+        "density_aggregate_seconds": aggregated - start,
+        "density_render_seconds": end - aggregated,
+    }
+
+
+def time_beeswarm(shap_values, features, path) -> float:
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    shap_plot.summary_plot(shap_values, features, path, mode="beeswarm")
+    seconds = time.perf_counter() - start
+    plt.close("all")
+    return seconds
+
+
+def main(args):
+    try:
+        import shap  # noqa: F401
+
+        has_shap = True
+    except ImportError:
+        has_shap = False
+
+    rng = np.random.default_rng(args.random_state)
+    results = {"features": args.features, "sample_size": args.sample_size, "runs": []}
+    directory = tempfile.mkdtemp(prefix="bench-shap-plot-")
+    for rows in args.rows:
+        shap_values, features, churn = synthetic(rows, args.features, rng)
+        run = {"rows": rows}
+        run.update(
+            time_density(
+                shap_values,
+                features,
+                churn,
+                args,
+                os.path.join(directory, "density.png"),
+            )
+        )
+        print(
+            f"{rows:>10} rows density  {run['density_aggregate_seconds']:8.2f}s "
+            f"aggregate {run['density_render_seconds']:8.2f}s render"
+        )
+        if has_shap and rows <= args.beeswarm_rows:
+            run["beeswarm_seconds"] = time_beeswarm(
+                shap_values, features, os.path.join(directory, "beeswarm.png")
+            )
+            print(f"{rows:>10} rows beeswarm {run['beeswarm_seconds']:8.2f}s")
+        results["runs"].append(run)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--features", type=int, default=70)
+    parser.add_argument("--sample-size", type=int, default=shap_plot.PLOT_SAMPLE_SIZE)
+    parser.add_argument("--bins", type=int, default=shap_plot.DENSITY_BINS)
+    parser.add_argument(
+        "--beeswarm-rows",
+        type=int,
+        default=100_000,
+        help="Largest number of rows the beeswarm is timed on",
+    )
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
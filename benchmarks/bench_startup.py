@@ -0,0 +1,93 @@
+"""
+"Import to first row" startup benchmark of the processing scripts.
+
+Each script is imported in a fresh interpreter, which also runs the startup
+dependency check the script runs as an entry point, and then reads the first
+row of the local source. Reports the time to import and the time to the
+first row, both measured from interpreter start.
+
+    python benchmarks/bench_startup.py --source-path data/churn.txt
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+MODULES = [
+    "preprocessing",
+    "coxph_preprocessing",
+    "inferpreprocessing",
+    "evaluation",
+    "coxph_evaluation",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {scripts_dir!r})
+import dependencies
+import {module}
+check = time.perf_counter()
+dependencies.missing_packages(
+    list(dependencies.read_pins()), dependencies.read_pins()
+)
+imported = time.perf_counter()
+from sources import iter_table
+next(iter_table(None, None, None, chunksize=1, source_path={source_path!r}))
+first_row = time.perf_counter()
+print(json.dumps({{
+    "import": check - start,
+    "dependency_check": imported - check,
+    "first_row": first_row - start,
+}}))
+"""
+
+
+def probe(module, source_path):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            PROBE.format(
+                scripts_dir=SCRIPTS_DIR, module=module, source_path=source_path
+            ),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main(args):
+    results = {}
+    for module in args.modules:
+        runs = [probe(module, args.source_path) for _ in range(args.repeat)]
+        results[module] = {key: min(run[key] for run in runs) for key in runs[0].keys()}
+        print(
+            "{:<22} import {import:6.2f}s  check {dependency_check:6.3f}s  "
+            "first row {first_row:6.2f}s  process {process:6.2f}s".format(
+                module, **results[module]
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source-path", type=str, default="data/churn.txt")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
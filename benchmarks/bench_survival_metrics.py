@@ -0,0 +1,112 @@
+"""
+Timing of the survival metrics of the Cox evaluation.
+
+Times `survival_metrics` on synthetic survival data: the IPCW concordance
+index and the time-dependent AUC and Brier scores over a time grid. When
+scikit-survival is installed, times its concordance index on the synthetic
+rows too, which compares every pair of rows. The metrics are checked
+against scikit-survival in `tests/test_survival_metrics.py`.
+
+    python benchmarks/bench_survival_metrics.py --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import survival_metrics  # noqa: E402
+
+
+def synthetic(rows: int, rng: np.random.Generator):
+    """Exponential event and censoring times with a log-normal hazard ratio"""
+    hazard = np.exp(rng.normal(0, 0.5, rows))
+    event_time = rng.exponential(100 / hazard)
+    censor_time = rng.uniform(0, 250, rows)
+    event = event_time <= censor_time
+    duration = np.ceil(np.minimum(event_time, censor_time)).astype(np.int32)
+    return event, duration, np.round(hazard, 3)
+
+
+def main(args):
+    try:
+        import sksurv  # noqa: F401
+
+        has_sksurv = True
+    except ImportError:
+        has_sksurv = False
+
+    results = {"rows": args.rows, "grid_points": args.grid_points}
+
+    rng = np.random.default_rng(args.random_state)
+    event_train, time_train, hazard_train = synthetic(args.rows, rng)
+    event, duration, hazard = synthetic(args.rows, rng)
+
+    start = time.perf_counter()
+    cindex = survival_metrics.concordance_index_ipcw(
+        event_train, time_train, event, duration, hazard, tau=args.tau
+    )
+    results["cindex_seconds"] = time.perf_counter() - start
+    results["cindex"] = cindex[0]
+
+    start = time.perf_counter()
+    report = survival_metrics.survival_report(
+        event_train,
+        time_train,
+        hazard_train,
+        event,
+        duration,
+        hazard,
+        survival_metrics.time_grid(duration, args.grid_points),
+    )
+    results["time_dependent_seconds"] = time.perf_counter() - start
+    results["mean_auc"] = report["mean_auc"]
+    results["integrated_brier_score"] = report["integrated_brier_score"]
+    print(f"concordance index   {results['cindex_seconds']:10.2f}s")
+    print(f"AUC and Brier score {results['time_dependent_seconds']:10.2f}s")
+
+    if has_sksurv and args.sksurv_rows:
+        from sksurv.metrics import concordance_index_ipcw
+        from sksurv.util import Surv
+
+        rows = min(args.sksurv_rows, args.rows)
+        start = time.perf_counter()
+        concordance_index_ipcw(
+            Surv.from_arrays(event_train, time_train),
+            Surv.from_arrays(event[:rows], duration[:rows]),
+            hazard[:rows],
+            tau=args.tau,
+        )
+        results["sksurv_rows"] = rows
+        results["sksurv_cindex_seconds"] = time.perf_counter() - start
+        print(
+            f"scikit-survival     {results['sksurv_cindex_seconds']:10.2f}s "
+            f"(on {rows} rows)"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--grid-points", type=int, default=survival_metrics.GRID_POINTS)
+    parser.add_argument("--tau", type=int, default=100)
+    parser.add_argument(
+        "--sksurv-rows",
+        type=int,
+        default=20_000,
+        help="Test rows scikit-survival's concordance index is timed on, 0 skips it",
+    )
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the Cox survival target encoder and decoder.
+
+Compares the row by row `iterrows` encoder and the `np.vstack` decoder that
+the Cox scripts used before with the vectorized routines in
+`scripts/survival.py`, and checks both produce the same target.
+
+    python benchmarks/bench_survival_target.py --rows 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from survival import encode_survival_target, survival_frame  # noqa: E402
+
+
+def encode_iterrows(dframe):
+    """Encoder as previously implemented in coxph_preprocessing.survival_y_cox"""
+    y_survival = []
+    for idx, row in dframe[["duration", "event"]].iterrows():
+        if row["event"]:
+            y_survival.append(int(row["duration"]))
+        else:
+            y_survival.append(-int(row["duration"]))
+    return np.array(y_survival)
+
+
+def decode_vstack(y):
+    """Decoder as previously implemented in coxph_evaluation.main"""
+    return pd.DataFrame(
+        np.vstack((np.where(y > 0, 1, 0), np.abs(y))).T,
+        columns=["event", "duration"],
+    )
+
+
+def rows_per_sec(func, arg, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return rows / best, result
+
+
+def main(args):
+    rng = np.random.default_rng(args.random_state)
+    dframe = pd.DataFrame(
+        {
+            "duration": rng.integers(1, 250, size=args.rows),
+            "event": rng.integers(0, 2, size=args.rows),
+        }
+    )
+
+    # iterrows is far too slow to run on the full frame
+    slow_rows = min(args.rows, args.baseline_rows)
+    before, expected = rows_per_sec(
+        encode_iterrows, dframe.iloc[:slow_rows], slow_rows, 1
+    )
+    after, y = rows_per_sec(
+        lambda df: encode_survival_target(df["event"].values, df["duration"].values),
+        dframe,
+        args.rows,
+        args.repeat,
+    )
+    assert np.array_equal(expected, y[:slow_rows])
+    print(f"encode  before {before:>14,.0f} rows/s  after {after:>14,.0f} rows/s")
+
+    before, expected = rows_per_sec(decode_vstack, y, args.rows, args.repeat)
+    after, decoded = rows_per_sec(survival_frame, y, args.rows, args.repeat)
+    assert np.array_equal(expected.values, decoded.values)
+    print(f"decode  before {before:>14,.0f} rows/s  after {after:>14,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--baseline-rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--random-state", type=int, default=123)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,64 @@
+"""
+Local stand-in for the SageMaker training job of the pipeline.
+
+Trains XGBoost on the train features the preprocessing wrote, the first
+column being the target as in the built-in algorithm's CSV input, and packs
+the pickled booster in `model/model.tar.gz` the way the training job does.
+The hyperparameters are fixed rather than tuned.
+
+    python benchmarks/standins.py --base-dir /tmp/bench/classification
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import tarfile
+
+import xgboost
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from features_io import is_libsvm, read_features, read_libsvm  # noqa: E402
+from models import MODEL_NAME  # noqa: E402
+
+
+def train_features(base_dir: str, name: str):
+    path = os.path.join(base_dir, "train", name)
+    if is_libsvm(path):
+        return read_libsvm(path)
+    df = read_features(path)
+    return df.values[:, 1:], df.values[:, 0]
+
+
+def main(args):
+    X, y = train_features(args.base_dir, args.train_features)
+    if args.objective == "survival:cox":
+        # the Cox evaluation scores all but the first feature column
+        X = X[:, 1:]
+    booster = xgboost.train(
+        {"objective": args.objective, "max_depth": args.max_depth, "eta": 0.2},
+        xgboost.DMatrix(X, label=y),
+        args.num_round,
+    )
+
+    model_dir = os.path.join(args.base_dir, "model")
+    os.makedirs(model_dir, exist_ok=True)
+    model_file = os.path.join(model_dir, MODEL_NAME)
+    with open(model_file, "wb") as f:
+        pickle.dump(booster, f)
+    with tarfile.open(os.path.join(model_dir, "model.tar.gz"), "w:gz") as tar:
+        tar.add(model_file, arcname=MODEL_NAME)
+    os.remove(model_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-dir", type=str, required=True)
+    parser.add_argument("--train-features", type=str, default="train_features.csv")
+    parser.add_argument("--objective", type=str, default="binary:logistic")
+    parser.add_argument("--num-round", type=int, default=100)
+    parser.add_argument("--max-depth", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,199 @@
+"""
+Synthetic churn data at any scale, shaped like `data/churn.txt`.
+
+The generator learns a profile of `data/churn.txt`: the churn rate and, for
+each churn class, the empirical distribution of every numeric column and the
+frequencies of every categorical column. Rows are drawn class by class, so
+every column keeps its marginal distribution and its relation to churn.
+Continuous columns are drawn by inverse transform sampling of the sorted
+values, integer columns by resampling the observed values.
+
+`State` and `Area Code` can be given more or fewer categories than the
+source to test the categorical paths at other cardinalities. Extra categories
+get the average frequency of the original ones. Phone numbers come from a
+bijection of the row number, so they are unique below 10M rows.
+
+The file is written in chunks with the header of `data/churn.txt`, so the
+processing scripts read it with `--source-path` as they read Athena.
+
+    python benchmarks/synthetic.py --rows 50000000 --output churn-50m.csv
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+CHURN = os.path.join(os.path.dirname(__file__), "..", "data", "churn.txt")
+TARGET = "Churn?"
+CATEGORICAL = ["State", "Int'l Plan", "VMail Plan"]
+KEYS = ["Area Code", "Phone"]
+PHONES = 10_000_000
+# multiplier of the row number to phone number bijection, coprime with 10
+PHONE_STRIDE = 7_654_321
+CHUNKSIZE = 1_000_000
+
+
+def _categories(values: pd.Series, n_categories: Optional[int], prefix: str):
+    """Categories and their frequencies, resized to `n_categories`"""
+    freq = values.value_counts(normalize=True)
+    if n_categories is None or n_categories == len(freq):
+        return freq.index.to_numpy(dtype=str), freq.to_numpy()
+    if n_categories < len(freq):
+        freq = freq.iloc[:n_categories]
+        return freq.index.to_numpy(dtype=str), (freq / freq.sum()).to_numpy()
+    extra = [f"{prefix}{i}" for i in range(n_categories - len(freq))]
+    weights = np.r_[freq.to_numpy(), np.full(len(extra), 1 / len(freq))]
+    return np.r_[freq.index.to_numpy(dtype=str), extra], weights / weights.sum()
+
+
+def fit_profile(
+    path: str = CHURN,
+    n_states: Optional[int] = None,
+    n_area_codes: Optional[int] = None,
+) -> Dict:
+    """Profile of the churn data the synthetic rows are drawn from
+
+    :param path: source CSV, defaults to `data/churn.txt`
+    :type path: str, optional
+    :param n_states: number of states, defaults to the source's
+    :type n_states: int, optional
+    :param n_area_codes: number of area codes, defaults to the source's
+    :type n_area_codes: int, optional
+    :return: column order, churn rate and the per class distributions
+    :rtype: Dict
+    """
+    df = pd.read_csv(path, dtype={"Area Code": str})
+    sizes = {"State": n_states, "Int'l Plan": None, "VMail Plan": None}
+    classes = {}
+    for label, group in df.groupby(TARGET):
+        classes[label] = {
+            "rate": len(group) / len(df),
+            "categorical": {
+                column: _categories(group[column], sizes[column], "S")
+                for column in CATEGORICAL
+            },
+            "numeric": {
+                column: np.sort(group[column].to_numpy())
+                for column in df.columns.drop(CATEGORICAL + KEYS + [TARGET])
+            },
+        }
+    return {
+        "columns": df.columns.tolist(),
+        "integer": df.select_dtypes("int").columns.tolist(),
+        "area_codes": _categories(df["Area Code"], n_area_codes, "A"),
+        "classes": classes,
+    }
+
+
+def generate(profile: Dict, rows: int, rng: np.random.Generator, start: int = 0):
+    """Draw synthetic rows
+
+    :param profile: output of `fit_profile`
+    :type profile: Dict
+    :param rows: number of rows
+    :type rows: int
+    :param rng: random generator
+    :type rng: np.random.Generator
+    :param start: row number of the first row, sets the phone numbers
+    , defaults to 0
+    :type start: int, optional
+    :return: rows with the columns of the source
+    :rtype: pd.DataFrame
+    """
+    labels = list(profile["classes"])
+    rates = [profile["classes"][label]["rate"] for label in labels]
+    target = rng.choice(len(labels), size=rows, p=rates)
+    columns = {TARGET: np.asarray(labels, dtype=object)[target]}
+
+    for i, label in enumerate(labels):
+        rows_in_class = np.flatnonzero(target == i)
+        n = len(rows_in_class)
+        stats = profile["classes"][label]
+        for column, (values, weights) in stats["categorical"].items():
+            column_values = columns.setdefault(column, np.empty(rows, dtype=object))
+            column_values[rows_in_class] = values[rng.choice(len(values), n, p=weights)]
+        for column, values in stats["numeric"].items():
+            if column in profile["integer"]:
+                drawn = values[rng.integers(0, len(values), n)]
+            else:
+                # inverse transform sampling of the empirical distribution
+                drawn = np.interp(
+                    rng.random(n) * (len(values) - 1), np.arange(len(values)), values
+                )
+            columns.setdefault(column, np.empty(rows, dtype=values.dtype))
+            columns[column][rows_in_class] = drawn
+
+    codes, weights = profile["area_codes"]
+    columns["Area Code"] = codes[rng.choice(len(codes), rows, p=weights)]
+    phones = (np.arange(start, start + rows, dtype=np.int64) * PHONE_STRIDE) % PHONES
+    columns["Phone"] = [f"{p // 10_000:03d}-{p % 10_000:04d}" for p in phones]
+    return pd.DataFrame(columns)[profile["columns"]]
+
+
+def write_churn(
+    path: str,
+    rows: int,
+    chunksize: int = CHUNKSIZE,
+    random_state: Optional[int] = None,
+    n_states: Optional[int] = None,
+    n_area_codes: Optional[int] = None,
+) -> str:
+    """Write synthetic churn rows to a CSV, one chunk at a time
+
+    :param path: output CSV path
+    :type path: str
+    :param rows: number of rows
+    :type rows: int
+    :param chunksize: rows generated and written at a time
+    , defaults to 1000000
+    :type chunksize: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :param n_states: number of states, defaults to the source's
+    :type n_states: int, optional
+    :param n_area_codes: number of area codes, defaults to the source's
+    :type n_area_codes: int, optional
+    :return: `path`
+    :rtype: str
+    """
+    profile = fit_profile(n_states=n_states, n_area_codes=n_area_codes)
+    starts = range(0, rows, chunksize)
+    seeds = np.random.SeedSequence(random_state).spawn(len(starts))
+    for start, seed in zip(starts, seeds):
+        chunk = generate(
+            profile, min(chunksize, rows - start), np.random.default_rng(seed), start
+        )
+        chunk.to_csv(path, index=False, header=start == 0, mode="a" if start else "w")
+    return path
+
+
+def main(args):
+    start = time.perf_counter()
+    write_churn(
+        args.output,
+        args.rows,
+        chunksize=args.chunksize,
+        random_state=args.random_state,
+        n_states=args.n_states,
+        n_area_codes=args.n_area_codes,
+    )
+    seconds = time.perf_counter() - start
+    print(f"Wrote {args.rows} rows to {args.output} in {seconds:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--n-states", type=int, default=None)
+    parser.add_argument("--n-area-codes", type=int, default=None)
+    parser.add_argument("--random-state", type=int, default=123)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,336 @@
+"""
+Bootstrap confidence intervals for the evaluation metrics.
+
+Resamples are drawn as matrices of row indices, a block of resamples at a
+time, and the blocks are spread over a process pool. Every block draws from
+its own child of one `SeedSequence`, so the intervals only depend on the
+seed, not on the number of workers.
+
+ROC AUC is computed for a whole block at once: the rows are sorted by score
+once, each resample becomes a row of bootstrap counts, and the Mann-Whitney
+statistic follows from cumulative sums over the tied score groups.
+
+The IPCW concordance index is computed the same way. The censoring weights,
+the risk ranks and the order of the rows by time are computed once, and the
+sweep of `survival_metrics.concordance_index_ipcw` runs once per block, with
+a Fenwick tree that holds the bootstrap counts of every resample of the
+block.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from survival_metrics import TIED_TOL, _risk_ranks, censoring_survival
+
+RESAMPLES = 1000
+CONFIDENCE = 0.95
+# resampled indices drawn at a time, bounds the memory of a block
+BLOCK_ELEMENTS = 1 << 22
+
+_shared: dict = {}
+
+
+def _blocks(
+    n_rows: int, n_resamples: int, random_state: Optional[int]
+) -> List[Tuple[np.random.SeedSequence, int]]:
+    """Seeds and sizes of the blocks of resamples"""
+    block_size = max(1, min(n_resamples, BLOCK_ELEMENTS // max(n_rows, 1)))
+    sizes = [
+        min(block_size, n_resamples - start)
+        for start in range(0, n_resamples, block_size)
+    ]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    return list(zip(seeds, sizes))
+
+
+def _index_matrix(seed: np.random.SeedSequence, size: int, n_rows: int) -> np.ndarray:
+    """`size` resamples of `n_rows` row indices drawn with replacement"""
+    dtype = np.int32 if n_rows < 2**31 else np.int64
+    return np.random.default_rng(seed).integers(0, n_rows, (size, n_rows), dtype=dtype)
+
+
+def _init_worker(state: dict):
+    _shared.update(state)
+
+
+def _run(
+    task: Callable, state: dict, blocks: list, n_jobs: Optional[int]
+) -> np.ndarray:
+    """Run `task` over every block in a process pool sharing `state`"""
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(blocks) == 1:
+        _init_worker(state)
+        results = [task(block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(blocks)),
+            initializer=_init_worker,
+            initargs=(state,),
+        ) as executor:
+            results = list(executor.map(task, blocks))
+    return np.concatenate(results)
+
+
+def _auc_block(block: Tuple[np.random.SeedSequence, int]) -> np.ndarray:
+    seed, size = block
+    positive, starts = _shared["positive"], _shared["starts"]
+    n_rows = len(positive)
+    index = _index_matrix(seed, size, n_rows)
+    # bootstrap count of every row, one resample per matrix row
+    offsets = np.arange(size, dtype=np.int64)[:, None] * n_rows
+    counts = np.bincount((index + offsets).ravel(), minlength=size * n_rows)
+    counts = counts.reshape(size, n_rows)
+    del index
+    # positives and negatives in every group of tied scores, lowest first
+    pos = np.add.reduceat(np.where(positive, counts, 0), starts, axis=1)
+    neg = np.add.reduceat(np.where(positive, 0, counts), starts, axis=1)
+    neg_below = np.cumsum(neg, axis=1) - neg
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (pos * (neg_below + 0.5 * neg)).sum(axis=1) / (
+            pos.sum(axis=1).astype(np.float64) * neg.sum(axis=1)
+        )
+
+
+def bootstrap_auc(
+    y_true,
+    scores,
+    n_resamples: int = RESAMPLES,
+    random_state: Optional[int] = None,
+    n_jobs: Optional[int] = None,
+) -> np.ndarray:
+    """ROC AUC of every bootstrap resample of the rows
+
+    :param y_true: binary labels, 1 for the positive class
+    :type y_true: array-like
+    :param scores: predicted score of the positive class
+    :type scores: array-like
+    :param n_resamples: number of resamples, defaults to 1000
+    :type n_resamples: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :param n_jobs: worker processes, defaults to the number of CPUs
+    :type n_jobs: int, optional
+    :return: AUC of every resample, NaN where a resample has one class only
+    :rtype: np.ndarray
+    """
+    scores = np.asarray(scores)
+    order = np.argsort(scores, kind="mergesort")
+    scores = scores[order]
+    state = {
+        "positive": np.asarray(y_true)[order].astype(bool),
+        "starts": np.r_[0, np.flatnonzero(np.diff(scores)) + 1],
+    }
+    blocks = _blocks(len(scores), n_resamples, random_state)
+    return _run(_auc_block, state, blocks, n_jobs)
+
+
+def _distinct(positions: np.ndarray, values: np.ndarray):
+    """Distinct positions and the sum of the rows of `values` at each"""
+    order = np.argsort(positions, kind="stable")
+    positions = positions[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(positions)) + 1]
+    return positions[starts], np.add.reduceat(values[order], starts, axis=0)
+
+
+def _tree_add(tree: np.ndarray, positions: np.ndarray, values: np.ndarray):
+    """Add rows of counts, one column per resample, to a Fenwick tree"""
+    while len(positions):
+        positions, values = _distinct(positions, values)
+        tree[positions] += values
+        positions = positions + (positions & -positions)
+        keep = positions < len(tree)
+        positions, values = positions[keep], values[keep]
+
+
+def _tree_build(size: int, positions: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Fenwick tree of rows of counts in one pass, instead of adding each"""
+    tree = np.zeros((size, values.shape[1]), dtype=values.dtype)
+    if len(positions):
+        positions, values = _distinct(positions, values)
+        tree[positions] = values
+    # every node adds into its parent, children before parents
+    step = 1
+    while step < size:
+        nodes = np.arange(step, size - step, 2 * step)
+        tree[nodes + step] += tree[nodes]
+        step *= 2
+    return tree
+
+
+def _tree_prefix(tree: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Counts at positions up to each of `positions`, for every resample"""
+    total = np.zeros((len(positions), tree.shape[1]), dtype=tree.dtype)
+    while positions.any():
+        # the empty node 0 adds nothing once a position is done
+        total += tree[positions]
+        positions = positions & (positions - 1)
+    return total
+
+
+def _cindex_block(block: Tuple[np.random.SeedSequence, int]) -> np.ndarray:
+    seed, size = block
+    order, ranks, event = _shared["order"], _shared["ranks"], _shared["event"]
+    weights, head, bounds = _shared["weights"], _shared["head"], _shared["bounds"]
+    n_rows = len(order)
+    index = _index_matrix(seed, size, n_rows)
+    offsets = np.arange(size, dtype=np.int64)[:, None] * n_rows
+    counts = np.bincount((index + offsets).ravel(), minlength=size * n_rows)
+    del index
+    # bootstrap count of every row in sweep order, one column per resample
+    counts = counts.reshape(size, n_rows).T[order]
+
+    # rows from tau on are observed after every weighted event
+    tree = _tree_build(int(ranks.max(initial=0)) + 1, ranks[:head], counts[:head])
+    inserted = counts[:head].sum(axis=0)
+    numerator = np.zeros(size)
+    denominator = np.zeros(size)
+    events = np.array([], dtype=np.int64)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        # the events of the previous, later, time go in with the rows
+        # censored at this time, which are compared with its events
+        added = np.r_[events, np.flatnonzero(~event[start:end]) + start]
+        _tree_add(tree, ranks[added], counts[added])
+        inserted += counts[added].sum(axis=0)
+        events = np.flatnonzero(event[start:end]) + start
+        if len(events):
+            below = _tree_prefix(tree, ranks[events] - 1)
+            ties = _tree_prefix(tree, ranks[events]) - below
+            weighted = weights[events, None] * counts[events]
+            numerator += (weighted * (below + 0.5 * ties)).sum(axis=0)
+            denominator += weighted.sum(axis=0) * inserted
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def bootstrap_cindex(
+    event_train,
+    time_train,
+    event,
+    time,
+    estimate,
+    tau=None,
+    tied_tol: float = TIED_TOL,
+    n_resamples: int = RESAMPLES,
+    random_state: Optional[int] = None,
+    n_jobs: Optional[int] = None,
+) -> np.ndarray:
+    """IPCW concordance index of every bootstrap resample of the test rows
+
+    Equal to `survival_metrics.concordance_index_ipcw` on every resample,
+    with the censoring distribution estimated once from the training rows.
+
+    :param event_train: training event indicator
+    :type event_train: array-like
+    :param time_train: training times, used for the censoring distribution
+    :type time_train: array-like
+    :param event: test event indicator
+    :type event: array-like
+    :param time: test times
+    :type time: array-like
+    :param estimate: predicted risk, higher for earlier events
+    :type estimate: array-like
+    :param tau: truncation time, defaults to None
+    :type tau: float, optional
+    :param tied_tol: tolerance of tied risks, defaults to 1e-8
+    :type tied_tol: float, optional
+    :param n_resamples: number of resamples, defaults to 1000
+    :type n_resamples: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :param n_jobs: worker processes, defaults to the number of CPUs
+    :type n_jobs: int, optional
+    :return: concordance index of every resample, NaN where a resample has
+     no comparable pair
+    :rtype: np.ndarray
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time)
+    weighted = event if tau is None else event & (time < tau)
+    g = censoring_survival(event_train, time_train, time[weighted])
+    if (g == 0).any():
+        raise ValueError("censoring survival function is zero at one or more times")
+    weights = np.zeros(len(time))
+    weights[weighted] = 1.0 / np.square(g)
+
+    # descending times, rows from tau on first
+    order = np.argsort(-time, kind="mergesort")
+    head = 0 if tau is None else int((time >= tau).sum())
+    swept = time[order][head:]
+    state = {
+        "order": order,
+        "ranks": _risk_ranks(np.asarray(estimate, dtype=np.float64), tied_tol)[order],
+        "event": event[order],
+        "weights": weights[order],
+        "head": head,
+        "bounds": head + np.r_[0, np.flatnonzero(np.diff(swept)) + 1, len(swept)],
+    }
+    blocks = _blocks(len(time), n_resamples, random_state)
+    return _run(_cindex_block, state, blocks, n_jobs)
+
+
+def _metric_block(block: Tuple[np.random.SeedSequence, int]) -> np.ndarray:
+    seed, size = block
+    metric, arrays = _shared["metric"], _shared["arrays"]
+    results = []
+    for index in _index_matrix(seed, size, len(arrays[0])):
+        try:
+            results.append(metric(*(a[index] for a in arrays)))
+        except ValueError:
+            # e.g. a resample without any event
+            results.append(np.nan)
+    return np.asarray(results, dtype=np.float64)
+
+
+def bootstrap_metric(
+    metric: Callable,
+    arrays: Sequence,
+    n_resamples: int = RESAMPLES,
+    random_state: Optional[int] = None,
+    n_jobs: Optional[int] = None,
+) -> np.ndarray:
+    """Any metric of every bootstrap resample of the rows
+
+    :param metric: picklable function of the resampled arrays returning a float
+    :type metric: Callable
+    :param arrays: arrays with one entry per row, resampled together
+    :type arrays: Sequence
+    :param n_resamples: number of resamples, defaults to 1000
+    :type n_resamples: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :param n_jobs: worker processes, defaults to the number of CPUs
+    :type n_jobs: int, optional
+    :return: metric of every resample, NaN where it is undefined
+    :rtype: np.ndarray
+    """
+    arrays = [np.asarray(a) for a in arrays]
+    state = {"metric": metric, "arrays": arrays}
+    blocks = _blocks(len(arrays[0]), n_resamples, random_state)
+    return _run(_metric_block, state, blocks, n_jobs)
+
+
+def confidence_interval(values, confidence: float = CONFIDENCE) -> dict:
+    """Percentile interval of the bootstrap distribution of a metric
+
+    :param values: metric of every resample
+    :type values: array-like
+    :param confidence: coverage of the interval, defaults to 0.95
+    :type confidence: float, optional
+    :return: `lower`, `upper`, `std`, `confidence` and `resamples` used
+    :rtype: dict
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        raise ValueError("The metric is undefined on every resample")
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(values, [alpha, 1 - alpha])
+    return {
+        "lower": float(lower),
+        "upper": float(upper),
+        "std": float(values.std()),
+        "confidence": confidence,
+        "resamples": int(len(values)),
+    }
@@ -0,0 +1,138 @@
+"""
+SHAP values computed from the trained booster with XGBoost's native TreeSHAP.
+
+`booster.predict(..., pred_contribs=True)` returns the exact TreeSHAP
+contribution of every feature plus the bias in the last column, the same
+layout as the `full_shap` tensor the SageMaker Debugger hook saves. Rows are
+scored in batches on all cores, optionally on a sample of rows only, so the
+cost follows the sample size rather than the data set size.
+"""
+
+import logging
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SHAP_SOURCES = ("debugger", "booster")
+# the rows explained by every source, recorded in the evaluation report
+SHAP_ROWS = {"debugger": "train", "booster": "test"}
+BATCH_SIZE = 10_000
+
+
+def sample_rows(
+    n_rows: int, sample_size: Optional[int] = None, random_state: Optional[int] = None
+) -> np.ndarray:
+    """Positions of a uniform sample of rows
+
+    :param n_rows: number of rows to sample from
+    :type n_rows: int
+    :param sample_size: number of rows in the sample, defaults to all rows
+    :type sample_size: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :return: sorted row positions
+    :rtype: np.ndarray
+    """
+    if not sample_size or sample_size >= n_rows:
+        return np.arange(n_rows)
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(n_rows, size=sample_size, replace=False))
+
+
+def iter_contributions(
+    booster, features, batch_size: int = BATCH_SIZE
+) -> Iterator[np.ndarray]:
+    """TreeSHAP values of the rows, one batch at a time
+
+    :param booster: trained XGBoost booster
+    :type booster: xgboost.Booster
+    :param features: dense array or CSR matrix of feature rows
+    :type features: np.ndarray or scipy.sparse.csr_matrix
+    :param batch_size: rows scored at a time, defaults to 10000
+    :type batch_size: int, optional
+    :return: iterator of contribution arrays with the bias as last column
+    :rtype: Iterator[np.ndarray]
+    """
+    import xgboost
+
+    # prediction runs on all cores, on a copy so the cached booster of
+    # `models.load_model` keeps its own setting
+    booster = booster.copy()
+    booster.set_param({"nthread": os.cpu_count() or 1})
+    for start in range(0, features.shape[0], batch_size):
+        batch = xgboost.DMatrix(features[start : start + batch_size])
+        yield booster.predict(batch, pred_contribs=True)
+
+
+def write_contributions(
+    booster, features, path: str, batch_size: int = BATCH_SIZE
+) -> np.ndarray:
+    """Compute TreeSHAP values and write them in the `shap.csv` layout
+
+    :param booster: trained XGBoost booster
+    :type booster: xgboost.Booster
+    :param features: dense array or CSR matrix of feature rows
+    :type features: np.ndarray or scipy.sparse.csr_matrix
+    :param path: output CSV path
+    :type path: str
+    :param batch_size: rows scored at a time, defaults to 10000
+    :type batch_size: int, optional
+    :return: contributions of every row, bias as last column
+    :rtype: np.ndarray
+    """
+    blocks = []
+    rows = 0
+    for block in iter_contributions(booster, features, batch_size=batch_size):
+        pd.DataFrame(block, index=np.arange(rows, rows + len(block))).to_csv(
+            path, header=rows == 0, mode="w" if rows == 0 else "a"
+        )
+        rows += len(block)
+        blocks.append(block)
+    logger.info(f"Computed SHAP values of {rows} rows")
+    if not blocks:
+        return np.empty((0, features.shape[1] + 1), dtype=np.float32)
+    return np.vstack(blocks)
+
+
+def sample_contributions(
+    booster,
+    features,
+    feature_names: List[str],
+    path: str,
+    sample_size: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    random_state: Optional[int] = None,
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """TreeSHAP values of a sample of rows, ready for `shap.summary_plot`
+
+    :param booster: trained XGBoost booster
+    :type booster: xgboost.Booster
+    :param features: dense array or CSR matrix of feature rows
+    :type features: np.ndarray or scipy.sparse.csr_matrix
+    :param feature_names: names of the feature columns
+    :type feature_names: List[str]
+    :param path: output CSV path of the SHAP values
+    :type path: str
+    :param sample_size: rows to explain, defaults to all rows
+    :type sample_size: int, optional
+    :param batch_size: rows scored at a time, defaults to 10000
+    :type batch_size: int, optional
+    :param random_state: random seed of the sample, defaults to None
+    :type random_state: int, optional
+    :return: SHAP values without the bias and the sampled feature rows
+    :rtype: Tuple[np.ndarray, pd.DataFrame]
+    """
+    from scipy import sparse
+
+    index = sample_rows(features.shape[0], sample_size, random_state)
+    sample = features[index]
+    logger.info(f"Computing SHAP values of {len(index)} rows")
+    shap_values = write_contributions(booster, sample, path, batch_size=batch_size)
+    if sparse.issparse(sample):
+        sample = sample.toarray()
+    return shap_values[:, :-1], pd.DataFrame(sample, columns=feature_names)
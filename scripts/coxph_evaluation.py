@@ -2,49 +2,173 @@ import argparse
 import json
 import logging
 import os
-import pickle
-import subprocess
-import sys
-import tarfile
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+from dependencies import ensure_installed
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-
-os.system("conda install -c sebp scikit-survival -y")
-install("xgboost")
-install("smdebug==1.0.5")
-install("shap==0.39.0")
-install("scikit-learn==0.24.1")
-install("matplotlib")
+if __name__ == "__main__":
+    ensure_installed(
+        ["xgboost", "smdebug", "shap", "scikit-learn", "matplotlib", "pyarrow"]
+    )
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import shap
 import xgboost
+from bootstrap import CONFIDENCE, bootstrap_cindex, confidence_interval
+from contributions import (
+    BATCH_SIZE,
+    SHAP_ROWS,
+    SHAP_SOURCES,
+    sample_contributions,
+    sample_rows,
+)
+from features_io import is_libsvm, read_features, read_libsvm
+from metrics import METRICS_FILE, Metrics
+from models import MODEL_CACHE_DIR, MODEL_NAME, load_model
+from shap_plot import (
+    DENSITY_BINS,
+    PLOT_MODES,
+    PLOT_SAMPLE_SIZE,
+    sample_frame,
+    stratified_rows,
+    summary_plot,
+)
 from sklearn.metrics import accuracy_score, classification_report
-from sksurv.datasets import get_x_y
-from sksurv.metrics import brier_score, concordance_index_ipcw
-from smdebug.trials import create_trial
+from survival import survival_frame
+from survival_metrics import (
+    GRID_POINTS,
+    brier_scores,
+    concordance_index_ipcw,
+    survival_report,
+    time_grid,
+)
+
+# the model, the test and train sets and the SHAP tensor load at the same time
+LOAD_WORKERS = 4
+
+
+def read_labelled(path: str, model_future=None):
+    """Features and target of a feature file
+
+    :param path: CSV, Parquet or LibSVM features, target first
+    :type path: str
+    :param model_future: future of the booster, LibSVM features are read as
+     wide as it once it is loaded, defaults to None
+    :type model_future: concurrent.futures.Future, optional
+    :return: features, with the target column unless LibSVM, and target
+    :rtype: Tuple[pd.DataFrame or scipy.sparse.csr_matrix, array-like]
+    """
+    if is_libsvm(path):
+        n_features = None
+        if model_future is not None:
+            # the first feature column is not a model input, see the
+            # predictions in `main`, and trailing all zero columns are only
+            # there when the width is given
+            n_features = model_future.result().num_features() + 1
+        # stays a CSR matrix, XGBoost reads it without densifying
+        return read_libsvm(path, n_features=n_features)
+    X = read_features(path)
+    return X, X.iloc[:, 0]
+
+
+def debugger_values(base_dir: str, shap_output_path: str):
+    """SHAP values of the training rows saved by the SageMaker Debugger hook
+
+    :param base_dir: root of the processing job inputs
+    :type base_dir: str
+    :param shap_output_path: path of the SHAP values CSV
+    :type shap_output_path: str
+    :return: SHAP values of the last complete step
+    :rtype: np.ndarray
+    """
+    from smdebug.trials import create_trial
+
+    latest_job_debugger_artifacts_path = os.path.join(base_dir, "debug", "debug-output")
+    trial = create_trial(latest_job_debugger_artifacts_path)
+
+    shap_values = trial.tensor("full_shap/f0").value(trial.last_complete_step)
+
+    pd.DataFrame(shap_values).to_csv(shap_output_path)
+    return shap_values
+
+
+def debugger_shap(X_train, train_features_data: str, shap_values):
+    """SHAP values of the Debugger hook and the matching feature rows
+
+    :param X_train: training features read for the report
+    :type X_train: pd.DataFrame or scipy.sparse.csr_matrix
+    :param train_features_data: path of the training features
+    :type train_features_data: str
+    :param shap_values: SHAP values from `debugger_values`
+    :type shap_values: np.ndarray
+    :return: SHAP values without the bias and the matching feature rows
+    :rtype: Tuple[np.ndarray, pd.DataFrame]
+    """
+    shap_no_base = shap_values[1:, :-1]
+    if is_libsvm(train_features_data):
+        # LibSVM has no header, the plot needs dense values and falls back
+        # to the f0, f1, ... feature names XGBoost uses
+        X_train, _ = read_libsvm(train_features_data, n_features=shap_no_base.shape[1])
+        X_train = pd.DataFrame(
+            X_train.toarray(), columns=[f"f{i}" for i in range(X_train.shape[1])]
+        )
+    logger.info(f"SHAP values {shap_values.shape}, features {X_train.shape}")
+    return shap_no_base, X_train
+
+
+def debugger_sample(args, X_train, shap_values, event_train, feature_names):
+    """SHAP values of the Debugger hook and a stratified sample of the
+    training rows the model explains, for the density plot
+
+    :param args: script arguments
+    :type args: argparse.Namespace
+    :param X_train: training features read for the report, target first
+    :type X_train: pd.DataFrame or scipy.sparse.csr_matrix
+    :param shap_values: SHAP values from `debugger_values`
+    :type shap_values: np.ndarray
+    :param event_train: event indicator of every training row
+    :type event_train: np.ndarray
+    :param feature_names: names of the model's feature columns
+    :type feature_names: List[str]
+    :return: SHAP values without the bias, the sampled feature rows and
+     their positions
+    :rtype: Tuple[np.ndarray, pd.DataFrame, np.ndarray]
+    """
+    shap_no_base = shap_values[1:, :-1]
+    rows = stratified_rows(
+        event_train[: len(shap_no_base)], args.plot_sample_size, args.random_state
+    )
+    if isinstance(X_train, pd.DataFrame):
+        sample = X_train.iloc[rows, 1:].values
+    else:
+        # only the sampled rows are densified
+        sample = X_train[rows][:, 1:].toarray()
+    logger.info(f"SHAP values {shap_values.shape}, features {sample.shape}")
+    return shap_no_base, pd.DataFrame(sample, columns=feature_names), rows
 
 
 def main(args):
     """
     Runs evaluation for the data set
-        1. Loads model from tar.gz
-        2. Reads in test features
+        1. Loads model from tar.gz, extracted once per archive, and reads
+        in test features concurrently, while the training features and
+        Debugger tensor load in the background
+        2. Scores the test features as soon as they and the model are loaded
         3. Runs an accuracy report
-        4. Generates feature importance with SHAP
+        4. Generates feature importance with SHAP, from the Debugger tensor
+        of the training job or computed from the booster on test rows, and
+        plots it as a beeswarm or as histograms colored by a sample of rows
 
     Args:
         model-name (str): Name of the trained model, default xgboost
+        model-cache-dir (str): Directory the model archive is extracted
+        into, keyed by its content hash, default MODEL_CACHE_DIR or a
+        temporary directory
         test-features (str): preprocessed test features for
-         evaluation, default test_features.csv
+         evaluation, csv, parquet or libsvm, default test_features.csv
         train-features (str): preproceed train features for SHAP,
         default train_features.csv
         test-features (str): preproceed test features for SHAP,
@@ -57,92 +181,168 @@ def main(args):
         , default 0.5
         tau (int): time range for the c-index will be from 0 to tau
         , default 100
+        shap-source (str): debugger reads the SHAP values the training job
+        saved, booster computes them with TreeSHAP, default debugger
+        shap-sample-size (int): Test rows SHAP values are computed for with
+        the booster, default None uses every row
+        shap-batch-size (int): Rows scored at a time, default 10000
+        plot-mode (str): beeswarm plots every SHAP value, density plots
+        their histograms per feature colored by a sample of feature rows
+        stratified by event, default beeswarm
+        plot-sample-size (int): Feature rows sampled to color the density
+        plot, default 10000
+        plot-bins (int): Bins per feature of the density plot, default 50
+        bootstrap-resamples (int): Resamples of the concordance index
+        confidence interval, e.g. 1000, default 0 skips it
+        confidence (float): Coverage of the confidence interval, default 0.95
+        grid-points (int): Time points of the time-dependent AUC and Brier
+        score, 0 skips them, default 20
+        random-state (int): Random seed of the bootstrap and the SHAP sample
+        , default 123
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
+
+    The time, CPU and peak memory of every phase are written to
+    `evaluation/metrics.json`, next to the evaluation report.
     """
 
-    model_path = os.path.join("/opt/ml/processing/model", "model.tar.gz")
-
-    logger.info(f"Extracting model from path: {model_path}")
-
-    with tarfile.open(model_path) as tar:
-        tar.extractall(path=".")
-    logger.info("Loading model")
-    with open(args.model_name, "rb") as f:
-        model = pickle.load(f)
-
-    logger.info("Loading train and test data")
-
-    test_features_data = os.path.join("/opt/ml/processing/test", args.test_features)
-    train_features_data = os.path.join("/opt/ml/processing/train", args.train_features)
-
-    X_test = pd.read_csv(test_features_data, header=0)
-    X_train = pd.read_csv(train_features_data, header=0)
-
-    y_test = X_test.iloc[:, 0]
-    y_train = X_train.iloc[:, 0]
-
-    # Reverse transfrom to event and duration columns
-    y_test_df = pd.DataFrame(
-        np.vstack((np.where(y_test > 0, 1, 0), np.abs(y_test))).T,
-        columns=["event", "duration"],
+    model_path = os.path.join(args.base_dir, "model", "model.tar.gz")
+    metrics = Metrics(
+        os.path.join(args.base_dir, "evaluation", METRICS_FILE),
+        profile_span=args.profile_span,
     )
 
-    y_train_df = pd.DataFrame(
-        np.vstack((np.where(y_train > 0, 1, 0), np.abs(y_train))).T,
-        columns=["event", "duration"],
+    test_features_data = os.path.join(args.base_dir, "test", args.test_features)
+    train_features_data = os.path.join(args.base_dir, "train", args.train_features)
+    shap_output_path = os.path.join(args.base_dir, "evaluation", args.shap_name)
+    libsvm = is_libsvm(test_features_data)
+
+    logger.info(f"Loading model from path: {model_path}, train and test data")
+    executor = ThreadPoolExecutor(max_workers=LOAD_WORKERS)
+    model_future = executor.submit(
+        load_model, model_path, args.model_name, cache_dir=args.model_cache_dir
     )
+    test_future = executor.submit(read_labelled, test_features_data, model_future)
+    # only needed for the concordance index and SHAP, after the predictions
+    train_future = executor.submit(read_labelled, train_features_data, model_future)
+    shap_future = None
+    if args.shap_source == "debugger":
+        shap_future = executor.submit(debugger_values, args.base_dir, shap_output_path)
+    executor.shutdown(wait=False)
+
+    with metrics.span("load") as span:
+        model = model_future.result()
+        X_test, y_test = test_future.result()
+        if libsvm:
+            test_feature_names = [f"f{i}" for i in range(X_test.shape[1])]
+        else:
+            X_test.drop(X_test.columns[0], axis=1, inplace=True)
+            test_feature_names = X_test.columns.tolist()
+            X_test = X_test.values
+        span["rows"] = X_test.shape[0]
 
-    X_test.drop(X_test.columns[0], axis=1, inplace=True)
-    X_train.drop(X_test.columns[0], axis=1, inplace=True)
+    # Reverse transfrom to event and duration columns
+    y_test_df = survival_frame(y_test)
 
     logger.info("Running inference")
 
-    predictions = model.predict(
-        xgboost.DMatrix(X_test.values[:, 1:]), output_margin=False
-    )
+    with metrics.span("predict", rows=X_test.shape[0]):
+        predictions = model.predict(xgboost.DMatrix(X_test[:, 1:]), output_margin=False)
 
     logger.info("Creating evaluation report")
 
     # NOTE: technical evaluation is really not as a classifier
     # TO DO: Normalize to 0 to 1 scale
-    report_dict = classification_report(
-        y_test_df["event"], predictions > args.threshold, output_dict=True
-    )
-    report_dict["accuracy"] = accuracy_score(
-        y_test_df["event"], predictions > args.threshold
-    )
-
-    _, y_train_tuple = get_x_y(y_train_df, ["event", "duration"], pos_label=True)
-    _, y_test_tuple = get_x_y(y_test_df, ["event", "duration"], pos_label=True)
-
-    concordance_index = concordance_index_ipcw(
-        y_train_tuple,
-        y_test_tuple,
-        predictions,
-        tau=args.tau,  # default within 100 days
-    )
-
-    report_dict["concordance_index"] = {
-        "cindex": float(concordance_index[0]),
-        "concordant": int(concordance_index[1]),
-        "discordant": int(concordance_index[2]),
-        "tied_risk": int(concordance_index[3]),
-        "tied_time": int(concordance_index[4]),
-    }
-
-    times, score = brier_score(
-        y_train_tuple, y_test_tuple, predictions, y_test_df["duration"].max() - 1
-    )
-
-    report_dict["brier_score"] = {
-        "times": times.astype(np.int32).tolist(),
-        "score": score.astype(np.float32).tolist(),
-    }
+    with metrics.span("report", rows=len(predictions)):
+        report_dict = classification_report(
+            y_test_df["event"], predictions > args.threshold, output_dict=True
+        )
+        report_dict["accuracy"] = accuracy_score(
+            y_test_df["event"], predictions > args.threshold
+        )
+        report_dict["shap_rows"] = SHAP_ROWS[args.shap_source]
+
+    with metrics.span("load_train") as span:
+        X_train, y_train = train_future.result()
+        if not libsvm:
+            # the column the test features lost above, as the model expects
+            X_train.drop(test_feature_names[0], axis=1, inplace=True)
+        span["rows"] = X_train.shape[0]
+    y_train_df = survival_frame(y_train)
+
+    event_train = y_train_df["event"].values
+    time_train = y_train_df["duration"].values
+    event_test = y_test_df["event"].values
+    time_test = y_test_df["duration"].values
+
+    with metrics.span("concordance_index", rows=len(predictions)):
+        concordance_index = concordance_index_ipcw(
+            event_train,
+            time_train,
+            event_test,
+            time_test,
+            predictions,
+            tau=args.tau,  # default within 100 days
+        )
+
+        report_dict["concordance_index"] = {
+            "cindex": float(concordance_index[0]),
+            "concordant": int(concordance_index[1]),
+            "discordant": int(concordance_index[2]),
+            "tied_risk": int(concordance_index[3]),
+            "tied_time": int(concordance_index[4]),
+        }
+    if args.bootstrap_resamples:
+        logger.info(
+            f"Bootstrapping concordance index over {args.bootstrap_resamples} resamples"
+        )
+        with metrics.span("bootstrap", rows=len(predictions)):
+            report_dict["concordance_index"]["interval"] = confidence_interval(
+                bootstrap_cindex(
+                    event_train,
+                    time_train,
+                    event_test,
+                    time_test,
+                    predictions,
+                    tau=args.tau,
+                    n_resamples=args.bootstrap_resamples,
+                    random_state=args.random_state,
+                ),
+                confidence=args.confidence,
+            )
+
+    with metrics.span("brier_score", rows=len(predictions)):
+        times = np.array([time_test.max() - 1])
+        score = brier_scores(
+            event_train, time_train, event_test, time_test, predictions[:, None], times
+        )
+
+        report_dict["brier_score"] = {
+            "times": times.astype(np.int32).tolist(),
+            "score": score.astype(np.float32).tolist(),
+        }
+
+    if args.grid_points:
+        logger.info(f"Evaluating AUC and Brier score at {args.grid_points} times")
+        # the training rows without the target, as the test predictions above
+        X_train_values = X_train if is_libsvm(train_features_data) else X_train.values
+        with metrics.span("time_dependent", rows=len(predictions)):
+            train_predictions = model.predict(xgboost.DMatrix(X_train_values[:, 1:]))
+            report_dict["time_dependent"] = survival_report(
+                event_train,
+                time_train,
+                train_predictions,
+                event_test,
+                time_test,
+                predictions,
+                time_grid(time_test, args.grid_points),
+            )
 
     logger.info(f"Classification report:\n{report_dict}")
 
-    evaluation_output_path = os.path.join(
-        "/opt/ml/processing/evaluation", args.report_name
-    )
+    evaluation_output_path = os.path.join(args.base_dir, "evaluation", args.report_name)
     logger.info(f"Saving classification report to {evaluation_output_path}")
 
     logger.debug(report_dict)
@@ -151,35 +351,122 @@ def main(args):
         f.write(json.dumps(report_dict))
 
     # SHAP
-    latest_job_debugger_artifacts_path = "/opt/ml/processing/debug/debug-output"
-    trial = create_trial(latest_job_debugger_artifacts_path)
-
-    shap_values = trial.tensor("full_shap/f0").value(trial.last_complete_step)
-
-    pd.DataFrame(shap_values).to_csv(
-        os.path.join("/opt/ml/processing/evaluation", args.shap_name)
-    )
-
-    shap_no_base = shap_values[1:, :-1]
-    feature_names = X_train.columns
-    os.makedirs("/opt/ml/processing/plot/", exist_ok=True)
-    logger.info(shap_values.shape, shap_no_base.shape, X_train.shape)
-    shap.summary_plot(
-        shap_no_base, features=X_train, feature_names=feature_names, show=False
-    )
-    plt.savefig("/opt/ml/processing/plot/feature_importance.png", bbox_inches="tight")
+    with metrics.span("shap") as span:
+        rows = None
+        if shap_future is not None and args.plot_mode == "density":
+            shap_no_base, X_shap, rows = debugger_sample(
+                args,
+                X_train,
+                shap_future.result(),
+                event_train,
+                test_feature_names[1:],
+            )
+        elif shap_future is not None:
+            shap_no_base, X_shap = debugger_shap(
+                X_train, train_features_data, shap_future.result()
+            )
+        else:
+            # explain the same columns the predictions above are made from
+            shap_no_base, X_shap = sample_contributions(
+                model,
+                X_test[:, 1:],
+                test_feature_names[1:],
+                shap_output_path,
+                sample_size=args.shap_sample_size,
+                batch_size=args.shap_batch_size,
+                random_state=args.random_state,
+            )
+            if args.plot_mode == "density":
+                # the same test rows sample_contributions explained
+                explained = sample_rows(
+                    X_test.shape[0], args.shap_sample_size, args.random_state
+                )
+                rows, X_shap = sample_frame(
+                    X_shap,
+                    event_test[explained],
+                    sample_size=args.plot_sample_size,
+                    random_state=args.random_state,
+                )
+        span["rows"] = len(shap_no_base)
+
+    os.makedirs(os.path.join(args.base_dir, "plot"), exist_ok=True)
+    with metrics.span("plot", rows=len(shap_no_base)) as span:
+        span["sampled"] = len(X_shap)
+        summary_plot(
+            shap_no_base,
+            X_shap,
+            os.path.join(args.base_dir, "plot", "feature_importance.png"),
+            mode=args.plot_mode,
+            rows=rows,
+            bins=args.plot_bins,
+        )
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--model-name", type=str, default="xgboost-model")
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME)
+    parser.add_argument(
+        "--model-cache-dir",
+        type=str,
+        default=MODEL_CACHE_DIR,
+        help="Directory the model archive is extracted into once",
+    )
     parser.add_argument("--test-features", type=str, default="test_features.csv")
     parser.add_argument("--train-features", type=str, default="train_features.csv")
     parser.add_argument("--report-name", type=str, default="evaluation.json")
     parser.add_argument("--shap-name", type=str, default="shap.csv")
     parser.add_argument("--threshold", type=float, default=0.5)
     parser.add_argument("--tau", type=int, default=100)
+    parser.add_argument(
+        "--grid-points",
+        type=int,
+        default=GRID_POINTS,
+        help="Evaluate the time-dependent AUC and Brier score at this many times",
+    )
+    parser.add_argument(
+        "--shap-source",
+        type=str,
+        default="debugger",
+        choices=SHAP_SOURCES,
+        help="Read SHAP values from the Debugger output or compute them",
+    )
+    parser.add_argument(
+        "--shap-sample-size",
+        type=int,
+        default=None,
+        help="Compute SHAP values of a sample of this many test rows",
+    )
+    parser.add_argument("--shap-batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--plot-mode",
+        type=str,
+        default="beeswarm",
+        choices=PLOT_MODES,
+        help="Plot every SHAP value or their histograms colored by a sample",
+    )
+    parser.add_argument(
+        "--plot-sample-size",
+        type=int,
+        default=PLOT_SAMPLE_SIZE,
+        help="Feature rows read to color the density plot",
+    )
+    parser.add_argument("--plot-bins", type=int, default=DENSITY_BINS)
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=0,
+        help="Resamples of the confidence interval, e.g. 1000, 0 skips it",
+    )
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
     args = parser.parse_args()
 
     main(args)
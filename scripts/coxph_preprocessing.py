@@ -1,37 +1,46 @@
 import argparse
 import logging
 import os
-import subprocess
-import sys
 import warnings
 
+from dependencies import ensure_installed
 
-def install(package):
-    subprocess.check_call(
-        [sys.executable, "-m", "pip", "install", package]
-        # quietly
-        ,
-        stdout=open(os.devnull, "wb"),
+if __name__ == "__main__":
+    ensure_installed(
+        ["scikit-learn", "awswrangler", "pyarrow", "hdbscan", "Amazon-DenseClus"]
     )
 
-
-install("scikit-learn==0.24.1")
-install("awswrangler==2.4.0")
-os.system("conda install -c conda-forge hdbscan -y")
-install("Amazon-DenseClus==0.0.7")
-
-import awswrangler as wr
-import boto3
 import joblib
 import numpy as np
 import pandas as pd
-from denseclus import DenseClus
-from sklearn.compose import ColumnTransformer
+from compiled_transform import (
+    CompiledTransform,
+    export_transform,
+    transform_with_target,
+)
+from data_cache import (
+    DATA_CACHE,
+    DATA_CACHE_MAX_BYTES,
+    cache_key,
+    cached_frame,
+    code_digest,
+    open_cache,
+)
+from features_io import (
+    OUTPUT_FORMATS,
+    SPARSE_FORMATS,
+    features_path,
+    prepend_target,
+    write_features,
+)
+from metrics import METRICS_FILE, Metrics
+from preprocessing import build_preprocessor
+from segments import CLUSTERER_FILE, cluster_segments
 from sklearn.exceptions import DataConversionWarning
-from sklearn.impute import SimpleImputer
 from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sources import apply_schema, compact_types, read_table, source_fingerprint
+from splits import SPLIT_COLUMN, SPLIT_MODES, hash_split, key_fractions
+from survival import encode_survival_target
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -69,16 +78,73 @@ class_labels = ["True.", "False."]
 
 def survival_y_cox(dframe):
     """Returns array of outcome encoded for XGB"""
-    y_survival = []
+    return encode_survival_target(dframe["event"].values, dframe["duration"].values)
+
+
+def clean_table(args, metrics: Metrics) -> pd.DataFrame:
+    """Read the source table, clean it and assign its rows to segments
+
+    Saves the fitted segment assigner with the transformers when clustering.
+
+    :param args: parsed script arguments
+    :param metrics: spans of the script
+    :type metrics: Metrics
+    :return: cleaned rows with the event and duration columns
+    :rtype: pd.DataFrame
+    """
+    logger.info("Querying Athena...")
+    with metrics.span("read") as span:
+        df = read_table(
+            args.database,
+            args.table,
+            args.region,
+            source_path=args.source_path,
+            dtype=compact_types(col_type) if args.compact_dtypes else None,
+        )
+        span["rows"] = len(df)
+    with metrics.span("clean") as span:
+        df = apply_schema(df, col_type, compact=args.compact_dtypes)
+        logger.info(df.dtypes)
+        fractions = None
+        if args.split == "hash":
+            fractions = pd.Series(key_fractions(df), index=df.index)
+
+        df["event"] = np.where(df["churn?"] == "False.", 0, 1).astype(
+            np.int8 if args.compact_dtypes else np.int64
+        )
+        del df["churn?"]
+        df = df.rename(columns={"account length": "duration"})
+
+        df = df.drop(["area code", "phone"], 1)
+        df = df.dropna()
+        df = df.drop_duplicates()
+        span["rows"] = len(df)
+
+    # no fit predict method currently supported for DenseClus
+    # See: https://github.com/awslabs/amazon-denseclus/issues/4
+    # rows outside the clustered sample are labelled by the SegmentAssigner
+    if args.cluster:
 
-    for idx, row in dframe[["duration", "event"]].iterrows():
-        if row["event"]:
-            # uncensored
-            y_survival.append(int(row["duration"]))
-        else:
-            # right censored
-            y_survival.append(-int(row["duration"]))
-    return np.array(y_survival)
+        logger.info("Clustering data")
+        with metrics.span("cluster", rows=len(df)):
+            segments, assigner = cluster_segments(
+                df,
+                assign_columns=df.columns.drop(["event", "duration"]).tolist(),
+                sample_size=args.cluster_sample_size,
+                stratify="event",
+                random_state=int(args.random_state),
+            )
+        logger.info("Clusters fit")
+
+        joblib.dump(
+            assigner, os.path.join(args.base_dir, "transformer", CLUSTERER_FILE)
+        )
+
+        df["segments"] = segments
+    # added after clustering, which fits on every column
+    if fractions is not None:
+        df[SPLIT_COLUMN] = fractions.loc[df.index].values
+    return df
 
 
 def main(args):
@@ -97,26 +163,66 @@ def main(args):
         , default is 25%
         random-state (float): Random seed used for train and test split
         , default is 123
+        split (str): random shuffles the rows with random-state, hash puts
+        every customer on the side its hashed area code and phone falls on,
+        stable as rows are added, see `splits.py`, default random
+        cluster-sample-size (int): Fit DenseClus on a stratified sample of
+        this many rows and assign the rest, default None fits on all rows
+        output-format (str): Format of the feature files, csv, parquet or
+        libsvm, default csv
+        source-path (str): Local CSV/Parquet file or directory read instead
+        of Athena, default None
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        compact-dtypes (bool): Parse the source into float32, categorical and
+        the smallest integer columns and write float32 features into a
+        matrix allocated with the target column, default False
+        data-cache (str): Local directory or S3 prefix caching the cleaned
+        and segmented rows by source snapshot, schema and arguments, see
+        `data_cache.py`, default the DATA_CACHE environment variable or no
+        cache
+        data-cache-max-bytes (int): Size the cache is bounded to by evicting
+        the least recently used entries, default 20 GiB
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
+
+    The time, CPU and peak memory of every phase are written to
+    `transformer/metrics.json`.
     """
     logger.debug(f"Received arguments {args}")
-    DATABASE, TABLE, REGION = args.database, args.table, args.region
-
-    logger.info("Querying Athena...")
-    boto3.setup_default_session(region_name=f"{REGION}")
-    df = wr.athena.read_sql_query(
-        f'SELECT * FROM "{TABLE}"', database=DATABASE, ctas_approach=False
+    metrics = Metrics(
+        os.path.join(args.base_dir, "transformer", METRICS_FILE),
+        profile_span=args.profile_span,
     )
-    df = df[columns]
-    df = df.astype(col_type)
-    logger.info(df.dtypes)
-
-    df["event"] = np.where(df["churn?"] == "False.", 0, 1)
-    del df["churn?"]
-    df = df.rename(columns={"account length": "duration"})
 
-    df = df.drop(["area code", "phone"], 1)
-    df = df.dropna()
-    df = df.drop_duplicates()
+    cache = open_cache(args.data_cache, args.data_cache_max_bytes)
+    key = None
+    if cache is not None:
+        with metrics.span("fingerprint"):
+            key = cache_key(
+                "coxph_preprocessing",
+                source_fingerprint(
+                    args.database, args.table, args.region, args.source_path
+                ),
+                col_type,
+                code=code_digest(
+                    "coxph_preprocessing", "sources", "segments", "splits", "row_index"
+                ),
+                compact_dtypes=args.compact_dtypes,
+                cluster=args.cluster,
+                cluster_sample_size=args.cluster_sample_size,
+                random_state=args.random_state,
+                split=args.split,
+            )
+    clusterer_path = os.path.join(args.base_dir, "transformer", CLUSTERER_FILE)
+    with metrics.span("source") as span:
+        df = cached_frame(
+            cache,
+            key,
+            lambda: clean_table(args, metrics),
+            files=[clusterer_path] if args.cluster else [],
+        )
+        span["rows"] = len(df)
 
     negative_examples, positive_examples = df["event"].value_counts().values
     print(
@@ -125,26 +231,25 @@ def main(args):
             df.shape, positive_examples, negative_examples
         )
     )
-    # no fit predict method currently supported for DenseClus
-    # See: https://github.com/awslabs/amazon-denseclus/issues/4
-    if args.cluster:
-
-        logger.info("Clustering data")
-        clf = DenseClus()
-        clf.fit(df)
-        logger.info("Clusters fit")
-
-        df["segments"] = clf.score()
-        df["segments"] = df["segments"].astype(str)
 
+    fractions = df.pop(SPLIT_COLUMN).values if args.split == "hash" else None
     y = survival_y_cox(df)
     X = df.drop(["event", "duration"], 1)
 
     logger.info(f"Splitting training and validation by{args.train_test_split_ratio}")
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=args.train_test_split_ratio, random_state=args.random_state
-    )
+    if fractions is not None:
+        X_train, X_test, y_train, y_test = hash_split(
+            X,
+            y,
+            fractions=fractions,
+            test_size=args.train_test_split_ratio,
+            log_classes=df["event"],
+        )
+    else:
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=args.train_test_split_ratio, random_state=args.random_state
+        )
 
     logger.info(X_train.dtypes)
 
@@ -152,40 +257,38 @@ def main(args):
         exclude=["object", "category"]
     ).columns.tolist()
 
-    categorical_idx = X_train.select_dtypes(exclude=["float", "int"]).columns.tolist()
-
-    numeric_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="median")),
-            ("scaler", StandardScaler()),
-        ]
-    )
-
-    categorical_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-            ("onehot", OneHotEncoder(sparse=False, handle_unknown="ignore")),
-        ]
-    )
+    categorical_idx = X_train.select_dtypes(exclude="number").columns.tolist()
 
-    preprocessor = ColumnTransformer(
-        [
-            ("numerical", numeric_transformer, numerical_idx),
-            ("categorical", categorical_transformer, categorical_idx),
-        ],
-        remainder="passthrough",
+    # libsvm keeps the one hot columns sparse end to end
+    sparse = args.output_format in SPARSE_FORMATS
+    preprocessor = build_preprocessor(
+        numerical_idx,
+        categorical_idx,
+        sparse=sparse,
+        dtype=np.float32 if args.compact_dtypes else np.float64,
     )
 
     logger.info("Running preprocessing and feature engineering transformations")
-    train_features = preprocessor.fit_transform(X_train)
-    test_features = preprocessor.transform(X_test)
-
-    logger.info(f"train features size {train_features.shape}")
-    logger.info(f"test features size {test_features.shape}")
-
-    # adding back the target as the first columan for XGB
-    train_features = np.hstack((y_train.reshape(-1, 1), train_features))
-    test_features = np.hstack((y_test.reshape(-1, 1), test_features))
+    if args.compact_dtypes and not sparse:
+        # the compiled preprocessor writes float32 features straight after
+        # the target, the first column for XGB
+        with metrics.span("fit", rows=len(X_train)):
+            compiled = CompiledTransform.from_preprocessor(preprocessor.fit(X_train))
+        with metrics.span("transform", rows=len(X_train) + len(X_test)):
+            train_features = transform_with_target(compiled, X_train, y_train)
+            test_features = transform_with_target(compiled, X_test, y_test)
+    else:
+        with metrics.span("fit_transform", rows=len(X_train)):
+            train_features = preprocessor.fit_transform(X_train)
+        with metrics.span("transform", rows=len(X_test)):
+            test_features = preprocessor.transform(X_test)
+
+        # adding back the target as the first columan for XGB
+        train_features = prepend_target(y_train, train_features)
+        test_features = prepend_target(y_test, test_features)
+
+    logger.info(f"train features size with the target {train_features.shape}")
+    logger.info(f"test features size with the target {test_features.shape}")
 
     # getting the feature names
     feature_names = (
@@ -196,28 +299,35 @@ def main(args):
     feature_names = ["target"] + feature_names
 
     preprocessor_output_path = os.path.join(
-        "/opt/ml/processing/transformer", "preprocessor.joblib"
+        args.base_dir, "transformer", "preprocessor.joblib"
     )
     joblib.dump(preprocessor, preprocessor_output_path)
+    export_transform(preprocessor, os.path.join(args.base_dir, "transformer"))
 
-    train_features_output_path = os.path.join(
-        "/opt/ml/processing/train", "train_features.csv"
+    train_features_output_path = features_path(
+        os.path.join(args.base_dir, "train"), "train_features", args.output_format
     )
 
-    test_features_output_path = os.path.join(
-        "/opt/ml/processing/test", "test_features.csv"
+    test_features_output_path = features_path(
+        os.path.join(args.base_dir, "test"), "test_features", args.output_format
     )
 
-    logger.info(f"Saving training data to {train_features_output_path}")
-
-    pd.DataFrame(train_features, columns=feature_names).to_csv(
-        train_features_output_path, header=True, index=False
-    )
+    with metrics.span("write", rows=len(y_train) + len(y_test)):
+        logger.info(f"Saving training data to {train_features_output_path}")
+        write_features(
+            train_features_output_path,
+            train_features,
+            feature_names,
+            output_format=args.output_format,
+        )
 
-    logger.info(f"Saving test data to {test_features_output_path}")
-    pd.DataFrame(test_features, columns=feature_names).to_csv(
-        test_features_output_path, header=True, index=False
-    )
+        logger.info(f"Saving test data to {test_features_output_path}")
+        write_features(
+            test_features_output_path,
+            test_features,
+            feature_names,
+            output_format=args.output_format,
+        )
 
 
 if __name__ == "__main__":
@@ -227,12 +337,60 @@ if __name__ == "__main__":
     parser.add_argument("--table", type=str, required=True)
     parser.add_argument("--train-test-split-ratio", type=float, default=0.20)
     parser.add_argument("--random-state", type=float, default=123)
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="random",
+        choices=SPLIT_MODES,
+        help="Split rows at random or by a stable hash of the customer",
+    )
     parser.add_argument(
         "--cluster",
         default=True,
         type=bool,
         help="Run clusters as part of preprocessing",
     )
+    parser.add_argument(
+        "--cluster-sample-size",
+        type=int,
+        default=None,
+        help="Fit the clusters on a stratified sample of this many rows",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="csv",
+        choices=OUTPUT_FORMATS,
+        help="Format of the train and test feature files",
+    )
+    parser.add_argument(
+        "--source-path",
+        type=str,
+        default=None,
+        help="Local CSV/Parquet file or directory to read instead of Athena",
+    )
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument(
+        "--compact-dtypes",
+        default=False,
+        type=bool,
+        help="Hold the data in float32, categorical and small integer columns",
+    )
+    parser.add_argument(
+        "--data-cache",
+        type=str,
+        default=DATA_CACHE,
+        help="Local directory or S3 prefix caching the cleaned rows",
+    )
+    parser.add_argument(
+        "--data-cache-max-bytes", type=int, default=DATA_CACHE_MAX_BYTES
+    )
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
     args = parser.parse_args()
 
     main(args)
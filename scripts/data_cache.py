@@ -0,0 +1,365 @@
+"""
+Content-addressed cache of the cleaned and segmented source data.
+
+The preprocessing scripts read the whole source table, apply the schema, drop
+missing and duplicated rows and often fit DenseClus on every run, even when
+neither the table nor the arguments changed, such as on a retry after a
+downstream failure. With a cache location they instead look the cleaned rows
+up by a key hashed from a fingerprint of the source snapshot
+(`sources.source_fingerprint`), the schema, the arguments that change the
+result and the code of the scripts, and on a hit go straight to splitting and
+transforming.
+
+An entry is a directory of files: the rows as compressed Parquet and the
+outputs written along with them, such as the fitted clusterer. Entries live
+in a local directory, e.g. for offline runs and tests, or under an S3 prefix
+so they outlive the processing job; `open_cache` picks the backend from the
+location. After every write the least recently used entries are evicted until
+the cache fits in `max_bytes`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DATA_CACHE = os.environ.get("DATA_CACHE")
+DATA_CACHE_MAX_BYTES = 20 * 1024**3
+FRAME_FILE = "frame.parquet"
+# the last object written to an S3 entry, an entry without it is incomplete
+COMMIT_FILE = "_COMMITTED"
+
+
+def code_digest(*modules: str) -> str:
+    """SHA-256 over the code of the script modules that produce an entry
+
+    :param modules: names of modules next to this one, e.g. the script and
+     the modules it cleans with
+    :type modules: str
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for module in modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), module)
+        with open(f"{path}.py", "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_key(stage: str, fingerprint: str, col_type: dict, **params) -> str:
+    """Key of the cleaned rows of a stage
+
+    :param stage: name of the script, entries of different scripts differ
+    :type stage: str
+    :param fingerprint: fingerprint of the source snapshot
+    :type fingerprint: str
+    :param col_type: schema the rows were cast to
+    :type col_type: dict
+    :param params: arguments and code digests that change the rows
+    :return: hex digest
+    :rtype: str
+    """
+    payload = {
+        "stage": stage,
+        "source": fingerprint,
+        "schema": col_type,
+        "params": params,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _evict(entries: List[Tuple[str, int, float]], max_bytes: int) -> List[str]:
+    """Keys of the least recently used entries to remove to fit `max_bytes`
+
+    :param entries: key, size in bytes and last use time of every entry
+    :type entries: List[Tuple[str, int, float]]
+    :param max_bytes: size the cache is bounded to
+    :type max_bytes: int
+    :return: keys to remove, oldest first
+    :rtype: List[str]
+    """
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for key, size, _ in sorted(entries, key=lambda entry: entry[2]):
+        if total <= max_bytes:
+            break
+        evicted.append(key)
+        total -= size
+    return evicted
+
+
+class LocalCache:
+    """Cache entries as directories of a local directory
+
+    :param root: cache directory
+    :type root: str
+    :param max_bytes: size the cache is bounded to
+    :type max_bytes: int, optional
+    """
+
+    def __init__(self, root: str, max_bytes: int = DATA_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        """Directory of an entry, marked as just used, or None on a miss"""
+        path = os.path.join(self.root, key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    @contextmanager
+    def put(self, key: str) -> Iterator[str]:
+        """Write an entry
+
+        The entry's files are written into the yielded directory, which
+        becomes the entry only once the block completes, so readers never
+        see a partial entry.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.root, prefix=".staging-")
+        try:
+            yield staging
+            # another process may have written the same entry meanwhile
+            try:
+                os.rename(staging, os.path.join(self.root, key))
+            except OSError:
+                if not os.path.isdir(os.path.join(self.root, key)):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(directory, name))
+                for directory, _, names in os.walk(path)
+                for name in names
+            )
+            entries.append((key, size, os.path.getmtime(path)))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits"""
+        for key in _evict(self._entries(), self.max_bytes):
+            logger.info(f"Evicting cache entry {key}")
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+class S3Cache:
+    """Cache entries as objects under an S3 prefix
+
+    Entries are downloaded into a temporary directory to be read. The last use
+    of an entry is the time its commit object was last written, which a hit
+    rewrites.
+
+    :param uri: `s3://bucket/prefix` of the cache
+    :type uri: str
+    :param max_bytes: size the cache is bounded to
+    :type max_bytes: int, optional
+    """
+
+    def __init__(self, uri: str, max_bytes: int = DATA_CACHE_MAX_BYTES):
+        import boto3
+
+        self.bucket, _, prefix = uri[len("s3://") :].partition("/")
+        self.prefix = prefix.strip("/")
+        self.max_bytes = max_bytes
+        self.s3 = boto3.client("s3")
+
+    def _key(self, *parts: str) -> str:
+        return "/".join(part for part in (self.prefix,) + parts if part)
+
+    def _objects(self, key: str = "") -> Iterator[dict]:
+        prefix = self._key(key) + "/" if self._key(key) else ""
+        pages = self.s3.get_paginator("list_objects_v2").paginate(
+            Bucket=self.bucket, Prefix=prefix
+        )
+        for page in pages:
+            yield from page.get("Contents", [])
+
+    def _commit(self, key: str):
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self._key(key, COMMIT_FILE), Body=b""
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Local copy of an entry, marked as just used, or None on a miss"""
+        objects = list(self._objects(key))
+        names = [obj["Key"].rsplit("/", 1)[-1] for obj in objects]
+        if COMMIT_FILE not in names:
+            return None
+        directory = tempfile.mkdtemp(prefix="churn-data-cache-")
+        for obj, name in zip(objects, names):
+            if name != COMMIT_FILE:
+                self.s3.download_file(
+                    self.bucket, obj["Key"], os.path.join(directory, name)
+                )
+        self._commit(key)
+        return directory
+
+    @contextmanager
+    def put(self, key: str) -> Iterator[str]:
+        """Write an entry from the files written into the yielded directory"""
+        staging = tempfile.mkdtemp(prefix="churn-data-cache-")
+        try:
+            yield staging
+            for name in os.listdir(staging):
+                self.s3.upload_file(
+                    os.path.join(staging, name), self.bucket, self._key(key, name)
+                )
+            self._commit(key)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits"""
+        sizes, used, keys = {}, {}, {}
+        for obj in self._objects():
+            entry, _, name = obj["Key"][len(self._key()) :].strip("/").partition("/")
+            sizes[entry] = sizes.get(entry, 0) + obj["Size"]
+            keys.setdefault(entry, []).append({"Key": obj["Key"]})
+            if name == COMMIT_FILE:
+                used[entry] = obj["LastModified"].timestamp()
+        # entries still being written have no commit object yet
+        entries = [(entry, sizes[entry], used[entry]) for entry in used]
+        for entry in _evict(entries, self.max_bytes):
+            logger.info(f"Evicting cache entry {entry}")
+            objects = keys[entry]
+            for start in range(0, len(objects), 1000):
+                self.s3.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": objects[start : start + 1000]},
+                )
+
+
+def open_cache(location: Optional[str], max_bytes: int = DATA_CACHE_MAX_BYTES):
+    """Cache at a local directory or S3 prefix, None without a location
+
+    :param location: local directory or `s3://bucket/prefix`
+    :type location: str, optional
+    :param max_bytes: size the cache is bounded to
+    :type max_bytes: int, optional
+    :return: cache backend
+    :rtype: LocalCache or S3Cache
+    """
+    if not location:
+        return None
+    if location.startswith("s3://"):
+        return S3Cache(location, max_bytes)
+    return LocalCache(location, max_bytes)
+
+
+def cached_frame(
+    cache, key: str, build: Callable[[], pd.DataFrame], files: Iterable[str] = ()
+) -> pd.DataFrame:
+    """Rows of a cache entry, or built and stored in the cache
+
+    :param cache: cache backend, None builds the rows without caching
+    :type cache: LocalCache or S3Cache
+    :param key: key of the rows, see `cache_key`
+    :type key: str
+    :param build: reads and cleans the rows on a miss
+    :type build: Callable[[], pd.DataFrame]
+    :param files: files `build` writes besides the rows, such as the fitted
+     clusterer, stored with them and restored to their paths on a hit
+    :type files: Iterable[str], optional
+    :return: cleaned rows
+    :rtype: pd.DataFrame
+    """
+    if cache is None:
+        return build()
+    entry = cache.get(key)
+    if entry is not None:
+        logger.info(f"Reading cleaned rows from cache entry {key}")
+        for path in files:
+            cached = os.path.join(entry, os.path.basename(path))
+            if os.path.exists(cached):
+                shutil.copyfile(cached, path)
+        return pd.read_parquet(os.path.join(entry, FRAME_FILE))
+
+    start = time.perf_counter()
+    df = build()
+    logger.info(f"Caching cleaned rows as entry {key}")
+    with cache.put(key) as staging:
+        df.to_parquet(os.path.join(staging, FRAME_FILE))
+        for path in files:
+            if os.path.exists(path):
+                shutil.copyfile(path, os.path.join(staging, os.path.basename(path)))
+    logger.info(f"Built and cached in {time.perf_counter() - start:.1f}s")
+    return df
+
+
+def cached_batches(
+    cache, key: str, build: Callable[[], Iterable[pd.DataFrame]], batch_size: int
+) -> Iterator[pd.DataFrame]:
+    """Batches of rows of a cache entry, or built and stored as they stream
+
+    The entry is only stored once every batch was built, a stream stopped
+    early leaves no entry.
+
+    :param cache: cache backend, None builds the batches without caching
+    :type cache: LocalCache or S3Cache
+    :param key: key of the rows, see `cache_key`
+    :type key: str
+    :param build: reads and cleans the batches on a miss
+    :type build: Callable[[], Iterable[pd.DataFrame]]
+    :param batch_size: rows per batch read from the entry
+    :type batch_size: int
+    :return: iterator of cleaned batches
+    :rtype: Iterator[pd.DataFrame]
+    """
+    if cache is None:
+        yield from build()
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    entry = cache.get(key)
+    if entry is not None:
+        logger.info(f"Reading cleaned batches from cache entry {key}")
+        path = os.path.join(entry, FRAME_FILE)
+        # a source without rows is cached as an entry without a file
+        if os.path.exists(path):
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+                yield batch.to_pandas()
+        return
+
+    with cache.put(key) as staging:
+        writer = None
+        try:
+            for df in build():
+                table = pa.Table.from_pandas(
+                    df,
+                    schema=writer.schema if writer is not None else None,
+                    preserve_index=False,
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        os.path.join(staging, FRAME_FILE), table.schema
+                    )
+                writer.write_table(table)
+                yield df
+        finally:
+            if writer is not None:
+                writer.close()
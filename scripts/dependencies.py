@@ -0,0 +1,122 @@
+"""
+Startup dependency check for the processing scripts.
+
+Every third party package the scripts need is pinned in
+`requirements-processing.txt`. The processing image built from
+`docker/processing` has all of them installed, so the check only costs a few
+package metadata lookups. On a stock container just the packages that are
+missing, or installed at another version, are installed before the script
+imports them. Nothing is installed when a script is imported as a module.
+Set `SKIP_DEPENDENCY_CHECK=1` to run the scripts against a local environment
+as is.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PINS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "requirements-processing.txt"
+)
+
+# packages with compiled dependencies that resolve more reliably with conda
+CONDA_CHANNELS = {"hdbscan": "conda-forge", "scikit-survival": "sebp"}
+
+
+def read_pins(path: str = PINS_FILE) -> Dict[str, str]:
+    """Read the pinned `name==version` lines of a requirements file
+
+    :param path: requirements file, defaults to requirements-processing.txt
+    :type path: str, optional
+    :return: pinned version by lower cased package name
+    :rtype: Dict[str, str]
+    """
+    pins = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            name, _, version = line.partition("==")
+            pins[name.strip().lower()] = version.strip()
+    return pins
+
+
+def installed_version(package: str) -> Optional[str]:
+    """Version of an installed distribution, None when it is not installed"""
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # python < 3.8
+        import pkg_resources
+
+        try:
+            return pkg_resources.get_distribution(package).version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+def missing_packages(packages: List[str], pins: Dict[str, str]) -> List[str]:
+    """Packages that are not installed at their pinned version
+
+    :param packages: package names the script needs
+    :type packages: List[str]
+    :param pins: pinned version by lower cased package name
+    :type pins: Dict[str, str]
+    :return: package names to install
+    :rtype: List[str]
+    """
+    missing = []
+    for package in packages:
+        pinned = pins.get(package.lower())
+        current = installed_version(package)
+        if current is None or (pinned and current != pinned):
+            missing.append(package)
+    return missing
+
+
+def install(package: str, version: Optional[str] = None):
+    """Install a single package, with conda where it has a channel"""
+    channel = CONDA_CHANNELS.get(package.lower())
+    if channel and shutil.which("conda"):
+        spec = f"{package}={version}" if version else package
+        command = ["conda", "install", "-c", channel, spec, "-y", "-q"]
+    else:
+        spec = f"{package}=={version}" if version else package
+        command = [sys.executable, "-m", "pip", "install", "-q", spec]
+    logger.info(f"Installing {spec}")
+    subprocess.check_call(command, stdout=subprocess.DEVNULL)
+
+
+def ensure_installed(packages: List[str], pins_file: str = PINS_FILE):
+    """Install the pinned version of every package that is missing
+
+    :param packages: package names the script needs
+    :type packages: List[str]
+    :param pins_file: pinned requirements, defaults to
+     requirements-processing.txt
+    :type pins_file: str, optional
+    """
+    if os.environ.get("SKIP_DEPENDENCY_CHECK"):
+        return
+    pins = read_pins(pins_file)
+    missing = missing_packages(packages, pins)
+    # conda packages first, pip packages such as DenseClus build on them
+    missing.sort(key=lambda package: package.lower() not in CONDA_CHANNELS)
+    for package in missing:
+        install(package, pins.get(package.lower()))
+
+
+if __name__ == "__main__":
+    # provision every pinned package, used to build the processing image
+    logging.basicConfig(level=logging.INFO)
+    ensure_installed(list(read_pins()))
@@ -2,44 +2,183 @@ import argparse
 import json
 import logging
 import os
-import pickle
-import subprocess
-import sys
-import tarfile
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+from dependencies import ensure_installed
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-
-install("xgboost")
-install("smdebug==1.0.5")
-install("shap==0.39.0")
-install("matplotlib")
+if __name__ == "__main__":
+    ensure_installed(["xgboost", "smdebug", "shap", "matplotlib", "pyarrow"])
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import shap
 import xgboost
+from bootstrap import CONFIDENCE, bootstrap_auc, confidence_interval
+from contributions import (
+    BATCH_SIZE,
+    SHAP_ROWS,
+    SHAP_SOURCES,
+    sample_contributions,
+    sample_rows,
+)
+from features_io import feature_columns, is_libsvm, read_features, read_libsvm
+from metrics import METRICS_FILE, Metrics
+from models import MODEL_CACHE_DIR, MODEL_NAME, load_model
+from shap_plot import (
+    DENSITY_BINS,
+    PLOT_MODES,
+    PLOT_SAMPLE_SIZE,
+    sample_features,
+    sample_frame,
+    summary_plot,
+)
 from sklearn.metrics import accuracy_score, classification_report, roc_auc_score
-from smdebug.trials import create_trial
+from thresholds import SWEEP_POINTS, curve_report, optimal_thresholds, threshold_curve
+
+# the model, the test set and the SHAP inputs are loaded at the same time
+LOAD_WORKERS = 3
+
+
+def read_test_features(path: str, model_future=None):
+    """Features, target and feature names of the test feature file
+
+    :param path: CSV, Parquet or LibSVM test features, target first
+    :type path: str
+    :param model_future: future of the booster, LibSVM features are read as
+     wide as it once it is loaded, defaults to None
+    :type model_future: concurrent.futures.Future, optional
+    :return: features, target and feature names
+    :rtype: Tuple[np.ndarray or scipy.sparse.csr_matrix, array-like, List[str]]
+    """
+    if is_libsvm(path):
+        # LibSVM only stores non zero entries, so trailing columns that are
+        # zero in every row are only there when the width is given
+        n_features = model_future.result().num_features() if model_future else None
+        # stays a CSR matrix, XGBoost reads it without densifying
+        X_test, y_test = read_libsvm(path, n_features=n_features)
+        return X_test, y_test, [f"f{i}" for i in range(X_test.shape[1])]
+    X_test = read_features(path)
+    y_test = X_test.iloc[:, 0]
+    X_test = X_test.drop(X_test.columns[0], axis=1)
+    return X_test.values, y_test, X_test.columns.tolist()
+
+
+def debugger_shap(args, shap_output_path: str):
+    """SHAP values of the training rows saved by the SageMaker Debugger hook
+
+    :param args: script arguments
+    :type args: argparse.Namespace
+    :param shap_output_path: path of the SHAP values CSV
+    :type shap_output_path: str
+    :return: SHAP values without the bias, the matching feature rows and
+     their positions, None when every row is read
+    :rtype: Tuple[np.ndarray, pd.DataFrame, np.ndarray]
+    """
+    from smdebug.trials import create_trial
+
+    latest_job_debugger_artifacts_path = os.path.join(
+        args.base_dir, "debug", "debug-output"
+    )
+    trial = create_trial(latest_job_debugger_artifacts_path)
+
+    shap_values = trial.tensor("full_shap/f0").value(trial.last_complete_step)
+
+    pd.DataFrame(shap_values).to_csv(shap_output_path)
+
+    shap_no_base = shap_values[1:, :-1]
+
+    train_features_data = os.path.join(args.base_dir, "train", args.train_features)
+    if args.plot_mode == "density":
+        # only the target and a sample of the rows are read
+        rows, X_train = sample_features(
+            train_features_data,
+            len(shap_no_base),
+            sample_size=args.plot_sample_size,
+            random_state=args.random_state,
+            n_features=shap_no_base.shape[1],
+        )
+        logger.info(f"SHAP values {shap_values.shape}, features {X_train.shape}")
+        return shap_no_base, X_train, rows
+    if is_libsvm(train_features_data):
+        # LibSVM has no header, the plot needs dense values and falls back
+        # to the f0, f1, ... feature names XGBoost uses
+        X_train, _ = read_libsvm(train_features_data, n_features=shap_no_base.shape[1])
+        X_train = pd.DataFrame(
+            X_train.toarray(), columns=[f"f{i}" for i in range(X_train.shape[1])]
+        )
+    else:
+        # the target is not needed for the plot, so it is not read at all
+        X_train = read_features(
+            train_features_data, columns=feature_columns(train_features_data)[1:]
+        )
+    logger.info(f"SHAP values {shap_values.shape}, features {X_train.shape}")
+    return shap_no_base, X_train, None
+
+
+def booster_shap(args, model, X_test, y_test, feature_names, shap_output_path: str):
+    """SHAP values of test rows computed from the booster
+
+    :param args: script arguments
+    :type args: argparse.Namespace
+    :param model: trained XGBoost booster
+    :type model: xgboost.Booster
+    :param X_test: test features
+    :type X_test: np.ndarray or scipy.sparse.csr_matrix
+    :param y_test: test target
+    :type y_test: array-like
+    :param feature_names: names of the feature columns
+    :type feature_names: List[str]
+    :param shap_output_path: path of the SHAP values CSV
+    :type shap_output_path: str
+    :return: SHAP values without the bias, the matching feature rows and
+     their positions, None when every row is kept
+    :rtype: Tuple[np.ndarray, pd.DataFrame, np.ndarray]
+    """
+    shap_no_base, X_shap = sample_contributions(
+        model,
+        X_test,
+        feature_names,
+        shap_output_path,
+        sample_size=args.shap_sample_size,
+        batch_size=args.shap_batch_size,
+        random_state=args.random_state,
+    )
+    if args.plot_mode != "density":
+        return shap_no_base, X_shap, None
+    # the same test rows sample_contributions explained
+    explained = sample_rows(X_test.shape[0], args.shap_sample_size, args.random_state)
+    rows, X_shap = sample_frame(
+        X_shap,
+        np.asarray(y_test)[explained],
+        sample_size=args.plot_sample_size,
+        random_state=args.random_state,
+    )
+    return shap_no_base, X_shap, rows
 
 
 def main(args):
     """
     Runs evaluation for the data set
-        1. Loads model from tar.gz
-        2. Reads in test features
-        3. Runs an classification accuracy report
-        4. Generates feature importance with SHAP
+        1. Loads model from tar.gz, extracted once per archive, and reads
+        in test features concurrently, while the training features and
+        Debugger tensor for SHAP load in the background
+        2. Scores the test features as soon as they and the model are loaded
+        3. Runs an classification accuracy report, and sweeps every
+        threshold for precision, recall, F1, lift and the F1 and cost optimal
+        thresholds
+        4. Generates feature importance with SHAP, from the Debugger tensor
+        of the training job or computed from the booster on test rows, and
+        plots it as a beeswarm or as histograms colored by a sample of rows
 
     Args:
         model-name (str): Name of the trained model, default xgboost
+        model-cache-dir (str): Directory the model archive is extracted
+        into, keyed by its content hash, default MODEL_CACHE_DIR or a
+        temporary directory
         test-features (str): preprocessed test features for
-         evaluation, default test_features.csv
+         evaluation, csv, parquet or libsvm, default test_features.csv
         train-features (str): preproceed train features for SHAP,
         default train_features.csv
         test-features (str): preproceed test features for SHAP,
@@ -50,76 +189,186 @@ def main(args):
         output file, default shap.csv
         threshold (float): Threshold to cut probablities at
         , default 0.5
-    """
+        bootstrap-resamples (int): Resamples of the ROC AUC confidence
+        interval, e.g. 1000, default 0 skips it
+        confidence (float): Coverage of the confidence interval, default 0.95
+        fp-cost (float): Cost of a false positive, such as an unneeded
+        retention offer, default 1
+        fn-cost (float): Cost of a false negative, a missed churner
+        , default 1
+        sweep-points (int): Thresholds of the sweep kept in the report
+        , default 101
+        shap-source (str): debugger reads the SHAP values the training job
+        saved, booster computes them with TreeSHAP, default debugger
+        shap-sample-size (int): Test rows SHAP values are computed for with
+        the booster, default None uses every row
+        shap-batch-size (int): Rows scored at a time, default 10000
+        plot-mode (str): beeswarm plots every SHAP value, density plots
+        their histograms per feature colored by a stratified sample of
+        feature rows, default beeswarm
+        plot-sample-size (int): Feature rows read to color the density
+        plot, default 10000
+        plot-bins (int): Bins per feature of the density plot, default 50
+        random-state (int): Random seed of the bootstrap and the SHAP sample
+        , default 123
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
 
-    model_path = os.path.join("/opt/ml/processing/model", "model.tar.gz")
+    The time, CPU and peak memory of every phase are written to
+    `evaluation/metrics.json`, next to the evaluation report.
+    """
 
-    logger.info(f"Extracting model from path: {model_path}")
+    model_path = os.path.join(args.base_dir, "model", "model.tar.gz")
+    metrics = Metrics(
+        os.path.join(args.base_dir, "evaluation", METRICS_FILE),
+        profile_span=args.profile_span,
+    )
 
-    with tarfile.open(model_path) as tar:
-        tar.extractall(path=".")
-    logger.info("Loading model")
-    with open(args.model_name, "rb") as f:
-        model = pickle.load(f)
+    test_features_data = os.path.join(args.base_dir, "test", args.test_features)
+    shap_output_path = os.path.join(args.base_dir, "evaluation", args.shap_name)
 
-    logger.info("Loading test input data")
-    test_features_data = os.path.join("/opt/ml/processing/test", args.test_features)
+    logger.info(f"Loading model from path: {model_path} and test input data")
+    executor = ThreadPoolExecutor(max_workers=LOAD_WORKERS)
+    model_future = executor.submit(
+        load_model, model_path, args.model_name, cache_dir=args.model_cache_dir
+    )
+    test_future = executor.submit(read_test_features, test_features_data, model_future)
+    # only needed for the plot, loaded while the test set is scored
+    shap_future = None
+    if args.shap_source == "debugger":
+        shap_future = executor.submit(debugger_shap, args, shap_output_path)
+    executor.shutdown(wait=False)
 
-    X_test = pd.read_csv(test_features_data, header=0)
-    y_test = X_test.iloc[:, 0]
-    X_test.drop(X_test.columns[0], axis=1, inplace=True)
-    predictions = model.predict(xgboost.DMatrix(X_test.values))
+    with metrics.span("load") as span:
+        model = model_future.result()
+        X_test, y_test, test_feature_names = test_future.result()
+        span["rows"] = X_test.shape[0]
+    with metrics.span("predict", rows=X_test.shape[0]):
+        predictions = model.predict(xgboost.DMatrix(X_test))
 
     logger.info("Creating classification evaluation report")
-    report_dict = classification_report(
-        y_test, predictions > args.threshold, output_dict=True
-    )
-    report_dict["accuracy"] = accuracy_score(y_test, predictions > args.threshold)
-    report_dict["roc_auc"] = roc_auc_score(y_test, predictions)
+    with metrics.span("report", rows=len(predictions)):
+        report_dict = classification_report(
+            y_test, predictions > args.threshold, output_dict=True
+        )
+        report_dict["accuracy"] = accuracy_score(y_test, predictions > args.threshold)
+        report_dict["roc_auc"] = roc_auc_score(y_test, predictions)
+        report_dict["shap_rows"] = SHAP_ROWS[args.shap_source]
+    if args.bootstrap_resamples:
+        logger.info(f"Bootstrapping ROC AUC over {args.bootstrap_resamples} resamples")
+        with metrics.span("bootstrap", rows=len(predictions)):
+            report_dict["roc_auc_interval"] = confidence_interval(
+                bootstrap_auc(
+                    y_test,
+                    predictions,
+                    n_resamples=args.bootstrap_resamples,
+                    random_state=args.random_state,
+                ),
+                confidence=args.confidence,
+            )
+
+    logger.info("Sweeping classification thresholds")
+    with metrics.span("threshold_sweep", rows=len(predictions)):
+        curve = threshold_curve(y_test, predictions)
+        report_dict["optimal_threshold"] = optimal_thresholds(
+            curve, fp_cost=args.fp_cost, fn_cost=args.fn_cost
+        )
+        report_dict["threshold_sweep"] = curve_report(curve, points=args.sweep_points)
 
     logger.info(f"Classification report:\n{report_dict}")
 
-    evaluation_output_path = os.path.join(
-        "/opt/ml/processing/evaluation", args.report_name
-    )
+    evaluation_output_path = os.path.join(args.base_dir, "evaluation", args.report_name)
     logger.info(f"Saving classification report to {evaluation_output_path}")
 
     with open(evaluation_output_path, "w") as f:
         f.write(json.dumps(report_dict))
 
     # SHAP
-    train_features_data = os.path.join("/opt/ml/processing/train", args.train_features)
-    X_train = pd.read_csv(train_features_data, header=0)
-    X_train.drop(X_train.columns[0], axis=1, inplace=True)
+    with metrics.span("shap") as span:
+        if shap_future is None:
+            shap_no_base, X_shap, rows = booster_shap(
+                args, model, X_test, y_test, test_feature_names, shap_output_path
+            )
+        else:
+            shap_no_base, X_shap, rows = shap_future.result()
+        span["rows"] = len(shap_no_base)
 
-    latest_job_debugger_artifacts_path = "/opt/ml/processing/debug/debug-output"
-    trial = create_trial(latest_job_debugger_artifacts_path)
-
-    shap_values = trial.tensor("full_shap/f0").value(trial.last_complete_step)
-
-    pd.DataFrame(shap_values).to_csv(
-        os.path.join("/opt/ml/processing/evaluation", args.shap_name)
-    )
-
-    shap_no_base = shap_values[1:, :-1]
-    feature_names = X_train.columns
-    os.makedirs("/opt/ml/processing/plot/", exist_ok=True)
-    logger.info(shap_values.shape, shap_no_base.shape, X_train.shape)
-    shap.summary_plot(
-        shap_no_base, features=X_train, feature_names=feature_names, show=False
-    )
-    plt.savefig("/opt/ml/processing/plot/feature_importance.png", bbox_inches="tight")
+    os.makedirs(os.path.join(args.base_dir, "plot"), exist_ok=True)
+    with metrics.span("plot", rows=len(shap_no_base)) as span:
+        span["sampled"] = len(X_shap)
+        summary_plot(
+            shap_no_base,
+            X_shap,
+            os.path.join(args.base_dir, "plot", "feature_importance.png"),
+            mode=args.plot_mode,
+            rows=rows,
+            bins=args.plot_bins,
+        )
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--model-name", type=str, default="xgboost-model")
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME)
+    parser.add_argument(
+        "--model-cache-dir",
+        type=str,
+        default=MODEL_CACHE_DIR,
+        help="Directory the model archive is extracted into once",
+    )
     parser.add_argument("--test-features", type=str, default="test_features.csv")
     parser.add_argument("--train-features", type=str, default="train_features.csv")
     parser.add_argument("--report-name", type=str, default="evaluation.json")
     parser.add_argument("--shap-name", type=str, default="shap.csv")
     parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=0,
+        help="Resamples of the confidence interval, e.g. 1000, 0 skips it",
+    )
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--fp-cost", type=float, default=1.0)
+    parser.add_argument("--fn-cost", type=float, default=1.0)
+    parser.add_argument("--sweep-points", type=int, default=SWEEP_POINTS)
+    parser.add_argument(
+        "--shap-source",
+        type=str,
+        default="debugger",
+        choices=SHAP_SOURCES,
+        help="Read SHAP values from the Debugger output or compute them",
+    )
+    parser.add_argument(
+        "--shap-sample-size",
+        type=int,
+        default=None,
+        help="Compute SHAP values of a sample of this many test rows",
+    )
+    parser.add_argument("--shap-batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        "--plot-mode",
+        type=str,
+        default="beeswarm",
+        choices=PLOT_MODES,
+        help="Plot every SHAP value or their histograms colored by a sample",
+    )
+    parser.add_argument(
+        "--plot-sample-size",
+        type=int,
+        default=PLOT_SAMPLE_SIZE,
+        help="Feature rows read to color the density plot",
+    )
+    parser.add_argument("--plot-bins", type=int, default=DENSITY_BINS)
+    parser.add_argument("--random-state", type=int, default=123)
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
     args = parser.parse_args()
 
     main(args)
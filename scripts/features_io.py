@@ -0,0 +1,473 @@
+"""
+Readers and writers for the engineered feature files.
+
+Features are written as CSV, which the SageMaker built-in XGBoost `text/csv`
+channels and Batch Transform read, as compressed float32 Parquet, which is
+several times smaller and much faster to write and parse, or as LibSVM, which
+the built-in XGBoost reads as `text/libsvm`. LibSVM only stores the non zero
+entries of every row, so the mostly zero one hot columns are never densified.
+"""
+
+import io
+import json
+import math
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+OUTPUT_FORMATS = ("csv", "parquet", "libsvm")
+SPARSE_FORMATS = ("libsvm",)
+LINE_FORMATS = ("csv", "libsvm")
+COPY_BUFFER_SIZE = 1024 * 1024
+ROW_GROUP_SIZE = 64 * 1024
+PARQUET_COMPRESSION = "snappy"
+
+
+def features_path(directory: str, name: str, output_format: str = "csv") -> str:
+    """Path of a feature file with the extension of its format
+
+    :param directory: output directory
+    :type directory: str
+    :param name: file name without extension, e.g. train_features
+    :type name: str
+    :param output_format: one of `OUTPUT_FORMATS`, defaults to csv
+    :type output_format: str, optional
+    :return: file path
+    :rtype: str
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format}")
+    return os.path.join(directory, f"{name}.{output_format}")
+
+
+def target_matrix(y, n_features: int, dtype=np.float32) -> np.ndarray:
+    """Allocate a feature matrix with the target written into its first column
+
+    The features are then written into `[:, 1:]` in place, for instance by
+    `CompiledTransform.transform(df, out=matrix[:, 1:])`, so they are never
+    copied next to the target.
+
+    :param y: target of every row
+    :type y: array-like
+    :param n_features: number of feature columns after the target
+    :type n_features: int
+    :param dtype: type of the matrix, defaults to float32
+    :type dtype: np.dtype, optional
+    :return: matrix of `len(y)` rows, the feature columns uninitialized
+    :rtype: np.ndarray
+    """
+    y = np.asarray(y)
+    matrix = np.empty((len(y), 1 + n_features), dtype=dtype)
+    matrix[:, 0] = y
+    return matrix
+
+
+def prepend_target(y, features):
+    """Add the target as the first column, as the XGBoost input formats expect
+
+    :param y: target of every row
+    :type y: array-like
+    :param features: dense array or sparse matrix of feature rows
+    :type features: np.ndarray or scipy.sparse.spmatrix
+    :return: features with the target as first column, sparse if they were
+    :rtype: np.ndarray or scipy.sparse.csr_matrix
+    """
+    y = np.asarray(y)
+    if sparse.issparse(features):
+        return sparse.hstack((y.reshape(-1, 1), features), format="csr")
+    matrix = target_matrix(
+        y, features.shape[1], dtype=np.result_type(y.dtype, features.dtype)
+    )
+    matrix[:, 1:] = features
+    return matrix
+
+
+class FeatureWriter:
+    """Appends blocks of feature rows to a CSV, Parquet or LibSVM file
+
+    Parquet columns are stored as float32 and every block is written as one
+    or more row groups of at most `row_group_size` rows, so readers can stream
+    the file back a row group at a time.
+
+    Blocks may be dense arrays or sparse matrices. LibSVM rows are written
+    straight from the sparse matrix with the first column as the label, or a
+    label of 0 when `has_target` is False; the other formats densify one
+    block at a time.
+
+    :param path: output file path
+    :type path: str
+    :param feature_names: column names, defaults to f0, f1, ...
+    :type feature_names: List[str], optional
+    :param output_format: one of `OUTPUT_FORMATS`, defaults to csv
+    :type output_format: str, optional
+    :param header: write the CSV header line, defaults to True
+    :type header: bool, optional
+    :param row_group_size: maximum rows per Parquet row group
+    :type row_group_size: int, optional
+    :param has_target: the first column is the target, defaults to True
+    :type has_target: bool, optional
+    """
+
+    def __init__(
+        self,
+        path: str,
+        feature_names: Optional[List[str]] = None,
+        output_format: str = "csv",
+        header: bool = True,
+        row_group_size: int = ROW_GROUP_SIZE,
+        has_target: bool = True,
+    ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {output_format}")
+        self.path = path
+        self.feature_names = feature_names
+        self.output_format = output_format
+        self.header = header
+        self.row_group_size = row_group_size
+        self.has_target = has_target
+        self.rows = 0
+        self._writer = None
+
+    def _names(self, n_columns: int) -> List[str]:
+        if self.feature_names is None:
+            self.feature_names = [f"f{i}" for i in range(n_columns)]
+        return list(self.feature_names)
+
+    def _write_libsvm(self, features):
+        from sklearn.datasets import dump_svmlight_file
+
+        features = sparse.csr_matrix(features)
+        if self.has_target:
+            y = features[:, 0].toarray().ravel()
+            features = features[:, 1:]
+        else:
+            y = np.zeros(features.shape[0])
+        if self._writer is None:
+            self._writer = open(self.path, "wb")
+        dump_svmlight_file(features, y, self._writer, zero_based=True)
+
+    def write(self, features):
+        """Append a block of rows
+
+        :param features: 2D array or sparse matrix of feature rows
+        :type features: np.ndarray or scipy.sparse.spmatrix
+        """
+        names = self._names(features.shape[1])
+        if self.output_format == "libsvm":
+            self._write_libsvm(features)
+            self.rows += features.shape[0]
+            return
+        if sparse.issparse(features):
+            features = features.toarray()
+        if self.output_format == "csv":
+            first = self.rows == 0
+            pd.DataFrame(features, columns=names).to_csv(
+                self.path,
+                header=self.header and first,
+                index=False,
+                mode="w" if first else "a",
+            )
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            features = np.asarray(features, dtype=np.float32)
+            table = pa.Table.from_arrays(
+                [pa.array(features[:, i]) for i in range(features.shape[1])],
+                names=names,
+            )
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(
+                    self.path, table.schema, compression=PARQUET_COMPRESSION
+                )
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows += len(features)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_features(
+    path: str,
+    features,
+    feature_names: Optional[List[str]] = None,
+    output_format: str = "csv",
+    header: bool = True,
+    has_target: bool = True,
+):
+    """Write a feature matrix in one go, see `FeatureWriter`"""
+    with FeatureWriter(
+        path,
+        feature_names,
+        output_format=output_format,
+        header=header,
+        has_target=has_target,
+    ) as writer:
+        writer.write(features)
+
+
+def is_parquet(path: str) -> bool:
+    return path.endswith((".parquet", ".pq"))
+
+
+def is_libsvm(path: str) -> bool:
+    return path.endswith((".libsvm", ".svm"))
+
+
+def feature_columns(path: str) -> List[str]:
+    """Column names of a feature file without reading its rows
+
+    :param path: CSV with a header line or Parquet file
+    :type path: str
+    :return: column names
+    :rtype: List[str]
+    """
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def read_features(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read a feature file, only parsing the requested columns
+
+    Both formats are parsed by Arrow in blocks spread over every core, CSV
+    several times faster than with the single threaded pandas parser.
+
+    :param path: CSV with a header line or Parquet file
+    :type path: str
+    :param columns: columns to read, defaults to all
+    :type columns: List[str], optional
+    :return: features
+    :rtype: pd.DataFrame
+    """
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, columns=columns, use_threads=True).to_pandas()
+    from pyarrow import csv
+
+    return csv.read_csv(
+        path,
+        read_options=csv.ReadOptions(use_threads=True),
+        convert_options=csv.ConvertOptions(include_columns=columns),
+    ).to_pandas()
+
+
+def read_libsvm(
+    path: str, n_features: Optional[int] = None
+) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """Read a LibSVM feature file without densifying it
+
+    :param path: LibSVM file with zero based feature indices
+    :type path: str
+    :param n_features: number of feature columns, defaults to the highest
+     index found in the file
+    :type n_features: int, optional
+    :return: sparse features and target
+    :rtype: Tuple[scipy.sparse.csr_matrix, np.ndarray]
+    """
+    from sklearn.datasets import load_svmlight_file
+
+    features, y = load_svmlight_file(
+        path, n_features=n_features, dtype=np.float32, zero_based=True
+    )
+    return features, y
+
+
+def read_target(path: str) -> np.ndarray:
+    """Read only the target, the first column, of a feature file
+
+    :param path: CSV with a header line, Parquet or LibSVM file
+    :type path: str
+    :return: target of every row
+    :rtype: np.ndarray
+    """
+    if is_libsvm(path):
+        with open(path, "rb") as f:
+            return np.fromiter((float(line.split(None, 1)[0]) for line in f), float)
+    return read_features(path, columns=feature_columns(path)[:1]).iloc[:, 0].values
+
+
+def _read_libsvm_rows(path: str, rows: np.ndarray, n_features: Optional[int]):
+    """Dense features of some lines of a LibSVM file, keeping only those lines"""
+    from sklearn.datasets import load_svmlight_file
+
+    lines = []
+    with open(path, "rb") as f:
+        position = 0
+        for line_number, line in enumerate(f):
+            if position == len(rows):
+                break
+            if line_number == rows[position]:
+                lines.append(line)
+                position += 1
+    if not lines:
+        return pd.DataFrame(columns=[f"f{i}" for i in range(n_features or 0)])
+    features, _ = load_svmlight_file(
+        io.BytesIO(b"".join(lines)),
+        n_features=n_features,
+        dtype=np.float32,
+        zero_based=True,
+    )
+    return pd.DataFrame(
+        features.toarray(), columns=[f"f{i}" for i in range(features.shape[1])]
+    )
+
+
+def read_rows(
+    path: str,
+    rows,
+    columns: Optional[List[str]] = None,
+    n_features: Optional[int] = None,
+) -> pd.DataFrame:
+    """Read only some rows of a feature file
+
+    The file is streamed one block at a time and only the requested rows are
+    kept, so memory follows the number of rows rather than the file size.
+
+    :param path: CSV with a header line, Parquet or LibSVM file
+    :type path: str
+    :param rows: sorted positions of the rows to read
+    :type rows: array-like
+    :param columns: columns to read, defaults to all, LibSVM reads every
+     feature and no target
+    :type columns: List[str], optional
+    :param n_features: number of LibSVM feature columns, defaults to the
+     highest index found in the rows read
+    :type n_features: int, optional
+    :return: features of the requested rows, in order
+    :rtype: pd.DataFrame
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if is_libsvm(path):
+        return _read_libsvm_rows(path, rows, n_features)
+    import pyarrow as pa
+
+    if is_parquet(path):
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(path).iter_batches(
+            batch_size=ROW_GROUP_SIZE, columns=columns
+        )
+    else:
+        from pyarrow import csv
+
+        batches = csv.open_csv(
+            path, convert_options=csv.ConvertOptions(include_columns=columns)
+        )
+    tables, offset = [], 0
+    for batch in batches:
+        start, stop = np.searchsorted(rows, [offset, offset + batch.num_rows])
+        if stop > start:
+            taken = batch.take(pa.array(rows[start:stop] - offset))
+            tables.append(pa.Table.from_batches([taken]))
+        offset += batch.num_rows
+        if stop == len(rows):
+            break
+    if not tables:
+        return pd.DataFrame(columns=columns or feature_columns(path))
+    return pa.concat_tables(tables).to_pandas()
+
+
+def _line_boundaries(path: str, n_shards: int) -> List[int]:
+    """Byte offsets that split a file into `n_shards` parts at line ends"""
+    total = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for k in range(1, n_shards):
+            f.seek(max(total * k // n_shards - 1, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), total))
+    bounds.append(total)
+    return sorted(set(bounds))
+
+
+def shard_lines(
+    path: str,
+    num_shards: Optional[int] = None,
+    max_shard_bytes: Optional[int] = None,
+) -> List[str]:
+    """Split a CSV or LibSVM file into evenly sized part files at row ends
+
+    The parts are named like `infer_features-part-00000.csv` and
+    concatenated in order they are byte for byte the original file, which
+    is removed. At least `num_shards` parts are written, more if needed to
+    keep every part at or below `max_shard_bytes`. An empty file has no
+    rows to split and writes no parts.
+
+    :param path: CSV or LibSVM file with one row per line
+    :type path: str
+    :param num_shards: minimum number of parts, defaults to 1
+    :type num_shards: int, optional
+    :param max_shard_bytes: maximum size of a part, defaults to unbounded
+    :type max_shard_bytes: int, optional
+    :return: paths of the parts in order, none for an empty file
+    :rtype: List[str]
+    """
+    total = os.path.getsize(path)
+    if not total:
+        os.remove(path)
+        return []
+    n_shards = max(num_shards or 1, 1)
+    if max_shard_bytes:
+        n_shards = max(n_shards, math.ceil(total / max_shard_bytes))
+
+    while True:
+        bounds = _line_boundaries(path, n_shards)
+        largest = max(end - start for start, end in zip(bounds, bounds[1:]))
+        if not max_shard_bytes or largest <= max_shard_bytes:
+            break
+        if n_shards >= total:
+            raise ValueError(f"A row of {path} is larger than {max_shard_bytes} bytes")
+        n_shards = max(n_shards + 1, math.ceil(n_shards * largest / max_shard_bytes))
+
+    root, ext = os.path.splitext(path)
+    shards = []
+    with open(path, "rb") as src:
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            shard = f"{root}-part-{i:05d}{ext}"
+            src.seek(start)
+            remaining = end - start
+            with open(shard, "wb") as dst:
+                while remaining:
+                    block = src.read(min(COPY_BUFFER_SIZE, remaining))
+                    dst.write(block)
+                    remaining -= len(block)
+            shards.append(shard)
+    os.remove(path)
+    return shards
+
+
+def write_manifest(path: str, shards: List[str], prefix: Optional[str] = None):
+    """Write a SageMaker manifest file listing the feature shards
+
+    Without any shard the manifest lists only the prefix, so there is
+    nothing to transform.
+
+    :param path: manifest file path
+    :type path: str
+    :param shards: paths of the shards, in order
+    :type shards: List[str]
+    :param prefix: S3 prefix the shards are uploaded to, defaults to their
+     local directory
+    :type prefix: str, optional
+    """
+    if prefix is None:
+        prefix = os.path.dirname(os.path.abspath(shards[0])) if shards else ""
+    if not prefix.endswith("/"):
+        prefix += "/"
+    with open(path, "w") as f:
+        json.dump([{"prefix": prefix}] + [os.path.basename(s) for s in shards], f)
@@ -1,32 +1,57 @@
 import argparse
 import logging
 import os
-import subprocess
-import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+from dependencies import ensure_installed
 
-def install(package: str):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-
-install("scikit-learn==0.24.1")
-install("awswrangler==2.4.0")
-os.system("conda install -c conda-forge hdbscan -y")
-install("Amazon-DenseClus==0.0.7")
+if __name__ == "__main__":
+    ensure_installed(
+        ["scikit-learn", "awswrangler", "pyarrow", "hdbscan", "Amazon-DenseClus"]
+    )
 
-import awswrangler as wr
-import boto3
 import joblib
 import pandas as pd
-from denseclus import DenseClus
+from compiled_transform import COMPILED_FILE, load_transform
+from data_cache import (
+    DATA_CACHE,
+    DATA_CACHE_MAX_BYTES,
+    cache_key,
+    cached_batches,
+    code_digest,
+    open_cache,
+)
+from features_io import (
+    LINE_FORMATS,
+    OUTPUT_FORMATS,
+    FeatureWriter,
+    features_path,
+    shard_lines,
+    write_manifest,
+)
+from metrics import METRICS_FILE, Metrics
+from models import file_digest
+from row_index import (
+    INDEX_FILE,
+    KEY_COLUMNS,
+    RowIndex,
+    index_stamp,
+    row_hashes,
+    row_keys,
+)
+from segments import CLUSTERER_FILE
 from sklearn.exceptions import DataConversionWarning
+from sources import iter_table, prefetch, source_fingerprint
 
 warnings.filterwarnings(action="ignore", category=DataConversionWarning)
 
+KEYS_FILE = "infer_keys.csv"
+
 
 col_type = {
     "state": "category",
@@ -54,12 +79,242 @@ col_type = {
 columns = list(col_type.keys())
 
 
+def cast_batch(df: pd.DataFrame, coxph: bool = False) -> pd.DataFrame:
+    """Apply the schema to a batch of rows and drop incomplete rows
+
+    :param df: raw rows from the source table
+    :type df: pd.DataFrame
+    :param coxph: drop the columns the Cox model is not trained on
+    , defaults to False
+    :type coxph: bool, optional
+    :return: rows of the model's columns, indexed like `df`
+    :rtype: pd.DataFrame
+    """
+    df = df[columns]
+    df = df.astype(col_type)
+
+    df = df.drop(["area code", "phone"], 1)
+    df = df.dropna()
+
+    if coxph:
+        del df["account length"]
+    return df
+
+
+def prepare_batch(df: pd.DataFrame, coxph: bool = False, assigner=None):
+    """Apply the schema to a batch of rows and assign their segments
+
+    :param df: raw rows from the source table
+    :type df: pd.DataFrame
+    :param coxph: drop the columns the Cox model is not trained on
+    , defaults to False
+    :type coxph: bool, optional
+    :param assigner: fitted `SegmentAssigner`, defaults to None
+    :type assigner: SegmentAssigner, optional
+    :return: rows ready for the preprocessor
+    :rtype: pd.DataFrame
+    """
+    df = cast_batch(df, coxph)
+
+    # assign rows to the segments found in training instead of refitting
+    if assigner is not None:
+        df["segments"] = assigner.predict(df).astype(str)
+    return df
+
+
+def changed_rows(df: pd.DataFrame, index: RowIndex, coxph: bool = False):
+    """Raw rows of a batch that are new or changed since the indexed run
+
+    Rows are compared on the columns the model reads, after the schema is
+    applied, so only changes that can change a prediction count.
+
+    :param df: raw rows from the source table
+    :type df: pd.DataFrame
+    :param index: row index of the previous run, updated with the batch
+    :type index: RowIndex
+    :param coxph: drop the columns the Cox model is not trained on
+    , defaults to False
+    :type coxph: bool, optional
+    :return: raw rows to process
+    :rtype: pd.DataFrame
+    """
+    df = df.reset_index(drop=True)
+    batch = cast_batch(df, coxph)
+    changed = index.update(row_keys(df.loc[batch.index]), row_hashes(batch))
+    return df.loc[batch.index[changed]]
+
+
+def transform_batches(batches: Iterable[pd.DataFrame], preprocess) -> Iterator:
+    """Run the feature engineering transformations one batch at a time
+
+    :param batches: rows ready for the preprocessor
+    :type batches: Iterable[pd.DataFrame]
+    :param preprocess: fitted or compiled preprocessor
+    :type preprocess: ColumnTransformer or CompiledTransform
+    :return: iterator of transformed feature blocks
+    :rtype: Iterator
+    """
+    for df in batches:
+        features = preprocess.transform(df)
+        if isinstance(features, pd.DataFrame):
+            features = features.values
+        yield features
+
+
+def write_overlapped(blocks: Iterable, writer: FeatureWriter):
+    """Append feature blocks from a writer thread, overlapped with the next one
+
+    :param blocks: transformed feature blocks
+    :type blocks: Iterable
+    :param writer: open feature file
+    :type writer: FeatureWriter
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for features in blocks:
+            # one write in flight at a time, overlapped with the next batch
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(writer.write, features)
+        if pending is not None:
+            pending.result()
+
+
+def load_index(
+    base_dir: str,
+    previous_dir: Optional[str] = None,
+    cluster: bool = True,
+    coxph: bool = False,
+    paths: Iterable[str] = (),
+) -> Tuple[RowIndex, str]:
+    """Row index of the previous run and the stamp of the current one
+
+    The stamp covers the saved preprocessor and segment assigner, so the
+    outputs of another training run are not reused.
+
+    :param base_dir: root of the processing job inputs and outputs
+    :type base_dir: str
+    :param previous_dir: directory with the index of the previous run,
+     defaults to `base_dir/previous`
+    :type previous_dir: str, optional
+    :param cluster: rows are assigned to segments, defaults to True
+    :type cluster: bool, optional
+    :param coxph: Cox proportional hazard model, defaults to False
+    :type coxph: bool, optional
+    :param paths: other files the outputs depend on, such as the model
+    :type paths: Iterable[str], optional
+    :return: index and stamp
+    :rtype: Tuple[RowIndex, str]
+    """
+    transformer_dir = os.path.join(base_dir, "transformer")
+    names = [COMPILED_FILE, "preprocessor.joblib"]
+    names += [CLUSTERER_FILE] if cluster else []
+    stamp = index_stamp(
+        [os.path.join(transformer_dir, name) for name in names] + list(paths),
+        coxph=coxph,
+    )
+    previous_dir = previous_dir or os.path.join(base_dir, "previous")
+    return RowIndex.load(os.path.join(previous_dir, INDEX_FILE), stamp), stamp
+
+
+def incremental_model_path(args) -> str:
+    """Model archive the transform of an incremental run scores with
+
+    The row index is stamped with it, so the customers that did not change
+    keep their previous scores only while the model stays the same.
+
+    :param args: arguments of `main`
+    :type args: argparse.Namespace
+    :raises FileNotFoundError: when the model archive is missing
+    :return: path of the model archive
+    :rtype: str
+    """
+    path = args.model_path or os.path.join(args.base_dir, "model", "model.tar.gz")
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No model archive {path}, incremental runs are stamped with the model"
+        )
+    return path
+
+
+def open_data_cache(args, clusterer_path: str, metrics: Metrics) -> Tuple:
+    """Data cache of the arguments and the key of the source's rows in it
+
+    :param args: arguments of `main`
+    :type args: argparse.Namespace
+    :param clusterer_path: saved segment assigner
+    :type clusterer_path: str
+    :param metrics: spans of the script, the fingerprint is timed in one
+    :type metrics: Metrics
+    :return: cache backend and key, both None without a cache location
+    :rtype: Tuple
+    """
+    cache = open_cache(args.data_cache, args.data_cache_max_bytes)
+    if cache is None:
+        return None, None
+    with metrics.span("fingerprint"):
+        key = cache_key(
+            "inferpreprocessing",
+            source_fingerprint(
+                args.database, args.table, args.region, args.source_path
+            ),
+            col_type,
+            code=code_digest("inferpreprocessing", "sources", "segments"),
+            coxph=args.coxph,
+            # the segments depend on the clusterer fitted in training
+            assigner=file_digest(clusterer_path) if args.cluster else None,
+        )
+    return cache, key
+
+
+def keyed_batches(
+    chunks: Iterable[pd.DataFrame], index: RowIndex, keys_path: str, coxph: bool
+) -> Iterator[pd.DataFrame]:
+    """New or changed rows of every chunk, their keys appended to a CSV file
+
+    The keys are written in the order of the feature rows, so predictions of
+    the feature file can be joined back to the customers.
+
+    :param chunks: raw rows from the source table
+    :type chunks: Iterable[pd.DataFrame]
+    :param index: row index of the previous run, updated with every chunk
+    :type index: RowIndex
+    :param keys_path: output path of the keys
+    :type keys_path: str
+    :param coxph: drop the columns the Cox model is not trained on
+    :type coxph: bool
+    :return: iterator of the raw rows to process
+    :rtype: Iterator[pd.DataFrame]
+    """
+    first = True
+    for df in chunks:
+        df = changed_rows(df, index, coxph)
+        df[KEY_COLUMNS].astype(str).to_csv(
+            keys_path, index=False, header=first, mode="w" if first else "a"
+        )
+        first = False
+        if len(df):
+            yield df
+
+
 def main(args):
     """
     Runs preprocessing for the example data set
-        1. Pulls data from the Athena database
-        2. Transforms features using the saved preprocessor
-        3. Writes preprocessed data to S3
+        1. Streams data from the Athena database in batches, reading the
+        next batch in the background
+        2. Assigns rows to the segments saved by the training preprocessing
+        3. Transforms features using the saved preprocessor, compiled to
+        vectorized NumPy
+        4. Appends every batch to the feature file from a writer thread,
+        which is then written to S3
+        5. Optionally splits the feature file into part files at row ends
+        and lists them in a manifest, so Batch Transform can spread them
+        over several instances
+        6. Incrementally, only transforms the customers that are new or
+        changed since the previous run, see `row_index.py`
+
+    Only a few batches are held in memory at any time, so the memory used
+    does not grow with the size of the scoring table.
 
     Args:
         database (str, required): Athena database to query data from
@@ -67,55 +322,132 @@ def main(args):
         region (str, required): AWS Region for queries
         coxph (bool): Flag indicating that it's a cox proportional hazard model,
         default False
+        output-format (str): Format of the feature file, csv, parquet or
+        libsvm, default csv. Use libsvm when the model was trained on libsvm
+        so absent one hot entries are read as missing in both
+        chunksize (int): Number of rows read, transformed and written at a
+        time, default 100000
+        source-path (str): Local CSV/Parquet file or directory read instead
+        of Athena, default None
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        num-shards (int): Minimum number of part files, default None writes
+        a single file
+        max-shard-bytes (int): Maximum size of a part file, default None
+        shard-prefix (str): S3 prefix the part files are uploaded to, used in
+        the manifest, default the local output directory
+        data-cache (str): Local directory or S3 prefix caching the rows
+        ready for the preprocessor by source snapshot, schema, arguments and
+        cluster assigner, see `data_cache.py`, default the DATA_CACHE
+        environment variable or no cache
+        data-cache-max-bytes (int): Size the cache is bounded to by evicting
+        the least recently used entries, default 20 GiB
+        incremental (bool): Only transform rows that are new or changed since
+        the run whose `row_index.parquet` is in previous-dir. The keys of the
+        transformed rows are written to `infer_keys.csv` and the index of all
+        rows to `row_index.parquet`, which `merge_predictions.py` uses to
+        merge the transform predictions with the previous scores, default
+        False
+        previous-dir (str): Directory with the `infer` outputs of the
+        previous run, default base-dir/previous
+        model-path (str): Model archive the transform scores with, which
+        the row index of an incremental run is stamped with, default
+        base-dir/model/model.tar.gz
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
+
+    The time, CPU and peak memory of every phase are written to
+    `infer/metrics.json`, which the manifest does not list.
     """
 
     logger.info(f"Received arguments {args}")
+    sharded = bool(args.num_shards or args.max_shard_bytes)
+    if sharded and args.output_format not in LINE_FORMATS:
+        raise ValueError(f"Cannot shard {args.output_format} features by rows")
     DATABASE, TABLE, region = args.database, args.table, args.region
-
-    boto3.setup_default_session(region_name=f"{region}")
-    df = wr.athena.read_sql_query(
-        f'SELECT * FROM "{TABLE}"', database=DATABASE, ctas_approach=False
+    os.makedirs(os.path.join(args.base_dir, "infer"), exist_ok=True)
+    metrics = Metrics(
+        os.path.join(args.base_dir, "infer", METRICS_FILE),
+        profile_span=args.profile_span,
     )
 
-    df = df[columns]
-    df = df.astype(col_type)
-    logger.info(df.dtypes)
+    infer_dir = os.path.join(args.base_dir, "infer")
+    transformer_dir = os.path.join(args.base_dir, "transformer")
+    clusterer_path = os.path.join(transformer_dir, CLUSTERER_FILE)
+    with metrics.span("load"):
+        assigner = None
+        if args.cluster:
+            logger.info("Loading cluster assigner")
+            assigner = joblib.load(clusterer_path)
 
-    df = df.drop(["area code", "phone"], 1)
-    df = df.dropna()
+        logger.info("Load Preprocessing Model")
+        preprocess = load_transform(transformer_dir)
 
-    if args.coxph:
-        del df["account length"]
+        index, stamp = None, None
+        if args.incremental:
+            # rows scored by another model are not reused
+            index, stamp = load_index(
+                args.base_dir,
+                args.previous_dir,
+                args.cluster,
+                args.coxph,
+                paths=[incremental_model_path(args)],
+            )
 
-    # no fit predict method currently supported for DenseClus
-    # See: https://github.com/awslabs/amazon-denseclus/issues/4
-    if args.cluster:
+    test_features_output_path = features_path(
+        infer_dir, "infer_features", args.output_format
+    )
 
-        logger.info("Clustering data")
-        clf = DenseClus()
-        clf.fit(df)
-        logger.info("Clusters fit")
+    # the cached rows are not keyed, incremental runs read the table
+    cache, key = None, None
+    if index is None:
+        cache, key = open_data_cache(args, clusterer_path, metrics)
 
-        df["segments"] = clf.score()
-        df["segments"] = df["segments"].astype(str)
+    def build():
+        chunks = prefetch(
+            iter_table(
+                DATABASE, TABLE, region, args.chunksize, source_path=args.source_path
+            )
+        )
+        if index is not None:
+            keys_path = os.path.join(infer_dir, KEYS_FILE)
+            chunks = keyed_batches(chunks, index, keys_path, args.coxph)
+        return (prepare_batch(df, args.coxph, assigner) for df in chunks)
 
-    logger.info("Load Preprocessing Model")
-    preprocess = joblib.load("/opt/ml/processing/transformer/preprocessor.joblib")
+    batches = cached_batches(cache, key, build, args.chunksize)
 
     logger.info("Running feature engineering transformations")
-    test_features = preprocess.transform(df)
-
-    logger.info(f"Infer data shape after preprocessing: {test_features.shape}")
+    # reading, transforming and writing overlap, so they are a single span
+    with metrics.span("transform") as span, FeatureWriter(
+        test_features_output_path,
+        header=False,
+        output_format=args.output_format,
+        has_target=False,
+    ) as writer:
+        write_overlapped(transform_batches(batches, preprocess), writer)
+        span["rows"] = writer.rows
+    if not writer.rows:
+        # e.g. no customer changed, leave an empty file rather than none
+        open(test_features_output_path, "w").close()
 
-    test_features_output_path = os.path.join(
-        "/opt/ml/processing/infer", "infer_features.csv"
+    logger.info(
+        f"Infer data shape after preprocessing: ({writer.rows}, "
+        f"{len(writer.feature_names or [])})"
     )
-    if isinstance(test_features, pd.DataFrame):
-        test_features.to_csv(test_features_output_path, header=False, index=False)
-    else:
-        pd.DataFrame(test_features).to_csv(
-            test_features_output_path, header=False, index=False
-        )
+
+    if index is not None:
+        with metrics.span("index", rows=index.rows):
+            index.write(os.path.join(infer_dir, INDEX_FILE), stamp)
+        logger.info(f"Transformed {index.changed} of {index.rows} rows")
+
+    if sharded:
+        with metrics.span("shard", rows=writer.rows):
+            shards = shard_lines(
+                test_features_output_path, args.num_shards, args.max_shard_bytes
+            )
+            manifest_path = os.path.join(infer_dir, "infer_features.manifest")
+            write_manifest(manifest_path, shards, args.shard_prefix)
+        logger.info(f"Split features into {len(shards)} parts, see {manifest_path}")
 
 
 if __name__ == "__main__":
@@ -130,6 +462,77 @@ if __name__ == "__main__":
         type=bool,
         help="Run clusters as part of preprocessing",
     )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="csv",
+        choices=OUTPUT_FORMATS,
+        help="Format of the feature file, Batch Transform reads csv or libsvm",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Number of rows read, transformed and written at a time",
+    )
+    parser.add_argument(
+        "--source-path",
+        type=str,
+        default=None,
+        help="Local CSV/Parquet file or directory to read instead of Athena",
+    )
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=None,
+        help="Split the features into at least this many part files",
+    )
+    parser.add_argument(
+        "--max-shard-bytes",
+        type=int,
+        default=None,
+        help="Maximum size of a part file, e.g. the transform MaxPayloadInMB",
+    )
+    parser.add_argument(
+        "--shard-prefix",
+        type=str,
+        default=None,
+        help="S3 prefix of the part files written into the manifest",
+    )
+    parser.add_argument(
+        "--data-cache",
+        type=str,
+        default=DATA_CACHE,
+        help="Local directory or S3 prefix caching the rows ready to transform",
+    )
+    parser.add_argument(
+        "--data-cache-max-bytes", type=int, default=DATA_CACHE_MAX_BYTES
+    )
+    parser.add_argument(
+        "--incremental",
+        type=bool,
+        default=False,
+        help="Only transform rows new or changed since the previous run",
+    )
+    parser.add_argument(
+        "--previous-dir",
+        type=str,
+        default=None,
+        help="Directory with the infer outputs of the previous run",
+    )
+    parser.add_argument(
+        "--model-path",
+        type=str,
+        default=None,
+        help="Model archive an incremental run's row index is stamped with",
+    )
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
     args = parser.parse_args()
 
     main(args)
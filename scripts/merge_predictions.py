@@ -0,0 +1,183 @@
+"""
+Merge the Batch Transform predictions of an incremental run into scores.
+
+With `--incremental True`, `inferpreprocessing.py` only writes the features
+of the customers that are new or changed since the previous run, with their
+keys in `infer_keys.csv` in the order of the feature rows. Batch Transform
+predicts one line per feature row, so the predictions are joined to the keys
+by position. The previous scores of the customers that are still in the
+table and did not change are then appended, as `scoring.py` does, so
+`scores.csv` covers the whole table again.
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import List
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+from dependencies import ensure_installed
+
+if __name__ == "__main__":
+    ensure_installed(["scikit-learn", "pyarrow"])
+
+import numpy as np
+import pandas as pd
+from inferpreprocessing import KEYS_FILE
+from metrics import METRICS_FILE, Metrics
+from row_index import INDEX_FILE, KEY_COLUMNS, row_keys
+from scoring import merge_previous
+
+MANIFEST_FILE = "infer_features.manifest"
+
+
+def prediction_files(infer_dir: str, results_dir: str) -> List[str]:
+    """Batch Transform output files in the order of the feature rows
+
+    :param infer_dir: outputs of the inference preprocessing
+    :type infer_dir: str
+    :param results_dir: outputs of the transform job
+    :type results_dir: str
+    :raises FileNotFoundError: when an output file is missing
+    :return: one `.out` file per part listed in the manifest, or the output
+     of the single feature file
+    :rtype: List[str]
+    """
+    manifest_path = os.path.join(infer_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            names = json.load(f)[1:]
+    else:
+        # an empty feature file has nothing to transform
+        names = [
+            name
+            for name in sorted(os.listdir(infer_dir))
+            if name.startswith("infer_features.")
+            and os.path.getsize(os.path.join(infer_dir, name))
+        ]
+    paths = [os.path.join(results_dir, f"{name}.out") for name in names]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"No transform output {missing[0]}")
+    return paths
+
+
+def join_predictions(
+    keys_path: str, paths: List[str], scores_path: str, column: str
+) -> pd.Index:
+    """Write the keys of the transformed rows next to their predictions
+
+    :param keys_path: `infer_keys.csv` of the inference preprocessing
+    :type keys_path: str
+    :param paths: Batch Transform output files, see `prediction_files`
+    :type paths: List[str]
+    :param scores_path: output scores file
+    :type scores_path: str
+    :param column: name of the prediction column
+    :type column: str
+    :raises ValueError: when the predictions and the keys differ in number
+    :return: keys of the scored customers, see `row_keys`
+    :rtype: pd.Index
+    """
+    keys = pd.read_csv(keys_path, dtype={name: str for name in KEY_COLUMNS})
+    predictions = [
+        pd.read_csv(path, header=None, usecols=[0])[0].values
+        for path in paths
+        if os.path.getsize(path)
+    ]
+    rows = sum(len(values) for values in predictions)
+    if rows != len(keys):
+        raise ValueError(f"{rows} predictions for the {len(keys)} rows of {keys_path}")
+    scores = keys.copy()
+    scores[column] = np.concatenate(predictions) if predictions else np.empty(0)
+    scores.to_csv(scores_path, index=False)
+    return pd.Index(row_keys(keys))
+
+
+def main(args):
+    """
+    Merges the Batch Transform predictions of an incremental run
+        1. Joins the predictions of every transform output file, in manifest
+        order, to the keys in `infer_keys.csv`
+        2. Appends the previous scores of the customers in `row_index.parquet`
+        that were not transformed again, dropping the customers no longer
+        in the table
+
+    Args:
+        coxph (bool): Flag indicating that it's a cox proportional hazard model,
+        default False
+        chunksize (int): Number of previous scores read at a time, default
+        100000
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        infer-dir (str): Outputs of the incremental inference preprocessing,
+        default base-dir/infer
+        results-dir (str): Outputs of the transform job, default
+        base-dir/inference_result
+        previous-dir (str): Directory with the `scores` outputs of the
+        previous run, default base-dir/previous
+        output-name (str): Name of the scores file, default scores.csv
+
+    The time, CPU and peak memory of every phase are written to
+    `scores/metrics.json`.
+    """
+    logger.info(f"Received arguments {args}")
+    infer_dir = args.infer_dir or os.path.join(args.base_dir, "infer")
+    results_dir = args.results_dir or os.path.join(args.base_dir, "inference_result")
+    previous_dir = args.previous_dir or os.path.join(args.base_dir, "previous")
+    output_dir = os.path.join(args.base_dir, "scores")
+    os.makedirs(output_dir, exist_ok=True)
+    metrics = Metrics(os.path.join(output_dir, METRICS_FILE))
+
+    keys_path = os.path.join(infer_dir, KEYS_FILE)
+    if not os.path.exists(keys_path):
+        raise FileNotFoundError(
+            f"No {keys_path}, run the inference preprocessing with --incremental"
+        )
+    scores_path = os.path.join(output_dir, args.output_name)
+    # the Cox model predicts the relative hazard, not a probability
+    column = "risk" if args.coxph else "probability"
+    with metrics.span("join") as span:
+        paths = prediction_files(infer_dir, results_dir)
+        scored = join_predictions(keys_path, paths, scores_path, column)
+        span["rows"] = len(scored)
+
+    previous_path = os.path.join(previous_dir, args.output_name)
+    with metrics.span("merge") as span:
+        if os.path.exists(previous_path):
+            # customers of the current table that were not transformed again
+            table = pd.read_parquet(
+                os.path.join(infer_dir, INDEX_FILE), columns=["key"]
+            )
+            unchanged = pd.Index(table["key"]).difference(scored)
+            span["rows"] = merge_previous(
+                previous_path, scores_path, unchanged, args.chunksize, header=False
+            )
+    logger.info(f"Merged {len(scored)} new predictions into {scores_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--coxph", type=bool, default=False)
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Number of previous scores read at a time",
+    )
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument("--infer-dir", type=str, default=None)
+    parser.add_argument("--results-dir", type=str, default=None)
+    parser.add_argument(
+        "--previous-dir",
+        type=str,
+        default=None,
+        help="Directory with the scores outputs of the previous run",
+    )
+    parser.add_argument("--output-name", type=str, default="scores.csv")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,135 @@
+"""
+Per-phase timing and memory metrics of the processing scripts.
+
+`Metrics.span` is a context manager around a phase of a script's `main`. It
+records the wall clock time, the CPU time of the process and of the worker
+processes it waited for, the peak RSS of the process and how much the phase
+raised it, and the rows the phase handled. The spans are written to
+`metrics.json` after every phase, so a failed job still reports where its
+time went up to the failure.
+
+Naming a span with `--profile-span` also runs cProfile over it and dumps the
+profile as `<span>.prof` next to `metrics.json`, to read with `pstats` or
+snakeviz.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+METRICS_FILE = "metrics.json"
+
+
+def _usage():
+    return (
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+    )
+
+
+def _megabytes(max_rss: int) -> float:
+    # ru_maxrss is in kilobytes on Linux, where the processing jobs run
+    return max_rss / 1024
+
+
+class Metrics:
+    """Spans of the phases of a script, written to a JSON file
+
+    :param path: output path of the metrics, usually `metrics.json` next to
+     the script's other outputs
+    :type path: str
+    :param profile_span: name of a span to profile with cProfile,
+     defaults to None
+    :type profile_span: str, optional
+    """
+
+    def __init__(self, path: str, profile_span: Optional[str] = None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.profile_span = profile_span
+        self.spans = []
+        self._open = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, rows: Optional[int] = None) -> Iterator[dict]:
+        """Measure a phase
+
+        The yielded record can be updated in the phase, e.g. with the
+        `rows` it handled once they are known.
+
+        :param name: name of the phase
+        :type name: str
+        :param rows: rows the phase handles, defaults to None
+        :type rows: int, optional
+        :return: record of the span
+        :rtype: Iterator[dict]
+        """
+        record = {"name": name}
+        if self._open:
+            record["parent"] = self._open[-1]["name"]
+        if rows is not None:
+            record["rows"] = rows
+        self.spans.append(record)
+        self._open.append(record)
+
+        profiler = cProfile.Profile() if name == self.profile_span else None
+        own, children = _usage()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as error:
+            record["error"] = type(error).__name__
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile_path = os.path.join(os.path.dirname(self.path), f"{name}.prof")
+                profiler.dump_stats(profile_path)
+                record["profile"] = profile_path
+            own_end, children_end = _usage()
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = (
+                time.process_time()
+                - cpu
+                + children_end.ru_utime
+                - children.ru_utime
+                + children_end.ru_stime
+                - children.ru_stime
+            )
+            record["max_rss_mb"] = _megabytes(own_end.ru_maxrss)
+            record["rss_growth_mb"] = _megabytes(own_end.ru_maxrss - own.ru_maxrss)
+            if children_end.ru_maxrss:
+                record["children_max_rss_mb"] = _megabytes(children_end.ru_maxrss)
+            self._open.pop()
+            logger.info(
+                f"{name}: {record['wall_seconds']:.1f}s wall, "
+                f"{record['cpu_seconds']:.1f}s CPU, "
+                f"peak RSS {record['max_rss_mb']:.0f} MB"
+                + (f", {record['rows']} rows" if "rows" in record else "")
+            )
+            self.write()
+
+    def write(self):
+        """Write the spans so far to `path`"""
+        own, _ = _usage()
+        with open(self.path, "w") as f:
+            json.dump(
+                {
+                    "wall_seconds": time.perf_counter() - self._start,
+                    "max_rss_mb": _megabytes(own.ru_maxrss),
+                    "spans": self.spans,
+                },
+                f,
+                indent=2,
+            )
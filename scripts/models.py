@@ -0,0 +1,161 @@
+"""
+Cached loading of the trained XGBoost model.
+
+`model.tar.gz` is extracted once into a cache directory named after the
+SHA-256 of the archive, so every later evaluation or scoring call on the same
+artifact skips the extraction. Boosters are also kept in memory by that
+digest: loading the same model again in a process costs one hash of the
+archive.
+
+The model file may be a pickled booster, as the SageMaker XGBoost container
+saves it, or XGBoost's native JSON or binary format. The format is told from
+the first bytes of the file, not its name. UBJSON models need XGBoost 1.6 or
+later, and the processing image pins 1.3.3, the release closest to the 1.2
+training container whose pickled boosters it must read, so they are not
+supported.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+MODEL_CACHE_DIR = os.environ.get(
+    "MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "churn-model-cache")
+)
+MODEL_NAME = "xgboost-model"
+HASH_CHUNK = 1 << 20
+
+_boosters: Dict[Tuple[str, str], object] = {}
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in 1 MiB chunks
+
+    :param path: file to hash
+    :type path: str
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_format(path: str) -> str:
+    """Format of a saved model: `pickle`, `json` or `binary`
+
+    :param path: model file
+    :type path: str
+    :return: format name
+    :rtype: str
+    """
+    with open(path, "rb") as f:
+        head = f.read(64)
+    if head[:1] == b"\x80":
+        return "pickle"
+    if head.lstrip()[:1] == b"{":
+        return "json"
+    return "binary"
+
+
+def _extract(archive: str, target: str):
+    """Extract the regular files of an archive, all of them inside `target`"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(target))
+    root = os.path.realpath(staging)
+    try:
+        with tarfile.open(archive) as tar:
+            members = [m for m in tar.getmembers() if m.isfile()]
+            for member in members:
+                path = os.path.realpath(os.path.join(staging, member.name))
+                if os.path.commonpath([root, path]) != root:
+                    raise ValueError(f"{member.name} is outside of the archive")
+            tar.extractall(path=staging, members=members)
+        # another process may have extracted the same archive meanwhile
+        os.rename(staging, target)
+    except OSError:
+        if not os.path.isdir(target):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _model_file(directory: str, model_name: str) -> str:
+    """Path of the model file in an extracted archive"""
+    for name in (model_name, f"{model_name}.json"):
+        if os.path.isfile(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+    files = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+    ]
+    if len(files) != 1:
+        raise FileNotFoundError(f"No model {model_name} in {directory}")
+    return files[0]
+
+
+def _read_booster(path: str):
+    """Load a booster from a model file of any supported format"""
+    import xgboost
+
+    fmt = model_format(path)
+    logger.info(f"Loading {fmt} model {path}")
+    if fmt == "pickle":
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+        # a scikit-learn wrapper, e.g. XGBClassifier, scores with its booster
+        return model.get_booster() if hasattr(model, "get_booster") else model
+    booster = xgboost.Booster()
+    booster.load_model(path)
+    return booster
+
+
+def load_model(
+    path: str, model_name: str = MODEL_NAME, cache_dir: str = MODEL_CACHE_DIR
+):
+    """Load the booster of a model archive or model file, through the cache
+
+    The returned booster is shared with every later call on the same
+    artifact, callers should not change its parameters concurrently.
+
+    :param path: `model.tar.gz` or a model file
+    :type path: str
+    :param model_name: name of the model file in the archive,
+     defaults to xgboost-model
+    :type model_name: str, optional
+    :param cache_dir: directory of the extracted archives, defaults to
+     `MODEL_CACHE_DIR`
+    :type cache_dir: str, optional
+    :return: trained booster
+    :rtype: xgboost.Booster
+    """
+    digest = file_digest(path)
+    key = (digest, model_name)
+    if key in _boosters:
+        logger.info(f"Model {path} already loaded")
+        return _boosters[key]
+
+    if tarfile.is_tarfile(path):
+        directory = os.path.join(cache_dir, digest)
+        if os.path.isdir(directory):
+            logger.info(f"Using model extracted in {directory}")
+        else:
+            logger.info(f"Extracting model from {path} into {directory}")
+            _extract(path, directory)
+        model_file = _model_file(directory, model_name)
+    else:
+        model_file = path
+
+    _boosters[key] = _read_booster(model_file)
+    return _boosters[key]
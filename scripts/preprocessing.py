@@ -1,38 +1,60 @@
 import argparse
 import logging
 import os
-import subprocess
-import sys
+import tempfile
 import warnings
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
 
 import numpy as np
+from dependencies import ensure_installed
 
-
-def install(package):
-    subprocess.check_call(
-        [sys.executable, "-m", "pip", "install", package],
-        # quietly
-        stdout=open(os.devnull, "wb"),
+if __name__ == "__main__":
+    ensure_installed(
+        ["scikit-learn", "awswrangler", "pyarrow", "hdbscan", "Amazon-DenseClus"]
     )
 
-
-install("scikit-learn==0.24.1")
-install("awswrangler==2.4.0")
-os.system("conda install -c conda-forge hdbscan -y")
-install("Amazon-DenseClus==0.0.7")
-
-import awswrangler as wr
-import boto3
 import joblib
 import pandas as pd
-from denseclus import DenseClus
+from compiled_transform import (
+    CompiledTransform,
+    export_transform,
+    transform_with_target,
+)
+from data_cache import (
+    DATA_CACHE,
+    DATA_CACHE_MAX_BYTES,
+    cache_key,
+    cached_frame,
+    code_digest,
+    open_cache,
+)
+from features_io import (
+    OUTPUT_FORMATS,
+    SPARSE_FORMATS,
+    FeatureWriter,
+    features_path,
+    prepend_target,
+    write_features,
+)
+from metrics import METRICS_FILE, Metrics
+from segments import CLUSTERER_FILE, cluster_segments
 from sklearn.compose import ColumnTransformer
 from sklearn.exceptions import DataConversionWarning
 from sklearn.impute import SimpleImputer
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sources import (
+    apply_schema,
+    compact_types,
+    iter_table,
+    read_table,
+    resolve_tables,
+    source_fingerprint,
+    table_source,
+)
+from splits import SPLIT_COLUMN, SPLIT_MODES, hash_split, key_fractions
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -66,6 +88,8 @@ col_type = {
 columns = list(col_type.keys())
 target_col = "churn?"
 class_labels = ["True.", "False."]
+# hash partitions the chunked mode de-duplicates the rows in
+DEDUPE_PARTITIONS = 64
 
 
 def split_col_dtype(col_type: dict, target_label: str) -> Tuple[List[str], List[str]]:
@@ -89,6 +113,570 @@ def split_col_dtype(col_type: dict, target_label: str) -> Tuple[List[str], List[
     return cat, num
 
 
+def build_preprocessor(
+    numerical_idx: List[str],
+    categorical_idx: List[str],
+    categories="auto",
+    sparse: bool = False,
+    dtype=np.float64,
+) -> ColumnTransformer:
+    """Build the unfitted feature engineering transformer
+
+    With `sparse` set, the one hot columns stay a sparse matrix and the
+    transformer outputs a CSR matrix instead of a dense array.
+
+    :param numerical_idx: numerical columns to impute and scale
+    :type numerical_idx: List[str]
+    :param categorical_idx: categorical columns to impute and one hot encode
+    :type categorical_idx: List[str]
+    :param categories: categories for the one hot encoder, defaults to "auto"
+    :type categories: str or List[List[str]], optional
+    :param sparse: output a sparse matrix, defaults to False
+    :type sparse: bool, optional
+    :param dtype: type of the one hot columns, defaults to float64
+    :type dtype: np.dtype, optional
+    :return: ColumnTransformer ready to be fit
+    :rtype: ColumnTransformer
+    """
+    numeric_transformer = Pipeline(
+        steps=[
+            ("imputer", SimpleImputer(strategy="median")),
+            ("scaler", StandardScaler()),
+        ]
+    )
+
+    categorical_transformer = Pipeline(
+        steps=[
+            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
+            (
+                "onehot",
+                OneHotEncoder(
+                    categories=categories,
+                    sparse=sparse,
+                    handle_unknown="ignore",
+                    dtype=dtype,
+                ),
+            ),
+        ]
+    )
+
+    return ColumnTransformer(
+        [
+            ("numerical", numeric_transformer, numerical_idx),
+            ("categorical", categorical_transformer, categorical_idx),
+        ],
+        remainder="passthrough",
+        sparse_threshold=1.0 if sparse else 0.0,
+    )
+
+
+def output_dir(args, name: str) -> str:
+    """Directory of the train, test or transformer outputs
+
+    :param args: parsed script arguments
+    :param name: train, test or transformer
+    :type name: str
+    :return: directory under the base directory, in the `output_prefix`
+     subdirectory when one is set
+    :rtype: str
+    """
+    directory = os.path.join(args.base_dir, name)
+    if args.output_prefix:
+        return os.path.join(directory, args.output_prefix)
+    return directory
+
+
+def table_args(args, table: str, output_prefix: Optional[str]):
+    """Arguments of preprocessing a single table
+
+    :param args: parsed script arguments
+    :param table: table name
+    :type table: str
+    :param output_prefix: subdirectory of the table's outputs
+    :type output_prefix: str, optional
+    :return: arguments with the table, its source path and output prefix
+    :rtype: argparse.Namespace
+    """
+    return argparse.Namespace(
+        **{
+            **vars(args),
+            "table": table,
+            "source_path": table_source(args.source_path, table),
+            "output_prefix": output_prefix,
+        }
+    )
+
+
+def clean_chunk(
+    df: pd.DataFrame, compact: bool = False, split: bool = False
+) -> pd.DataFrame:
+    """Apply the schema, drop id columns and missing rows, binarize the target
+
+    :param df: raw rows from the source table
+    :type df: pd.DataFrame
+    :param compact: use the compact types of `apply_schema`, defaults to False
+    :type compact: bool, optional
+    :param split: add the `SPLIT_COLUMN` fraction of every row's customer
+     before the id columns are dropped, defaults to False
+    :type split: bool, optional
+    :return: cleaned rows
+    :rtype: pd.DataFrame
+    """
+    df = apply_schema(df, col_type, compact=compact)
+    if split:
+        df[SPLIT_COLUMN] = key_fractions(df)
+    df = df.drop(["area code", "phone"], 1)
+    df = df.dropna()
+    df[target_col] = (
+        df[target_col]
+        .replace(class_labels, [1, 0])
+        .astype("int8" if compact else "int64")
+    )
+    return df
+
+
+def row_partitions(df: pd.DataFrame, partitions: int) -> np.ndarray:
+    """Hash partition of every row, equal rows always fall in the same one
+
+    The split fraction of a row's customer is not part of the row.
+
+    :param df: cleaned chunk
+    :type df: pd.DataFrame
+    :param partitions: number of partitions
+    :type partitions: int
+    :return: partition of every row
+    :rtype: np.ndarray
+    """
+    hashes = pd.util.hash_pandas_object(
+        df.drop(columns=SPLIT_COLUMN, errors="ignore"), index=False
+    ).values
+    return (hashes % np.uint64(partitions)).astype(np.int64)
+
+
+def spill_partitions(chunks, args, spill_dir: str) -> List[List[str]]:
+    """Clean the source chunks and spill their rows by hash partition
+
+    Rows duplicated within a chunk are dropped here, rows duplicated across
+    chunks land in the same partition and are dropped by `read_partition`.
+
+    :param chunks: raw source chunks
+    :param args: parsed script arguments
+    :param spill_dir: directory the partition files are written to
+    :type spill_dir: str
+    :return: files of every partition, in source order
+    :rtype: List[List[str]]
+    """
+    files = [[] for _ in range(args.dedupe_partitions)]
+    for i, chunk in enumerate(chunks):
+        chunk = clean_chunk(chunk, args.compact_dtypes, split=args.split == "hash")
+        chunk = drop_duplicate_rows(chunk)
+        partition = row_partitions(chunk, args.dedupe_partitions)
+        for p in np.unique(partition):
+            path = os.path.join(spill_dir, f"partition-{p:04d}-{i:06d}.parquet")
+            chunk[partition == p].to_parquet(path, index=False)
+            files[p].append(path)
+    return files
+
+
+def drop_duplicate_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the first of every set of rows with equal values
+
+    :param df: cleaned rows
+    :type df: pd.DataFrame
+    :return: rows without duplicates
+    :rtype: pd.DataFrame
+    """
+    values = df.drop(columns=SPLIT_COLUMN, errors="ignore")
+    return df[~values.duplicated().values]
+
+
+def read_partition(files: List[str]) -> pd.DataFrame:
+    """Rows of a partition without duplicates, removing its files
+
+    Rows are compared by value, so distinct rows with the same hash are
+    both kept.
+
+    :param files: partition files in source order
+    :type files: List[str]
+    :return: rows of the partition
+    :rtype: pd.DataFrame
+    """
+    parts = [pd.read_parquet(path) for path in files]
+    for path in files:
+        os.remove(path)
+    return drop_duplicate_rows(pd.concat(parts, ignore_index=True))
+
+
+def sample_rows(
+    sample: pd.DataFrame,
+    sample_keys: np.ndarray,
+    rows: pd.DataFrame,
+    rng: np.random.Generator,
+    size: int,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Bottom-k sampling, keeps a uniform sample of every row offered so far
+
+    :param sample: rows sampled so far, None on the first call
+    :type sample: pd.DataFrame
+    :param sample_keys: random keys of the sampled rows
+    :type sample_keys: np.ndarray
+    :param rows: new rows to offer to the sample
+    :type rows: pd.DataFrame
+    :param rng: random generator drawing the keys
+    :type rng: np.random.Generator
+    :param size: maximum number of rows in the sample
+    :type size: int
+    :return: updated sample and its keys
+    :rtype: Tuple[pd.DataFrame, np.ndarray]
+    """
+    keys = rng.random(len(rows))
+    if sample is not None:
+        rows = pd.concat([sample, rows])
+        keys = np.concatenate((sample_keys, keys))
+    keep = np.argsort(keys, kind="stable")[:size]
+    return rows.iloc[keep], keys[keep]
+
+
+def spill_chunks(args, spill_dir: str) -> dict:
+    """Stream the source once, spilling cleaned train and test chunks to disk
+
+    The source chunks are first spilled by hash partition, see
+    `spill_partitions`, so that every partition can be de-duplicated on its
+    own. A partition holds about 1 / `dedupe-partitions` of the unique rows,
+    which bounds the memory of this step. Every de-duplicated partition is
+    then split and spilled as a chunk.
+
+    Alongside the spill, accumulates everything needed to fit the
+    preprocessor: the scaler statistics and the one hot vocabulary over every
+    training row, and a bounded uniform sample of training rows.
+
+    :param args: parsed script arguments
+    :param spill_dir: directory the cleaned chunks are written to
+    :type spill_dir: str
+    :return: spilled file paths, row counts and fit state
+    :rtype: dict
+    """
+    rng = np.random.default_rng(int(args.random_state))
+    state = {
+        "spilled": {"train": [], "test": []},
+        "rows": {"train": 0, "test": 0},
+        "positive_examples": 0,
+        "scaler": StandardScaler(),
+        "sample": None,
+        "sample_keys": None,
+    }
+
+    chunks = iter_table(
+        args.database,
+        args.table,
+        args.region,
+        chunksize=args.chunksize,
+        source_path=args.source_path,
+        dtype=compact_types(col_type) if args.compact_dtypes else None,
+    )
+    partition_dir = os.path.join(spill_dir, "partitions")
+    os.makedirs(partition_dir)
+    partitions = spill_partitions(chunks, args, partition_dir)
+    for i, files in enumerate(partitions):
+        if not files:
+            continue
+        chunk = read_partition(files)
+        if args.split == "hash":
+            is_test = chunk.pop(SPLIT_COLUMN).values < args.train_test_split_ratio
+        else:
+            is_test = rng.random(len(chunk)) < args.train_test_split_ratio
+        state["positive_examples"] += int(chunk[target_col].sum())
+
+        if "numerical_idx" not in state:
+            X = chunk.drop(target_col, axis=1)
+            state["numerical_idx"] = X.select_dtypes(
+                exclude=["object", "category"]
+            ).columns.tolist()
+            state["categorical_idx"] = X.select_dtypes(
+                exclude="number"
+            ).columns.tolist()
+            state["levels"] = {col: set() for col in state["categorical_idx"]}
+
+        for name, part in (("train", chunk[~is_test]), ("test", chunk[is_test])):
+            if part.empty:
+                continue
+            path = os.path.join(spill_dir, f"{name}-{i:06d}.parquet")
+            part.to_parquet(path, index=False)
+            state["spilled"][name].append(path)
+            state["rows"][name] += len(part)
+
+        train = chunk[~is_test]
+        if train.empty:
+            continue
+        state["scaler"].partial_fit(train[state["numerical_idx"]].values)
+        for col in state["categorical_idx"]:
+            state["levels"][col].update(train[col].dropna().astype(str).unique())
+        state["sample"], state["sample_keys"] = sample_rows(
+            state["sample"], state["sample_keys"], train, rng, args.fit_sample_size
+        )
+
+    if state["sample"] is None:
+        raise ValueError("No training rows left after cleaning")
+    return state
+
+
+def cluster_sample(args, state: dict):
+    """Cluster the bounded training sample gathered by `spill_chunks`
+
+    Adds the `segments` column to the sample and its labels to the one hot
+    vocabulary, and saves the assigner that labels the spilled chunks.
+
+    :param args: parsed script arguments
+    :param state: spilled chunks and fit state from `spill_chunks`
+    :type state: dict
+    :return: fitted segment assigner
+    :rtype: SegmentAssigner
+    """
+    sample = state["sample"]
+    logger.info("Clustering data")
+    segments, assigner = cluster_segments(
+        sample,
+        assign_columns=sample.columns.drop(target_col).tolist(),
+        sample_size=args.cluster_sample_size,
+        stratify=target_col,
+        random_state=int(args.random_state),
+    )
+    logger.info("Clusters fit")
+    joblib.dump(assigner, os.path.join(output_dir(args, "transformer"), CLUSTERER_FILE))
+
+    state["sample"] = sample.assign(segments=segments)
+    state["categorical_idx"] = state["categorical_idx"] + ["segments"]
+    state["levels"]["segments"] = set(assigner.knn_.classes_)
+    return assigner
+
+
+def clean_table(args, metrics: Metrics) -> pd.DataFrame:
+    """Read the source table, clean it and assign its rows to segments
+
+    Saves the fitted segment assigner with the transformers when clustering.
+
+    :param args: parsed script arguments
+    :param metrics: spans of the script
+    :type metrics: Metrics
+    :return: cleaned rows with the binary target
+    :rtype: pd.DataFrame
+    """
+    with metrics.span("read") as span:
+        df = read_table(
+            args.database,
+            args.table,
+            args.region,
+            source_path=args.source_path,
+            dtype=compact_types(col_type) if args.compact_dtypes else None,
+        )
+        span["rows"] = len(df)
+    with metrics.span("clean") as span:
+        df = apply_schema(df, col_type, compact=args.compact_dtypes)
+        logger.info(df.dtypes)
+        fractions = None
+        if args.split == "hash":
+            fractions = pd.Series(key_fractions(df), index=df.index)
+
+        df = df.drop(["area code", "phone"], 1)
+        df = df.dropna()
+        df = df.drop_duplicates()
+
+        # fix class labels to binary
+        df[target_col] = df[target_col].replace(class_labels, [1, 0])
+        span["rows"] = len(df)
+
+    # no fit predict method currently supported for DenseClus
+    # See: https://github.com/awslabs/amazon-denseclus/issues/4
+    # rows outside the clustered sample are labelled by the SegmentAssigner
+    if args.cluster:
+
+        logger.info("Clustering data")
+        with metrics.span("cluster", rows=len(df)):
+            segments, assigner = cluster_segments(
+                df,
+                assign_columns=df.columns.drop([target_col]).tolist(),
+                sample_size=args.cluster_sample_size,
+                stratify=target_col,
+                random_state=int(args.random_state),
+            )
+        logger.info("Clusters fit")
+
+        joblib.dump(
+            assigner, os.path.join(output_dir(args, "transformer"), CLUSTERER_FILE)
+        )
+
+        df["segments"] = segments
+    # added after clustering, which fits on every column
+    if fractions is not None:
+        df[SPLIT_COLUMN] = fractions.loc[df.index].values
+    return df
+
+
+def split_rows(df: pd.DataFrame, args) -> list:
+    """Split the cleaned rows into train and test features and targets
+
+    :param df: cleaned rows, with the `SPLIT_COLUMN` of the hash split
+    :type df: pd.DataFrame
+    :param args: parsed script arguments
+    :return: train and test features, train and test targets
+    :rtype: list
+    """
+    X, y = df.drop(target_col, axis=1), df[target_col]
+    if args.split == "hash":
+        return hash_split(
+            X.drop(columns=SPLIT_COLUMN),
+            y,
+            fractions=X[SPLIT_COLUMN].values,
+            test_size=args.train_test_split_ratio,
+            log_classes=y,
+        )
+    return train_test_split(
+        X, y, test_size=args.train_test_split_ratio, random_state=args.random_state
+    )
+
+
+def main_chunked(args, metrics: Metrics):
+    """
+    Runs preprocessing out of core, holding at most `chunksize` source rows
+    plus a bounded fit sample in memory
+        1. Streams the source in chunks, cleaning each one and spilling it
+        to local disk by hash partition, then de-duplicates every partition,
+        randomly splits it and spills it again
+        2. Fits the preprocessor, with the scaler statistics accumulated over
+        every training row, the one hot vocabulary collected over every
+        training row and the median imputer fit on a uniform sample
+        3. Streams the spilled chunks through the transform and appends them
+        to the train and test feature files
+
+    With clustering, DenseClus is fit on the training sample and the rows
+    of every spilled chunk are assigned to its segments, see `cluster_sample`.
+    The phases are recorded as spans of `metrics`.
+
+    Args:
+        chunksize (int): Number of rows read from the source at a time
+        fit-sample-size (int): Number of training rows kept to fit the
+        imputer, default is 100000
+        dedupe-partitions (int): Number of hash partitions the rows are
+        de-duplicated in, default is 64
+    """
+    with tempfile.TemporaryDirectory() as spill_dir:
+        with metrics.span("spill") as span:
+            state = spill_chunks(args, spill_dir)
+            span["rows"] = state["rows"]["train"] + state["rows"]["test"]
+        rows, positive_examples = state["rows"], state["positive_examples"]
+        logger.info(
+            """Data after cleaning: {} train rows, {} test rows
+            , {} positive examples, {} negative examples""".format(
+                rows["train"],
+                rows["test"],
+                positive_examples,
+                rows["train"] + rows["test"] - positive_examples,
+            )
+        )
+
+        assigner = None
+        if args.cluster:
+            with metrics.span("cluster", rows=len(state["sample"])):
+                assigner = cluster_sample(args, state)
+
+        numerical_idx, categorical_idx = (
+            state["numerical_idx"],
+            state["categorical_idx"],
+        )
+        sample = state["sample"]
+        logger.info(f"Fitting preprocessor on a sample of {len(sample)} rows")
+        preprocessor = build_preprocessor(
+            numerical_idx,
+            categorical_idx,
+            categories=[sorted(state["levels"][col]) for col in categorical_idx],
+            sparse=args.output_format in SPARSE_FORMATS,
+            dtype=np.float32 if args.compact_dtypes else np.float64,
+        )
+        with metrics.span("fit", rows=len(sample)):
+            preprocessor.fit(sample.drop(target_col, axis=1))
+        # the scaler is fit on the sample first, then takes the statistics
+        # accumulated over every training row
+        fitted_scaler = preprocessor.named_transformers_["numerical"]["scaler"]
+        for attr in ("mean_", "var_", "scale_", "n_samples_seen_"):
+            setattr(fitted_scaler, attr, getattr(state["scaler"], attr))
+
+        feature_names = [target_col] + (
+            numerical_idx
+            + preprocessor.transformers_[1][1]["onehot"].get_feature_names().tolist()
+        )
+
+        preprocessor_output_path = os.path.join(
+            output_dir(args, "transformer"), "preprocessor.joblib"
+        )
+        joblib.dump(preprocessor, preprocessor_output_path)
+        compiled = export_transform(preprocessor, output_dir(args, "transformer"))
+        if not args.compact_dtypes or args.output_format in SPARSE_FORMATS:
+            compiled = None
+
+        for name in ("train", "test"):
+            output_path = features_path(
+                output_dir(args, name),
+                f"{name}_features",
+                args.output_format,
+            )
+            logger.info(f"Saving {name} data to {output_path}")
+            with metrics.span(f"transform_{name}", rows=rows[name]), FeatureWriter(
+                output_path, feature_names, output_format=args.output_format
+            ) as writer:
+                for path in state["spilled"][name]:
+                    part = pd.read_parquet(path)
+                    if assigner is not None:
+                        part["segments"] = assigner.predict(part)
+                    X, y = part.drop(target_col, axis=1), part[target_col].values
+                    if compiled is not None:
+                        writer.write(transform_with_target(compiled, X, y))
+                    else:
+                        writer.write(prepend_target(y, preprocessor.transform(X)))
+                    os.remove(path)
+
+
+def main_tables(args, tables: List[str]):
+    """
+    Runs preprocessing for several tables in a pool of processes, each table
+    writing its train, test and transformer outputs, including its
+    `preprocessor.joblib`, into a subdirectory named after it. A failed
+    table does not stop the others, the run fails once all are done.
+
+    Args:
+        n-jobs (int): Tables preprocessed at a time, default the number of
+        tables up to the number of CPUs
+    """
+    n_jobs = args.n_jobs or min(len(tables), os.cpu_count() or 1)
+    os.makedirs(os.path.join(args.base_dir, "transformer"), exist_ok=True)
+    metrics = Metrics(
+        os.path.join(args.base_dir, "transformer", METRICS_FILE),
+        profile_span=args.profile_span,
+    )
+    logger.info(f"Preprocessing {len(tables)} tables on {n_jobs} workers")
+
+    failed = []
+    with metrics.span("tables") as span, ProcessPoolExecutor(
+        max_workers=n_jobs
+    ) as executor:
+        span["tables"] = tables
+        futures = {}
+        for table in tables:
+            prefix = table
+            if args.output_prefix:
+                prefix = os.path.join(args.output_prefix, table)
+            futures[executor.submit(main, table_args(args, table, prefix))] = table
+        for future in as_completed(futures):
+            try:
+                future.result()
+                logger.info(f"Preprocessed table {futures[future]}")
+            except Exception:
+                logger.exception(f"Preprocessing table {futures[future]} failed")
+                failed.append(futures[future])
+        span["failed"] = failed
+    if failed:
+        raise RuntimeError(f"Preprocessing failed for tables {sorted(failed)}")
+
+
 def main(args):
     """
     Runs preprocessing for the example data set
@@ -99,32 +687,92 @@ def main(args):
 
     Args:
         database (str, required): Athena database to query data from
-        table (str, required): Athena table name to query data from
+        table (str, required): Athena table name to query data from, or a
+        comma separated list of names and patterns such as `churn_*`, see
+        `main_tables`
         region (str, required): AWS Region for queries
         train-test-split-ratio (float): Percentage to split the data into
         , default is 25%
         random-state (float): Random seed used for train and test split
         , default is 123
-
-
+        split (str): random shuffles the rows with random-state, hash puts
+        every customer on the side its hashed area code and phone falls on,
+        stable as rows are added, see `splits.py`, default random
+        cluster-sample-size (int): Fit DenseClus on a stratified sample of
+        this many rows and assign the rest, default None fits on all rows
+        source-path (str): Local CSV/Parquet file or directory read instead
+        of Athena, with several tables a path with a `{table}` field such
+        as `data/{table}.csv`, default None
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        output-prefix (str): Subdirectory of the train, test and transformer
+        outputs, default None
+        n-jobs (int): Tables preprocessed at a time, default the number of
+        tables up to the number of CPUs
+        chunksize (int): Process the data out of core in chunks of this many
+        rows, see `main_chunked`, default None
+        output-format (str): Format of the feature files, csv, parquet or
+        libsvm, default csv. libsvm keeps the one hot features sparse end
+        to end
+        compact-dtypes (bool): Parse the source into float32, categorical and
+        the smallest integer columns and write float32 features into a
+        matrix allocated with the target column, default False
+        data-cache (str): Local directory or S3 prefix caching the cleaned
+        and segmented rows by source snapshot, schema and arguments, see
+        `data_cache.py`, default the DATA_CACHE environment variable or no
+        cache. Not used with chunksize
+        data-cache-max-bytes (int): Size the cache is bounded to by evicting
+        the least recently used entries, default 20 GiB
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
+
+    The time, CPU and peak memory of every phase are written to
+    `transformer/metrics.json`.
     """
     logger.debug(f"Received arguments {args}")
-    DATABASE, TABLE, region = args.database, args.table, args.region
-
-    boto3.setup_default_session(region_name=f"{region}")
-    df = wr.athena.read_sql_query(
-        f'SELECT * FROM "{TABLE}"', database=DATABASE, ctas_approach=False
+    tables = resolve_tables(args.database, args.table, args.region, args.source_path)
+    if len(tables) > 1:
+        return main_tables(args, tables)
+    args = table_args(args, tables[0], args.output_prefix)
+
+    for name in ("train", "test", "transformer"):
+        os.makedirs(output_dir(args, name), exist_ok=True)
+    metrics = Metrics(
+        os.path.join(output_dir(args, "transformer"), METRICS_FILE),
+        profile_span=args.profile_span,
     )
-    df = df[columns]
-    df = df.astype(col_type)
-    logger.info(df.dtypes)
-
-    df = df.drop(["area code", "phone"], 1)
-    df = df.dropna()
-    df = df.drop_duplicates()
 
-    # fix class labels to binary
-    df[target_col] = df[target_col].replace(class_labels, [1, 0])
+    if args.chunksize:
+        return main_chunked(args, metrics)
+
+    cache = open_cache(args.data_cache, args.data_cache_max_bytes)
+    key = None
+    if cache is not None:
+        with metrics.span("fingerprint"):
+            key = cache_key(
+                "preprocessing",
+                source_fingerprint(
+                    args.database, args.table, args.region, args.source_path
+                ),
+                col_type,
+                code=code_digest(
+                    "preprocessing", "sources", "segments", "splits", "row_index"
+                ),
+                compact_dtypes=args.compact_dtypes,
+                cluster=args.cluster,
+                cluster_sample_size=args.cluster_sample_size,
+                random_state=args.random_state,
+                split=args.split,
+            )
+    clusterer_path = os.path.join(output_dir(args, "transformer"), CLUSTERER_FILE)
+    with metrics.span("source") as span:
+        df = cached_frame(
+            cache,
+            key,
+            lambda: clean_table(args, metrics),
+            files=[clusterer_path] if args.cluster else [],
+        )
+        span["rows"] = len(df)
 
     negative_examples, positive_examples = df[target_col].value_counts().values
     logger.info(
@@ -134,71 +782,51 @@ def main(args):
         )
     )
 
-    # no fit predict method currently supported for DenseClus
-    # See: https://github.com/awslabs/amazon-denseclus/issues/4
-    if args.cluster:
-
-        logger.info("Clustering data")
-        clf = DenseClus()
-        clf.fit(df)
-        logger.info("Clusters fit")
-
-        df["segments"] = clf.score()
-        df["segments"] = df["segments"].astype(str)
-
     split_ratio = args.train_test_split_ratio
     logger.info(f"Splitting data into train and test sets with ratio {split_ratio}")
-    X_train, X_test, y_train, y_test = train_test_split(
-        df.drop(target_col, axis=1),
-        df[target_col],
-        test_size=split_ratio,
-        random_state=args.random_state,
-    )
+    X_train, X_test, y_train, y_test = split_rows(df, args)
     logger.info(X_train.dtypes)
 
     numerical_idx = X_train.select_dtypes(
         exclude=["object", "category"]
     ).columns.tolist()
 
-    categorical_idx = X_train.select_dtypes(exclude=["float", "int"]).columns.tolist()
+    categorical_idx = X_train.select_dtypes(exclude="number").columns.tolist()
 
-    numeric_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="median")),
-            ("scaler", StandardScaler()),
-        ]
-    )
-
-    categorical_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-            ("onehot", OneHotEncoder(sparse=False, handle_unknown="ignore")),
-        ]
-    )
-
-    preprocessor = ColumnTransformer(
-        [
-            ("numerical", numeric_transformer, numerical_idx),
-            ("categorical", categorical_transformer, categorical_idx),
-        ],
-        remainder="passthrough",
+    sparse = args.output_format in SPARSE_FORMATS
+    preprocessor = build_preprocessor(
+        numerical_idx,
+        categorical_idx,
+        sparse=sparse,
+        dtype=np.float32 if args.compact_dtypes else np.float64,
     )
 
     logger.info("Running preprocessing and feature engineering transformations")
-    train_features = preprocessor.fit_transform(X_train)
-    test_features = preprocessor.transform(X_test)
+    if args.compact_dtypes and not sparse:
+        # the compiled preprocessor writes float32 features straight after
+        # the target, the first column for XGB
+        with metrics.span("fit", rows=len(X_train)):
+            compiled = CompiledTransform.from_preprocessor(preprocessor.fit(X_train))
+        with metrics.span("transform", rows=len(X_train) + len(X_test)):
+            train_features = transform_with_target(compiled, X_train, y_train.values)
+            test_features = transform_with_target(compiled, X_test, y_test.values)
+    else:
+        with metrics.span("fit_transform", rows=len(X_train)):
+            train_features = preprocessor.fit_transform(X_train)
+        with metrics.span("transform", rows=len(X_test)):
+            test_features = preprocessor.transform(X_test)
+
+        # adding back the target as the first columan for XGB
+        train_features = prepend_target(y_train.values, train_features)
+        test_features = prepend_target(y_test.values, test_features)
 
     preprocessor_output_path = os.path.join(
-        "/opt/ml/processing/transformer", "preprocessor.joblib"
+        output_dir(args, "transformer"), "preprocessor.joblib"
     )
     joblib.dump(preprocessor, preprocessor_output_path)
 
-    logger.info(f"train features size {train_features.shape}")
-    logger.info(f"test features size {test_features.shape}")
-
-    # adding back the target as the first columan for XGB
-    train_features = np.hstack((y_train.values.reshape(-1, 1), train_features))
-    test_features = np.hstack((y_test.values.reshape(-1, 1), test_features))
+    logger.info(f"train features size with the target {train_features.shape}")
+    logger.info(f"test features size with the target {test_features.shape}")
 
     # getting the feature names
     feature_names = (
@@ -209,28 +837,35 @@ def main(args):
     feature_names = [target_col] + feature_names
 
     preprocessor_output_path = os.path.join(
-        "/opt/ml/processing/transformer", "preprocessor.joblib"
+        output_dir(args, "transformer"), "preprocessor.joblib"
     )
     joblib.dump(preprocessor, preprocessor_output_path)
+    export_transform(preprocessor, output_dir(args, "transformer"))
 
-    train_features_output_path = os.path.join(
-        "/opt/ml/processing/train", "train_features.csv"
+    train_features_output_path = features_path(
+        output_dir(args, "train"), "train_features", args.output_format
     )
 
-    test_features_output_path = os.path.join(
-        "/opt/ml/processing/test", "test_features.csv"
+    test_features_output_path = features_path(
+        output_dir(args, "test"), "test_features", args.output_format
     )
 
-    logger.info(f"Saving training data to {train_features_output_path}")
-
-    pd.DataFrame(train_features, columns=feature_names).to_csv(
-        train_features_output_path, header=True, index=False
-    )
+    with metrics.span("write", rows=len(y_train) + len(y_test)):
+        logger.info(f"Saving training data to {train_features_output_path}")
+        write_features(
+            train_features_output_path,
+            train_features,
+            feature_names,
+            output_format=args.output_format,
+        )
 
-    logger.info(f"Saving test data to {test_features_output_path}")
-    pd.DataFrame(test_features, columns=feature_names).to_csv(
-        test_features_output_path, header=True, index=False
-    )
+        logger.info(f"Saving test data to {test_features_output_path}")
+        write_features(
+            test_features_output_path,
+            test_features,
+            feature_names,
+            output_format=args.output_format,
+        )
 
 
 if __name__ == "__main__":
@@ -240,12 +875,85 @@ if __name__ == "__main__":
     parser.add_argument("--table", type=str, required=True)
     parser.add_argument("--train-test-split-ratio", type=float, default=0.25)
     parser.add_argument("--random-state", type=float, default=123)
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="random",
+        choices=SPLIT_MODES,
+        help="Split rows at random or by a stable hash of the customer",
+    )
     parser.add_argument(
         "--cluster",
         default=True,
         type=bool,
         help="Run clusters as part of preprocessing",
     )
+    parser.add_argument(
+        "--cluster-sample-size",
+        type=int,
+        default=None,
+        help="Fit the clusters on a stratified sample of this many rows",
+    )
+    parser.add_argument(
+        "--source-path",
+        type=str,
+        default=None,
+        help="Local CSV/Parquet file or directory to read instead of Athena",
+    )
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument(
+        "--output-prefix",
+        type=str,
+        default=None,
+        help="Subdirectory of the train, test and transformer outputs",
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=None,
+        help="Tables preprocessed at a time when preprocessing several tables",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Process the data out of core in chunks of this many rows",
+    )
+    parser.add_argument("--fit-sample-size", type=int, default=100_000)
+    parser.add_argument(
+        "--dedupe-partitions",
+        type=int,
+        default=DEDUPE_PARTITIONS,
+        help="Hash partitions the rows are de-duplicated in with chunksize",
+    )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="csv",
+        choices=OUTPUT_FORMATS,
+        help="Format of the train and test feature files",
+    )
+    parser.add_argument(
+        "--compact-dtypes",
+        default=False,
+        type=bool,
+        help="Hold the data in float32, categorical and small integer columns",
+    )
+    parser.add_argument(
+        "--data-cache",
+        type=str,
+        default=DATA_CACHE,
+        help="Local directory or S3 prefix caching the cleaned rows",
+    )
+    parser.add_argument(
+        "--data-cache-max-bytes", type=int, default=DATA_CACHE_MAX_BYTES
+    )
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,194 @@
+"""
+Row fingerprint index for incremental inference.
+
+Only a small share of the customers change from one day to the next, so
+transforming and scoring the whole table on every run mostly repeats work.
+`RowIndex` keeps the hash of every customer's cleaned row, keyed on area code
+and phone, from the previous run. Rows whose key is new or whose hash
+differs are passed on to be transformed and scored, the others keep their
+previous output, and customers no longer in the table are dropped from it.
+
+The index is written as Parquet with a stamp of the preprocessor, segment
+assigner and model it was built with. An index with another stamp is
+ignored, so retraining reprocesses every row.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from models import file_digest
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+INDEX_FILE = "row_index.parquet"
+KEY_COLUMNS = ["area code", "phone"]
+STAMP_KEY = b"stamp"
+
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    """Customer identity of every row, area code and phone
+
+    :param df: rows with the key columns
+    :type df: pd.DataFrame
+    :return: key of every row
+    :rtype: pd.Series
+    """
+    keys = df[KEY_COLUMNS].astype(str)
+    return keys[KEY_COLUMNS[0]] + "|" + keys[KEY_COLUMNS[1]]
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """64 bit hash of the values of every row
+
+    Floats are hashed at float32, the precision XGBoost predicts in, so a
+    value re-serialized with a different last digit hashes the same.
+
+    :param df: cleaned rows, with the schema applied so equal values hash
+     the same in every batch
+    :type df: pd.DataFrame
+    :return: hash of every row
+    :rtype: np.ndarray
+    """
+    floats = df.select_dtypes("float").columns
+    if len(floats):
+        df = df.astype({column: np.float32 for column in floats})
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def index_stamp(paths: Iterable[str], **params) -> str:
+    """Digest of the files and arguments the indexed outputs depend on
+
+    :param paths: files such as the preprocessor, missing files are skipped
+    :type paths: Iterable[str]
+    :param params: arguments that change the outputs
+    :return: hex digest
+    :rtype: str
+    """
+    digests = {
+        os.path.basename(path): file_digest(path)
+        for path in paths
+        if os.path.exists(path)
+    }
+    payload = json.dumps({"files": digests, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RowIndex:
+    """Keys and row hashes of the previous run and of the current one
+
+    :param previous: `key` and `hash` of every row of the previous run,
+     defaults to None, which treats every row as new
+    :type previous: pd.DataFrame, optional
+    """
+
+    def __init__(self, previous: Optional[pd.DataFrame] = None):
+        if previous is None:
+            previous = pd.DataFrame(
+                {"key": pd.Series(dtype=str), "hash": pd.Series(dtype=np.uint64)}
+            )
+        self._previous_keys = pd.Index(previous["key"])
+        self._previous_hashes = previous["hash"].values.astype(np.uint64)
+        self._unchanged = np.zeros(len(previous), dtype=bool)
+        self._seen = set()
+        self._keys: List[np.ndarray] = []
+        self._hashes: List[np.ndarray] = []
+        self.changed = 0
+
+    @classmethod
+    def load(cls, path: Optional[str], stamp: str) -> "RowIndex":
+        """Index of the previous run, empty if missing or stamped otherwise
+
+        :param path: previous index file, defaults to None
+        :type path: str, optional
+        :param stamp: stamp of the current run, see `index_stamp`
+        :type stamp: str
+        :return: index
+        :rtype: RowIndex
+        """
+        if not path or not os.path.exists(path):
+            logger.info("No previous row index, processing every row")
+            return cls()
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        previous_stamp = (table.schema.metadata or {}).get(STAMP_KEY, b"").decode()
+        if previous_stamp != stamp:
+            logger.info("Row index built with another model, processing every row")
+            return cls()
+        return cls(table.to_pandas())
+
+    @property
+    def rows(self) -> int:
+        """Rows of the current run indexed so far"""
+        return sum(len(keys) for keys in self._keys)
+
+    def update(self, keys: pd.Series, hashes: np.ndarray) -> np.ndarray:
+        """Index a batch of the current run and find its new or changed rows
+
+        A key seen before in this run keeps its first row.
+
+        :param keys: key of every row, see `row_keys`
+        :type keys: pd.Series
+        :param hashes: hash of every row, see `row_hashes`
+        :type hashes: np.ndarray
+        :return: mask of the rows to process
+        :rtype: np.ndarray
+        """
+        keys = np.asarray(keys, dtype=object)
+        first = ~pd.Series(keys).duplicated().values
+        first &= np.fromiter((key not in self._seen for key in keys), bool, len(keys))
+        keys, hashes = keys[first], hashes[first]
+        self._seen.update(keys)
+        self._keys.append(keys)
+        self._hashes.append(hashes)
+
+        positions = self._previous_keys.get_indexer(keys)
+        found = positions >= 0
+        unchanged = np.zeros(len(keys), dtype=bool)
+        unchanged[found] = self._previous_hashes[positions[found]] == hashes[found]
+        self._unchanged[positions[unchanged]] = True
+
+        changed = np.zeros(len(first), dtype=bool)
+        changed[np.flatnonzero(first)[~unchanged]] = True
+        self.changed += int(changed.sum())
+        return changed
+
+    def unchanged_keys(self) -> pd.Index:
+        """Keys of the previous run still in the table with the same row"""
+        return self._previous_keys[self._unchanged]
+
+    def write(self, path: str, stamp: str):
+        """Write the index of the current run
+
+        :param path: output index file
+        :type path: str
+        :param stamp: stamp of the current run, see `index_stamp`
+        :type stamp: str
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        keys = np.concatenate(self._keys) if self._keys else np.array([], object)
+        hashes = (
+            np.concatenate(self._hashes)
+            if self._hashes
+            else np.array([], dtype=np.uint64)
+        )
+        table = pa.table(
+            {
+                "key": pa.array(keys, type=pa.string()),
+                "hash": pa.array(hashes, type=pa.uint64()),
+            }
+        )
+        pq.write_table(table.replace_schema_metadata({STAMP_KEY: stamp.encode()}), path)
+        logger.info(
+            f"Indexed {len(keys)} rows, {self.changed} new or changed, "
+            f"{len(self._previous_keys) - int(self._unchanged.sum())} previous "
+            "rows changed or removed"
+        )
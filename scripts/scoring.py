@@ -0,0 +1,385 @@
+"""
+In-process batch scoring of the churn table.
+
+Chains the saved preprocessor and the trained booster: raw rows are streamed
+from the source table, transformed and scored with `inplace_predict` in a
+pool of worker processes, and the predictions are written keyed by customer.
+No feature file is written, uploaded or parsed again, so a partial refresh of
+a few hundred thousand customers costs the transform and the trees only.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+from dependencies import ensure_installed
+
+if __name__ == "__main__":
+    ensure_installed(
+        [
+            "scikit-learn",
+            "awswrangler",
+            "pyarrow",
+            "hdbscan",
+            "Amazon-DenseClus",
+            "xgboost",
+        ]
+    )
+
+import joblib
+import numpy as np
+import pandas as pd
+from compiled_transform import load_transform
+from inferpreprocessing import changed_rows, load_index, prepare_batch
+from metrics import METRICS_FILE, Metrics
+from models import MODEL_CACHE_DIR, MODEL_NAME, load_model
+from row_index import INDEX_FILE, KEY_COLUMNS, RowIndex, row_keys
+from segments import CLUSTERER_FILE
+from sources import iter_table, prefetch
+
+_state: dict = {}
+
+
+def _init_worker(
+    base_dir: str,
+    model_name: str,
+    cache_dir: str,
+    cluster: bool,
+    coxph: bool,
+    nthread: int,
+    missing: float = np.nan,
+):
+    """Load the preprocessor, the segment assigner and the booster once"""
+    transformer_dir = os.path.join(base_dir, "transformer")
+    _state["preprocess"] = load_transform(transformer_dir)
+    _state["buffer"] = None
+    _state["assigner"] = (
+        joblib.load(os.path.join(transformer_dir, CLUSTERER_FILE)) if cluster else None
+    )
+    booster = load_model(
+        os.path.join(base_dir, "model", "model.tar.gz"), model_name, cache_dir
+    )
+    booster.set_param({"nthread": nthread})
+    _state["booster"] = booster
+    _state["coxph"] = coxph
+    _state["missing"] = missing
+
+
+def score_batch(df: pd.DataFrame) -> pd.DataFrame:
+    """Predictions of a batch of raw rows, keyed by customer
+
+    :param df: raw rows from the source table
+    :type df: pd.DataFrame
+    :return: key columns and the prediction of every row kept by the schema
+    :rtype: pd.DataFrame
+    """
+    df = df.reset_index(drop=True)
+    batch = prepare_batch(df, _state["coxph"], _state["assigner"])
+    preprocess = _state["preprocess"]
+    # one float32 buffer per worker, grown to the largest batch
+    if _state["buffer"] is None or len(_state["buffer"]) < len(batch):
+        _state["buffer"] = np.empty((len(batch), preprocess.n_features), np.float32)
+    features = preprocess.transform(batch, out=_state["buffer"])
+    scores = df.loc[batch.index, KEY_COLUMNS].astype(str)
+    # the Cox model predicts the relative hazard, not a probability
+    column = "risk" if _state["coxph"] else "probability"
+    scores[column] = _state["booster"].inplace_predict(
+        features, missing=_state["missing"]
+    )
+    return scores
+
+
+def score_batches(
+    chunks: Iterable[pd.DataFrame], n_jobs: int, initargs: tuple
+) -> Iterator[pd.DataFrame]:
+    """Score chunks in a process pool, in order, with few chunks in flight
+
+    :param chunks: raw rows from the source table
+    :type chunks: Iterable[pd.DataFrame]
+    :param n_jobs: worker processes, 1 scores in this process
+    :type n_jobs: int
+    :param initargs: arguments of the worker initializer
+    :type initargs: tuple
+    :return: iterator of the scores of every chunk
+    :rtype: Iterator[pd.DataFrame]
+    """
+    if n_jobs == 1:
+        _init_worker(*initargs)
+        yield from (score_batch(df) for df in chunks)
+        return
+
+    # the source is read on a prefetch thread, which a forked worker would
+    # copy mid-flight together with its locks
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=initargs,
+    ) as executor:
+        # two chunks per worker keep every worker busy and memory bounded
+        pending = deque()
+        for df in chunks:
+            pending.append(executor.submit(score_batch, df))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def changed_chunks(
+    chunks: Iterable[pd.DataFrame], index: RowIndex, coxph: bool
+) -> Iterator[pd.DataFrame]:
+    """Rows of every chunk that are new or changed since the indexed run"""
+    for df in chunks:
+        df = changed_rows(df, index, coxph)
+        if len(df):
+            yield df
+
+
+def merge_previous(
+    previous_path: str, scores_path: str, keys: pd.Index, chunksize: int, header: bool
+) -> int:
+    """Append the previous scores of the customers that did not change
+
+    :param previous_path: scores file of the previous run
+    :type previous_path: str
+    :param scores_path: scores file of the current run
+    :type scores_path: str
+    :param keys: keys of the unchanged customers, see `RowIndex`
+    :type keys: pd.Index
+    :param chunksize: rows of the previous scores read at a time
+    :type chunksize: int
+    :param header: write the header line, no scores were written yet
+    :type header: bool
+    :return: number of rows appended
+    :rtype: int
+    """
+    rows = 0
+    previous = pd.read_csv(
+        previous_path,
+        dtype={column: str for column in KEY_COLUMNS},
+        chunksize=chunksize,
+    )
+    for scores in previous:
+        scores = scores[keys.get_indexer(row_keys(scores)) >= 0]
+        scores.to_csv(
+            scores_path,
+            index=False,
+            header=header and rows == 0,
+            mode="w" if header and rows == 0 else "a",
+        )
+        rows += len(scores)
+    return rows
+
+
+def main(args):
+    """
+    Scores the churn table in process
+        1. Streams raw rows from the Athena database in batches, reading the
+        next batch in the background
+        2. Assigns rows to segments, transforms them with the saved
+        preprocessor compiled to vectorized NumPy and predicts with the
+        booster in a pool of processes that load both once
+        3. Appends the predictions of every batch to the scores file, keyed
+        by area code and phone, which is then written to S3
+        4. Reports the throughput in rows per second
+
+    Incrementally, only the customers that are new or changed since the
+    previous run are scored, and the previous scores of the others are
+    appended to theirs, see `row_index.py`.
+
+    Args:
+        database (str, required): Athena database to query data from
+        table (str, required): Athena table name to query data from
+        region (str, required): AWS Region for queries
+        coxph (bool): Flag indicating that it's a cox proportional hazard model,
+        default False
+        cluster (bool): Assign rows to the segments saved by the training
+        preprocessing, default True
+        model-name (str): Name of the trained model, default xgboost-model
+        model-cache-dir (str): Directory the model archive is extracted
+        into, default MODEL_CACHE_DIR or a temporary directory
+        chunksize (int): Number of rows read and scored at a time, default
+        100000
+        n-jobs (int): Worker processes, default the number of CPUs
+        missing (float): Feature value the booster reads as missing, default
+        NaN. Pass 0 for a model trained on libsvm features, which leave out
+        the zero one hot entries, as the Batch Transform of libsvm features
+        reads them
+        source-path (str): Local CSV/Parquet file or directory read instead
+        of Athena, default None
+        base-dir (str): Root of the processing job inputs and outputs
+        , default /opt/ml/processing
+        output-name (str): Name of the scores file, default scores.csv
+        report-name (str): Name of the throughput report, default
+        scoring.json
+        incremental (bool): Only score rows new or changed since the run
+        whose scores and `row_index.parquet` are in previous-dir, default
+        False
+        previous-dir (str): Directory with the `scores` outputs of the
+        previous run, default base-dir/previous
+        profile-span (str): Name of a phase to profile with cProfile, see
+        `metrics.py`, default None
+
+    The time, CPU and peak memory of every phase are written to
+    `scores/metrics.json`, the CPU time of the scoring phase including the
+    workers'.
+    """
+
+    logger.info(f"Received arguments {args}")
+    n_jobs = args.n_jobs or os.cpu_count() or 1
+    output_dir = os.path.join(args.base_dir, "scores")
+    os.makedirs(output_dir, exist_ok=True)
+    metrics = Metrics(
+        os.path.join(output_dir, METRICS_FILE), profile_span=args.profile_span
+    )
+
+    # extract the model once, the workers read it from the cache
+    model_path = os.path.join(args.base_dir, "model", "model.tar.gz")
+    with metrics.span("load_model"):
+        load_model(model_path, args.model_name, args.model_cache_dir)
+    initargs = (
+        args.base_dir,
+        args.model_name,
+        args.model_cache_dir,
+        args.cluster,
+        args.coxph,
+        max(1, (os.cpu_count() or 1) // n_jobs),
+        args.missing,
+    )
+
+    chunks = prefetch(
+        iter_table(
+            args.database,
+            args.table,
+            args.region,
+            args.chunksize,
+            source_path=args.source_path,
+        )
+    )
+
+    index = None
+    if args.incremental:
+        # scores of another preprocessor or model are not reused
+        index, stamp = load_index(
+            args.base_dir,
+            args.previous_dir,
+            args.cluster,
+            args.coxph,
+            paths=[model_path],
+        )
+        chunks = changed_chunks(chunks, index, args.coxph)
+
+    scores_path = os.path.join(output_dir, args.output_name)
+    logger.info(f"Scoring on {n_jobs} workers into {scores_path}")
+    start = time.perf_counter()
+    rows = 0
+    with metrics.span("score") as span:
+        for scores in score_batches(chunks, n_jobs, initargs):
+            scores.to_csv(
+                scores_path, index=False, header=rows == 0, mode="a" if rows else "w"
+            )
+            rows += len(scores)
+        span["rows"] = rows
+    seconds = time.perf_counter() - start
+
+    if index is not None:
+        previous_path = os.path.join(
+            args.previous_dir or os.path.join(args.base_dir, "previous"),
+            args.output_name,
+        )
+        with metrics.span("merge") as span:
+            if os.path.exists(previous_path):
+                span["rows"] = merge_previous(
+                    previous_path,
+                    scores_path,
+                    index.unchanged_keys(),
+                    args.chunksize,
+                    header=rows == 0,
+                )
+            index.write(os.path.join(output_dir, INDEX_FILE), stamp)
+        logger.info(f"Scored {index.changed} new or changed of {index.rows} rows")
+    rows_per_second = rows / seconds if seconds else 0.0
+
+    logger.info(f"Scored {rows} rows in {seconds:.1f}s, {rows_per_second:.0f} rows/sec")
+    report = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows_per_second,
+        "workers": n_jobs,
+    }
+    with open(os.path.join(output_dir, args.report_name), "w") as f:
+        json.dump(report, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", type=str, required=True)
+    parser.add_argument("--region", type=str, required=True)
+    parser.add_argument("--table", type=str, required=True)
+    parser.add_argument("--coxph", type=bool, default=False)
+    parser.add_argument(
+        "--cluster",
+        default=True,
+        type=bool,
+        help="Run clusters as part of preprocessing",
+    )
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME)
+    parser.add_argument(
+        "--model-cache-dir",
+        type=str,
+        default=MODEL_CACHE_DIR,
+        help="Directory the model archive is extracted into once",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="Number of rows read and scored at a time",
+    )
+    parser.add_argument("--n-jobs", type=int, default=None)
+    parser.add_argument(
+        "--missing",
+        type=float,
+        default=np.nan,
+        help="Feature value read as missing, 0 for models trained on libsvm",
+    )
+    parser.add_argument(
+        "--source-path",
+        type=str,
+        default=None,
+        help="Local CSV/Parquet file or directory to read instead of Athena",
+    )
+    parser.add_argument("--base-dir", type=str, default="/opt/ml/processing")
+    parser.add_argument("--output-name", type=str, default="scores.csv")
+    parser.add_argument("--report-name", type=str, default="scoring.json")
+    parser.add_argument(
+        "--incremental",
+        type=bool,
+        default=False,
+        help="Only score rows new or changed since the previous run",
+    )
+    parser.add_argument(
+        "--previous-dir",
+        type=str,
+        default=None,
+        help="Directory with the scores outputs of the previous run",
+    )
+    parser.add_argument(
+        "--profile-span",
+        type=str,
+        default=None,
+        help="Name of a phase in metrics.json to profile with cProfile",
+    )
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,190 @@
+"""
+Segment assignment for rows that DenseClus was not fit on.
+
+DenseClus has no predict method, see
+https://github.com/awslabs/amazon-denseclus/issues/4, and its combined UMAP
+mapper cannot embed new points. `SegmentAssigner` is fit on the clustered
+training rows and their segments, and assigns new rows to the segment of
+their nearest clustered neighbours in the same power transformed numeric and
+one hot categorical space DenseClus clusters in. Assignment is a transform
+that scales linearly with the number of new rows instead of a full refit.
+"""
+
+import logging
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.preprocessing import PowerTransformer
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+CLUSTERER_FILE = "clusterer.joblib"
+
+
+class SegmentAssigner:
+    """Assigns rows to the segments of a fitted DenseClus model
+
+    :param n_neighbors: clustered neighbours voting on a segment,
+     defaults to 15
+    :type n_neighbors: int, optional
+    :param batch_size: rows assigned at a time, defaults to 100000
+    :type batch_size: int, optional
+    """
+
+    def __init__(self, n_neighbors: int = 15, batch_size: int = 100_000):
+        self.n_neighbors = n_neighbors
+        self.batch_size = batch_size
+
+    def fit(self, df: pd.DataFrame, segments) -> "SegmentAssigner":
+        """Fit on the clustered rows and the segments DenseClus gave them
+
+        :param df: clustered rows, only the columns available at inference
+        :type df: pd.DataFrame
+        :param segments: segment label of every row
+        :type segments: array-like
+        :return: fitted assigner
+        :rtype: SegmentAssigner
+        """
+        self.numerical_columns_: List[str] = df.select_dtypes(
+            include="number"
+        ).columns.tolist()
+        self.categorical_columns_: List[str] = df.select_dtypes(
+            exclude="number"
+        ).columns.tolist()
+        self.power_ = PowerTransformer().fit(df[self.numerical_columns_].values)
+        self.dummy_columns_ = pd.get_dummies(
+            df[self.categorical_columns_].astype(str)
+        ).columns
+        self.knn_ = KNeighborsClassifier(
+            n_neighbors=min(self.n_neighbors, len(df)), n_jobs=-1
+        ).fit(self._features(df), np.asarray(segments))
+        return self
+
+    def _features(self, df: pd.DataFrame) -> np.ndarray:
+        numerical = self.power_.transform(df[self.numerical_columns_].values)
+        categorical = pd.get_dummies(df[self.categorical_columns_].astype(str)).reindex(
+            columns=self.dummy_columns_, fill_value=0
+        )
+        return np.hstack((numerical, categorical.values)).astype(np.float32)
+
+    def _batches(self, df: pd.DataFrame):
+        for start in range(0, len(df), self.batch_size):
+            yield self._features(df.iloc[start : start + self.batch_size])
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        """Segment of every row
+
+        :param df: rows to assign
+        :type df: pd.DataFrame
+        :return: segment labels
+        :rtype: np.ndarray
+        """
+        if len(df) == 0:
+            return np.empty(0, dtype=self.knn_.classes_.dtype)
+        return np.concatenate([self.knn_.predict(X) for X in self._batches(df)])
+
+    def predict_proba(self, df: pd.DataFrame) -> np.ndarray:
+        """Approximate membership of every row in every segment
+
+        :param df: rows to assign
+        :type df: pd.DataFrame
+        :return: share of neighbours in each segment of `knn_.classes_`
+        :rtype: np.ndarray
+        """
+        return np.vstack([self.knn_.predict_proba(X) for X in self._batches(df)])
+
+
+def sample_index(
+    n_rows: int,
+    sample_size: int,
+    stratify=None,
+    random_state: Optional[int] = None,
+) -> np.ndarray:
+    """Positions of a sample of rows, stratified when labels are given
+
+    :param n_rows: number of rows to sample from
+    :type n_rows: int
+    :param sample_size: number of rows in the sample
+    :type sample_size: int
+    :param stratify: labels whose proportions the sample keeps, defaults to None
+    :type stratify: array-like, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :return: sorted row positions
+    :rtype: np.ndarray
+    """
+    if sample_size >= n_rows:
+        return np.arange(n_rows)
+    index, _ = train_test_split(
+        np.arange(n_rows),
+        train_size=sample_size,
+        stratify=stratify,
+        random_state=random_state,
+    )
+    return np.sort(index)
+
+
+def cluster_segments(
+    df: pd.DataFrame,
+    assign_columns: List[str],
+    sample_size: Optional[int] = None,
+    stratify: Optional[str] = None,
+    random_state: Optional[int] = None,
+) -> Tuple[np.ndarray, SegmentAssigner]:
+    """Cluster rows with DenseClus, optionally fitting on a sample only
+
+    UMAP and HDBSCAN scale super-linearly with rows. With `sample_size` set,
+    DenseClus is fit on a stratified sample and every other row is assigned
+    in batches by the `SegmentAssigner` fit on that sample.
+
+    :param df: rows to cluster, with every column DenseClus is fit on
+    :type df: pd.DataFrame
+    :param assign_columns: columns available at inference the assigner uses
+    :type assign_columns: List[str]
+    :param sample_size: rows DenseClus is fit on, defaults to all rows
+    :type sample_size: int, optional
+    :param stratify: column whose proportions the sample keeps, defaults to None
+    :type stratify: str, optional
+    :param random_state: random seed of the sample, defaults to None
+    :type random_state: int, optional
+    :return: segment of every row as strings and the fitted assigner
+    :rtype: Tuple[np.ndarray, SegmentAssigner]
+    """
+    from denseclus import DenseClus
+
+    index = sample_index(
+        len(df),
+        sample_size or len(df),
+        stratify=df[stratify] if stratify else None,
+        random_state=random_state,
+    )
+    sample = df.iloc[index]
+
+    start = time.perf_counter()
+    clf = DenseClus()
+    clf.fit(sample)
+    labels = clf.score().astype(str)
+    logger.info(
+        f"Clusters fit on {len(sample)} rows in {time.perf_counter() - start:.1f}s"
+    )
+
+    assigner = SegmentAssigner().fit(sample[assign_columns], labels)
+    if len(index) == len(df):
+        return labels, assigner
+
+    start = time.perf_counter()
+    rest = np.ones(len(df), dtype=bool)
+    rest[index] = False
+    segments = np.empty(len(df), dtype=labels.dtype)
+    segments[index] = labels
+    segments[rest] = assigner.predict(df[assign_columns].iloc[np.flatnonzero(rest)])
+    logger.info(
+        f"Assigned {rest.sum()} rows to clusters in "
+        f"{time.perf_counter() - start:.1f}s"
+    )
+    return segments, assigner
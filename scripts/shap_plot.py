@@ -0,0 +1,293 @@
+"""
+Feature importance plot of SHAP values that scales to any number of rows.
+
+`shap.summary_plot` draws a point for every row and feature and colors it
+with the row's feature value, so on millions of rows the beeswarm takes
+longer than training and needs every feature row in memory. The density plot
+instead counts the SHAP values of every feature into a fixed number of bins,
+with one vectorized histogram over all rows for every block of rows, and
+colors each bin with the mean feature value of a bounded sample of rows. The
+sample is stratified by the target, so rare classes such as churners keep
+their share, and only the sampled feature rows are read. One bar is drawn per
+bin, so the time and memory of the plot do not grow with the data set.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from features_io import feature_columns, is_libsvm, read_rows, read_target
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+PLOT_MODES = ("beeswarm", "density")
+PLOT_SAMPLE_SIZE = 10_000
+DENSITY_BINS = 50
+# the number of features shap.summary_plot shows
+MAX_DISPLAY = 20
+BLOCK_ROWS = 100_000
+
+
+def stratified_rows(
+    strata, sample_size: Optional[int] = None, random_state: Optional[int] = None
+) -> np.ndarray:
+    """Positions of a sample of rows with every class in proportion
+
+    :param strata: class of every row, e.g. churned or event
+    :type strata: array-like
+    :param sample_size: number of rows in the sample, defaults to all rows
+    :type sample_size: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :return: sorted row positions, at least one of every class
+    :rtype: np.ndarray
+    """
+    strata = np.asarray(strata)
+    if not sample_size or sample_size >= len(strata):
+        return np.arange(len(strata))
+    rng = np.random.default_rng(random_state)
+    _, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    quotas = np.minimum(np.maximum(counts * sample_size // len(strata), 1), counts)
+    order = np.argsort(inverse, kind="stable")
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    picked = [
+        rng.choice(order[start : start + count], size=quota, replace=False)
+        for start, count, quota in zip(starts, counts, quotas)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def sample_frame(
+    features: pd.DataFrame,
+    strata,
+    sample_size: Optional[int] = PLOT_SAMPLE_SIZE,
+    random_state: Optional[int] = None,
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """Stratified sample of feature rows already in memory
+
+    :param features: feature rows
+    :type features: pd.DataFrame
+    :param strata: class of every row
+    :type strata: array-like
+    :param sample_size: number of rows in the sample, defaults to 10000
+    :type sample_size: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :return: positions of the sampled rows and their features
+    :rtype: Tuple[np.ndarray, pd.DataFrame]
+    """
+    rows = stratified_rows(strata, sample_size, random_state)
+    return rows, features.iloc[rows].reset_index(drop=True)
+
+
+def sample_features(
+    path: str,
+    n_rows: int,
+    sample_size: Optional[int] = PLOT_SAMPLE_SIZE,
+    random_state: Optional[int] = None,
+    n_features: Optional[int] = None,
+) -> Tuple[np.ndarray, pd.DataFrame]:
+    """Stratified sample of the feature rows of a feature file
+
+    Only the target column and the sampled rows are read.
+
+    :param path: CSV, Parquet or LibSVM features, target first
+    :type path: str
+    :param n_rows: sample among the first `n_rows` rows, e.g. the rows with
+     SHAP values
+    :type n_rows: int
+    :param sample_size: number of rows in the sample, defaults to 10000
+    :type sample_size: int, optional
+    :param random_state: random seed, defaults to None
+    :type random_state: int, optional
+    :param n_features: number of LibSVM feature columns, defaults to None
+    :type n_features: int, optional
+    :return: positions of the sampled rows and their features, without the
+     target
+    :rtype: Tuple[np.ndarray, pd.DataFrame]
+    """
+    rows = stratified_rows(read_target(path)[:n_rows], sample_size, random_state)
+    columns = None if is_libsvm(path) else feature_columns(path)[1:]
+    logger.info(f"Reading {len(rows)} sampled feature rows for the plot")
+    return rows, read_rows(path, rows, columns=columns, n_features=n_features)
+
+
+def _bin_index(values: np.ndarray, low: np.ndarray, width: np.ndarray, bins: int):
+    return np.clip(((values - low) / width).astype(np.int64), 0, bins - 1)
+
+
+def _scale(features: np.ndarray) -> np.ndarray:
+    """Feature values scaled to [0, 1] between their 5th and 95th percentile,
+    the color range of `shap.summary_plot`"""
+    with np.errstate(all="ignore"):
+        low, high = np.nanpercentile(features, [5, 95], axis=0)
+        flat = high <= low
+        low[flat] = np.nanmin(features, axis=0)[flat]
+        high[flat] = np.nanmax(features, axis=0)[flat]
+        scaled = np.clip((features - low) / (high - low), 0, 1)
+    # a constant feature is drawn in the middle of the color range
+    scaled[:, high <= low] = 0.5
+    return scaled
+
+
+def shap_density(
+    shap_values: np.ndarray,
+    rows: np.ndarray,
+    features: np.ndarray,
+    bins: int = DENSITY_BINS,
+    block_rows: int = BLOCK_ROWS,
+) -> Dict[str, np.ndarray]:
+    """Histograms of the SHAP values of every feature, colored by a sample
+
+    :param shap_values: SHAP values of every row, without the bias
+    :type shap_values: np.ndarray
+    :param rows: positions in `shap_values` of the sampled feature rows
+    :type rows: np.ndarray
+    :param features: feature values of the sampled rows
+    :type features: np.ndarray
+    :param bins: bins per feature, defaults to 50
+    :type bins: int, optional
+    :param block_rows: rows counted at a time, defaults to 100000
+    :type block_rows: int, optional
+    :return: arrays of `edges` (features x bins + 1), `counts` of rows and
+     `color`, the mean scaled value of the sampled rows, NaN without any,
+     (features x bins), and `importance`, the mean absolute SHAP value of
+     every feature
+    :rtype: Dict[str, np.ndarray]
+    """
+    n_rows, n_features = shap_values.shape
+    low = shap_values.min(axis=0).astype(np.float64)
+    high = shap_values.max(axis=0).astype(np.float64)
+    width = (high - low) / bins
+    width[width == 0] = 1.0
+    # one flat histogram over all features, feature k counts into
+    # bins k * bins ... (k + 1) * bins - 1
+    offsets = np.arange(n_features) * bins
+    counts = np.zeros(n_features * bins, dtype=np.int64)
+    absolute = np.zeros(n_features)
+    for start in range(0, n_rows, block_rows):
+        block = shap_values[start : start + block_rows]
+        index = _bin_index(block, low, width, bins) + offsets
+        counts += np.bincount(index.ravel(), minlength=len(counts))
+        absolute += np.abs(block).sum(axis=0, dtype=np.float64)
+
+    scaled = _scale(np.asarray(features, dtype=np.float64))
+    index = _bin_index(shap_values[rows], low, width, bins) + offsets
+    known = ~np.isnan(scaled)
+    sums = np.bincount(index[known], weights=scaled[known], minlength=len(counts))
+    hits = np.bincount(index[known], minlength=len(counts))
+    with np.errstate(invalid="ignore"):
+        color = sums / hits
+    edges = low[:, None] + width[:, None] * np.arange(bins + 1)
+    return {
+        "edges": edges,
+        "counts": counts.reshape(n_features, bins),
+        "color": color.reshape(n_features, bins),
+        "importance": absolute / max(n_rows, 1),
+    }
+
+
+def plot_density(
+    density: Dict[str, np.ndarray],
+    feature_names: List[str],
+    path: str,
+    max_display: int = MAX_DISPLAY,
+):
+    """Draw the histograms of `shap_density` as a summary plot
+
+    Every feature is a row of bars, one per bin, as high as the share of rows
+    in the bin and colored from blue for low to red for high feature values.
+    Features are sorted by their mean absolute SHAP value.
+
+    :param density: output of `shap_density`
+    :type density: Dict[str, np.ndarray]
+    :param feature_names: names of the feature columns
+    :type feature_names: List[str]
+    :param path: output image path
+    :type path: str
+    :param max_display: number of most important features shown,
+     defaults to 20
+    :type max_display: int, optional
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib import cm, colors
+
+    order = np.argsort(-density["importance"], kind="stable")[:max_display]
+    counts = density["counts"][order]
+    edges = density["edges"][order]
+    heights = 0.8 * counts / np.maximum(counts.max(axis=1, keepdims=True), 1)
+    # the most important feature at the top
+    y = np.arange(len(order))[::-1, None] + np.zeros_like(heights)
+    cmap = plt.get_cmap("coolwarm").copy()
+    cmap.set_bad("#cccccc")
+    fill = cmap(np.ma.masked_invalid(density["color"][order]))
+
+    drawn = counts > 0
+    fig, ax = plt.subplots(figsize=(8, 0.4 * len(order) + 1.5))
+    ax.bar(
+        edges[:, :-1][drawn],
+        heights[drawn],
+        width=np.diff(edges, axis=1)[drawn],
+        bottom=(y - heights / 2)[drawn],
+        color=fill[drawn],
+        align="edge",
+        linewidth=0,
+    )
+    ax.axvline(0, color="#999999", linewidth=0.8, zorder=0)
+    ax.set_yticks(np.arange(len(order)))
+    ax.set_yticklabels([feature_names[i] for i in order[::-1]])
+    ax.set_xlabel("SHAP value (impact on model output)")
+    colorbar = fig.colorbar(
+        cm.ScalarMappable(norm=colors.Normalize(0, 1), cmap=cmap),
+        ax=ax,
+        ticks=[0, 1],
+        aspect=40,
+    )
+    colorbar.set_ticklabels(["Low", "High"])
+    colorbar.set_label("Feature value")
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+
+def summary_plot(
+    shap_values: np.ndarray,
+    features: pd.DataFrame,
+    path: str,
+    mode: str = "beeswarm",
+    rows: Optional[np.ndarray] = None,
+    bins: int = DENSITY_BINS,
+):
+    """Save the SHAP feature importance plot
+
+    :param shap_values: SHAP values without the bias
+    :type shap_values: np.ndarray
+    :param features: feature rows, every row of `shap_values` for the
+     beeswarm, the sampled rows for the density plot
+    :type features: pd.DataFrame
+    :param path: output image path
+    :type path: str
+    :param mode: one of `PLOT_MODES`, defaults to beeswarm
+    :type mode: str, optional
+    :param rows: positions in `shap_values` of the rows of `features`,
+     defaults to the first rows
+    :type rows: np.ndarray, optional
+    :param bins: bins per feature of the density plot, defaults to 50
+    :type bins: int, optional
+    """
+    if mode not in PLOT_MODES:
+        raise ValueError(f"Unknown plot mode {mode}")
+    if mode == "beeswarm":
+        import matplotlib.pyplot as plt
+        import shap
+
+        shap.summary_plot(
+            shap_values, features=features, feature_names=features.columns, show=False
+        )
+        plt.savefig(path, bbox_inches="tight")
+        return
+    if rows is None:
+        rows = np.arange(len(features))
+    density = shap_density(shap_values, rows, features.values, bins=bins)
+    plot_density(density, features.columns.tolist(), path)
@@ -0,0 +1,419 @@
+"""
+Source readers shared by the processing scripts.
+
+Data is read from the Athena table by default. Passing a local path reads a
+CSV (such as `data/churn.txt`) or Parquet file, or a directory of them,
+instead so the scripts can be run offline.
+
+The schema of a script maps every column to the type it is cast to. In the
+compact mode of `apply_schema`, floats are float32 and integers the smallest
+integer type that holds their values, about half the memory of int64 and
+float64 columns, while the low cardinality columns are categoricals in both
+modes. Local files are
+parsed straight into the compact types with `compact_types`, reading only the
+schema columns.
+"""
+
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+from typing import Iterable, Iterator, List, Optional, TypeVar
+
+import numpy as np
+import pandas as pd
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+PATTERN_CHARS = "*?["
+# placeholder of the table name in a local source path of several tables
+TABLE_FIELD = "{table}"
+# types of the compact mode, integers are downcast once their range is known.
+# Identifiers such as phone numbers stay strings, as categoricals of nearly
+# unique values are slower to build and no smaller
+COMPACT_TYPES = {"float64": "float32"}
+
+T = TypeVar("T")
+
+
+def _local_files(source_path: str) -> List[str]:
+    """List the data files under a local source path
+
+    :param source_path: file or directory of CSV/Parquet files
+    :type source_path: str
+    :return: sorted list of file paths
+    :rtype: List[str]
+    """
+    if os.path.isdir(source_path):
+        files = sorted(
+            f
+            for f in glob.glob(os.path.join(source_path, "*"))
+            if os.path.isfile(f) and not os.path.basename(f).startswith(".")
+        )
+    else:
+        files = [source_path]
+    if not files:
+        raise FileNotFoundError(f"No data files found under {source_path}")
+    return files
+
+
+def _catalog_tables(database: str, region: str) -> List[str]:
+    """Names of the tables of a Glue database"""
+    import boto3
+
+    pages = (
+        boto3.client("glue", region_name=region)
+        .get_paginator("get_tables")
+        .paginate(DatabaseName=database)
+    )
+    return [table["Name"] for page in pages for table in page["TableList"]]
+
+
+def _path_tables(source_path: str) -> List[str]:
+    """Table names of the local paths matching a path with a `{table}` field"""
+    prefix, _, suffix = source_path.partition(TABLE_FIELD)
+    name = re.compile(f"{re.escape(prefix)}(.+){re.escape(suffix)}$")
+    paths = glob.glob(source_path.replace(TABLE_FIELD, "*"))
+    return [name.match(path).group(1) for path in paths if name.match(path)]
+
+
+def table_source(source_path: Optional[str], table: str) -> Optional[str]:
+    """Local source path of a table, filling in the `{table}` field
+
+    :param source_path: local CSV/Parquet file or directory, may contain a
+     `{table}` field
+    :type source_path: str, optional
+    :param table: table name
+    :type table: str
+    :return: source path of the table
+    :rtype: str, optional
+    """
+    if not source_path:
+        return source_path
+    return source_path.replace(TABLE_FIELD, table)
+
+
+def resolve_tables(
+    database: str, tables: str, region: str, source_path: Optional[str] = None
+) -> List[str]:
+    """Table names of a comma separated list of names and glob patterns
+
+    Patterns such as `churn_*` are matched against the tables of the Glue
+    database, or, with a local source path containing a `{table}` field such
+    as `data/{table}.csv`, against the files it names.
+
+    :param database: Athena database to query data from
+    :type database: str
+    :param tables: comma separated table names and patterns
+    :type tables: str
+    :param region: AWS Region for queries
+    :type region: str
+    :param source_path: local source path, defaults to None
+    :type source_path: str, optional
+    :return: table names, in the order given and each pattern's sorted
+    :rtype: List[str]
+    """
+    names, candidates = [], None
+    for name in (name.strip() for name in tables.split(",")):
+        if not any(char in name for char in PATTERN_CHARS):
+            names.append(name)
+            continue
+        if candidates is None:
+            candidates = (
+                _path_tables(source_path)
+                if source_path and TABLE_FIELD in source_path
+                else _catalog_tables(database, region)
+            )
+        matched = sorted(fnmatch.filter(candidates, name))
+        if not matched:
+            raise ValueError(f"No table of {database} matches {name}")
+        names.extend(matched)
+    # a table named twice is processed once
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def source_fingerprint(
+    database: str, table: str, region: str, source_path: Optional[str] = None
+) -> str:
+    """Fingerprint of the data files behind the source table
+
+    Local files are fingerprinted by path, size and modification time, the
+    Athena table by the location in the Glue catalog and the ETag and size
+    of every S3 object under it, which change whenever the data does.
+
+    :param database: Athena database to query data from
+    :type database: str
+    :param table: Athena table name to query data from
+    :type table: str
+    :param region: AWS Region for queries
+    :type region: str
+    :param source_path: local CSV/Parquet file or directory used instead
+     of Athena, defaults to None
+    :type source_path: str, optional
+    :return: hex digest
+    :rtype: str
+    """
+    if source_path:
+        files = [
+            (os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns)
+            for path in _local_files(source_path)
+        ]
+        snapshot = {"files": files}
+    else:
+        import boto3
+
+        location = boto3.client("glue", region_name=region).get_table(
+            DatabaseName=database, Name=table
+        )["Table"]["StorageDescriptor"]["Location"]
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        pages = (
+            boto3.client("s3", region_name=region)
+            .get_paginator("list_objects_v2")
+            .paginate(Bucket=bucket, Prefix=prefix)
+        )
+        objects = [
+            (obj["Key"], obj["ETag"], obj["Size"])
+            for page in pages
+            for obj in page.get("Contents", [])
+        ]
+        snapshot = {"location": location, "objects": objects}
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+
+def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Lower case column names the same way the Glue crawler does"""
+    df.columns = [c.lower() for c in df.columns]
+    return df
+
+
+def compact_types(col_type: dict) -> dict:
+    """Types the compact mode parses the schema columns as
+
+    Integers keep their type, their range is only known after parsing.
+
+    :param col_type: schema, columns and the types they are cast to
+    :type col_type: dict
+    :return: columns and their compact types
+    :rtype: dict
+    """
+    return {col: COMPACT_TYPES.get(dtype, dtype) for col, dtype in col_type.items()}
+
+
+def apply_schema(
+    df: pd.DataFrame, col_type: dict, compact: bool = False
+) -> pd.DataFrame:
+    """Select the schema columns and cast them to their types
+
+    :param df: rows from the source table
+    :type df: pd.DataFrame
+    :param col_type: schema, columns and the types they are cast to
+    :type col_type: dict
+    :param compact: cast to the compact types and downcast the integers to
+     the smallest type that holds them, defaults to False
+    :type compact: bool, optional
+    :return: rows with the schema types
+    :rtype: pd.DataFrame
+    """
+    df = df[list(col_type)]
+    if not compact:
+        return df.astype(col_type)
+    df = df.astype(compact_types(col_type))
+    for col in df.select_dtypes(include=np.integer).columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+def _source_columns(names: List[str], dtype: Optional[dict]) -> dict:
+    """Arguments reading only the schema columns of a file, as their types
+
+    :param names: column names of the file, before lower casing
+    :type names: List[str]
+    :param dtype: lower case columns and the types to parse them as
+    :type dtype: dict, optional
+    :return: keyword arguments of the reader
+    :rtype: dict
+    """
+    if not dtype:
+        return {}
+    raw = {name.lower(): name for name in names}
+    return {
+        "columns": [raw[col] for col in dtype if col in raw],
+        "dtype": {raw[col]: dtype[col] for col in dtype if col in raw},
+    }
+
+
+def _read_csv(path: str, dtype: Optional[dict] = None, **kwargs):
+    if dtype:
+        names = pd.read_csv(path, nrows=0).columns
+        columns = _source_columns(names, dtype)
+        kwargs.update(usecols=columns["columns"], dtype=columns["dtype"])
+    return pd.read_csv(path, **kwargs)
+
+
+def _parquet_frame(table, dtype: Optional[dict]) -> pd.DataFrame:
+    df = table.to_pandas()
+    if dtype:
+        df = df.astype(_source_columns(df.columns, dtype)["dtype"])
+    return df
+
+
+def _iter_local(
+    source_path: str, chunksize: int, dtype: Optional[dict] = None
+) -> Iterator[pd.DataFrame]:
+    for path in _local_files(source_path):
+        if path.endswith(PARQUET_EXTENSIONS):
+            import pyarrow.parquet as pq
+
+            parquet = pq.ParquetFile(path)
+            columns = _source_columns(parquet.schema_arrow.names, dtype)
+            for batch in parquet.iter_batches(
+                batch_size=chunksize, columns=columns.get("columns")
+            ):
+                yield _normalize_columns(_parquet_frame(batch, dtype))
+        else:
+            for chunk in _read_csv(path, dtype, chunksize=chunksize):
+                yield _normalize_columns(chunk)
+
+
+def iter_table(
+    database: str,
+    table: str,
+    region: str,
+    chunksize: int,
+    source_path: Optional[str] = None,
+    dtype: Optional[dict] = None,
+) -> Iterator[pd.DataFrame]:
+    """Read the source table as a stream of bounded DataFrames
+
+    :param database: Athena database to query data from
+    :type database: str
+    :param table: Athena table name to query data from
+    :type table: str
+    :param region: AWS Region for queries
+    :type region: str
+    :param chunksize: maximum number of rows per chunk
+    :type chunksize: int
+    :param source_path: local CSV/Parquet file or directory used instead
+     of Athena, defaults to None
+    :type source_path: str, optional
+    :param dtype: read only these columns of local files, parsed as the
+     given types, such as `compact_types`, defaults to None
+    :type dtype: dict, optional
+    :return: iterator of DataFrames with at most `chunksize` rows
+    :rtype: Iterator[pd.DataFrame]
+    """
+    if source_path:
+        yield from _iter_local(source_path, chunksize, dtype)
+        return
+
+    import awswrangler as wr
+    import boto3
+
+    boto3.setup_default_session(region_name=f"{region}")
+    yield from wr.athena.read_sql_query(
+        f'SELECT * FROM "{table}"',
+        database=database,
+        ctas_approach=False,
+        chunksize=chunksize,
+    )
+
+
+def read_table(
+    database: str,
+    table: str,
+    region: str,
+    source_path: Optional[str] = None,
+    dtype: Optional[dict] = None,
+) -> pd.DataFrame:
+    """Read the full source table into a single DataFrame
+
+    :param database: Athena database to query data from
+    :type database: str
+    :param table: Athena table name to query data from
+    :type table: str
+    :param region: AWS Region for queries
+    :type region: str
+    :param source_path: local CSV/Parquet file or directory used instead
+     of Athena, defaults to None
+    :type source_path: str, optional
+    :param dtype: read only these columns of local files, parsed as the
+     given types, such as `compact_types`, defaults to None
+    :type dtype: dict, optional
+    :return: source table
+    :rtype: pd.DataFrame
+    """
+    if source_path:
+        frames = []
+        for path in _local_files(source_path):
+            if path.endswith(PARQUET_EXTENSIONS):
+                import pyarrow.parquet as pq
+
+                names = pq.read_schema(path).names
+                columns = _source_columns(names, dtype).get("columns")
+                frames.append(
+                    _parquet_frame(pq.read_table(path, columns=columns), dtype)
+                )
+            else:
+                frames.append(_read_csv(path, dtype))
+        if len(frames) == 1:
+            return _normalize_columns(frames[0])
+        return _normalize_columns(pd.concat(frames, ignore_index=True))
+
+    import awswrangler as wr
+    import boto3
+
+    boto3.setup_default_session(region_name=f"{region}")
+    return wr.athena.read_sql_query(
+        f'SELECT * FROM "{table}"', database=database, ctas_approach=False
+    )
+
+
+def prefetch(items: Iterable[T], depth: int = 2) -> Iterator[T]:
+    """Produce the items of an iterable from a background thread
+
+    The next items are read while the caller is busy with the current one,
+    overlapping network and parsing time with the caller's work. At most
+    `depth` items are buffered, so memory stays bounded.
+
+    :param items: iterable to read, such as the chunks of `iter_table`
+    :type items: Iterable
+    :param depth: maximum number of items read ahead, defaults to 2
+    :type depth: int, optional
+    :return: iterator over the same items in the same order
+    :rtype: Iterator
+    """
+    done = object()
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+            buffer.put(done)
+        except BaseException as exc:  # re-raised in the consuming thread
+            buffer.put(exc)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock a producer waiting on a full buffer
+        while thread.is_alive():
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.1)
@@ -0,0 +1,81 @@
+"""
+Deterministic train/test split by customer.
+
+`train_test_split` shuffles the whole frame with a seed, so it needs every row
+in memory and moves customers between the sets whenever the table grows, and
+the test sets of two retrains are not comparable. The hash split instead
+places every customer at a fixed fraction in [0, 1) from a hash of its area
+code and phone, and puts it in the test set when the fraction is below the
+split ratio. A chunk is split on its own in one streaming pass, and a
+customer stays on the same side as rows are added, for any fixed ratio, or
+moves from test to train only when the ratio is lowered.
+
+The split is not stratified: the fraction does not depend on the target, so
+every class, such as churned and retained customers or events and censored
+durations, is split at the ratio only up to sampling noise. Cutting every
+class at its own rank would move customers whenever the table changes. The
+test share of every class is logged to check the noise.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+from row_index import row_keys
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+SPLIT_MODES = ("random", "hash")
+# column holding the fraction of every row between cleaning and splitting
+SPLIT_COLUMN = "split fraction"
+# fixed 16 byte key of the hash, changing it moves every customer
+SPLIT_HASH_KEY = "churn-split-0001"
+
+
+def key_fractions(df: pd.DataFrame) -> np.ndarray:
+    """Stable fraction in [0, 1) of every row, from the hash of its customer
+
+    :param df: rows with the key columns, with the schema applied so keys
+     are formatted the same in every run
+    :type df: pd.DataFrame
+    :return: fraction of every row
+    :rtype: np.ndarray
+    """
+    keys = row_keys(df).values.astype(object)
+    hashes = pd.util.hash_array(keys, hash_key=SPLIT_HASH_KEY, categorize=False)
+    # the top 53 bits are exact in a float64
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+
+def hash_split(
+    *arrays, fractions: np.ndarray, test_size: float, log_classes=None
+) -> list:
+    """Split arrays into train and test rows by the fraction of every row
+
+    A drop-in for `train_test_split` that keeps the order of the rows. The
+    split is not stratified, `log_classes` only reports the test share of
+    every class.
+
+    :param arrays: frames or arrays with the same rows as `fractions`
+    :param fractions: fraction of every row, see `key_fractions`
+    :type fractions: np.ndarray
+    :param test_size: share of the rows in the test set
+    :type test_size: float
+    :param log_classes: class of every row, whose test shares are logged,
+     defaults to None
+    :type log_classes: array-like, optional
+    :return: train and test split of every array, in the order of
+     `train_test_split`
+    :rtype: list
+    """
+    test = np.asarray(fractions) < test_size
+    if log_classes is not None:
+        classes = np.asarray(log_classes)
+        for label in np.unique(classes):
+            in_class = classes == label
+            logger.info(
+                f"Class {label}: {test[in_class].mean():.2%} of "
+                f"{in_class.sum()} rows in the test set"
+            )
+    return [part for array in arrays for part in (array[~test], array[test])]
@@ -0,0 +1,55 @@
+"""
+Survival target helpers shared by the Cox proportional hazard scripts.
+
+XGBoost's `survival:cox` objective takes a single signed label: the duration
+for uncensored rows and the negative duration for right censored rows.
+
+A label of 0 has no sign, and XGBoost trains on it as censored, since only
+positive labels are events. An event at duration 0 therefore decodes as
+censored, as the model saw it. The account length the Cox scripts use as
+the duration starts at 1 day, so no event is lost in practice.
+"""
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def encode_survival_target(event, duration) -> np.ndarray:
+    """Encode event and duration as the signed XGBoost Cox label
+
+    :param event: 1 or True where the event was observed, 0 where censored
+    :type event: array-like
+    :param duration: time to event or censoring
+    :type duration: array-like
+    :return: duration for observed rows, negative duration for censored rows,
+     0 for both at duration 0
+    :rtype: np.ndarray
+    """
+    duration = np.asarray(duration).astype(np.int32)
+    return np.where(np.asarray(event).astype(bool), duration, -duration)
+
+
+def decode_survival_target(y) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode the signed XGBoost Cox label back to event and duration
+
+    :param y: signed survival label
+    :type y: array-like
+    :return: event indicator, 1 for positive labels only, and duration
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    y = np.asarray(y)
+    return (y > 0).astype(np.int32), np.abs(y).astype(np.int32)
+
+
+def survival_frame(y) -> pd.DataFrame:
+    """Decode the signed XGBoost Cox label into an event/duration frame
+
+    :param y: signed survival label
+    :type y: array-like
+    :return: DataFrame with `event` and `duration` columns
+    :rtype: pd.DataFrame
+    """
+    event, duration = decode_survival_target(y)
+    return pd.DataFrame({"event": event, "duration": duration})
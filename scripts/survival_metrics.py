@@ -0,0 +1,372 @@
+"""
+Vectorized survival metrics for the Cox evaluation.
+
+Drop-in replacements for the scikit-survival metrics the evaluation used,
+written to scale to millions of rows:
+
+* the Kaplan-Meier estimate of the censoring distribution is computed once
+  from the training times and evaluated with a binary search
+* the IPCW concordance index counts concordant pairs in O(n log n) with a
+  Fenwick tree over risk ranks, sweeping the event times in descending order
+  instead of comparing every pair
+* the cumulative/dynamic AUC and the Brier score are evaluated over a grid of
+  times from a single sort of the risk scores, O(n) per time point
+
+Risk ties follow scikit-survival: estimates closer than `TIED_TOL` count as
+tied.
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+TIED_TOL = 1e-8
+GRID_POINTS = 20
+
+
+def kaplan_meier(event, time, reverse: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Kaplan-Meier estimate of the survival or censoring distribution
+
+    :param event: 1 or True where the event was observed
+    :type event: array-like
+    :param time: time to event or censoring
+    :type time: array-like
+    :param reverse: estimate the censoring distribution instead
+    , defaults to False
+    :type reverse: bool, optional
+    :return: unique times and the probability of surviving past each
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    event = np.asarray(event).astype(bool)
+    times, inverse = np.unique(np.asarray(time), return_inverse=True)
+    n_events = np.bincount(inverse, weights=event, minlength=len(times))
+    n_total = np.bincount(inverse, minlength=len(times))
+    n_at_risk = len(event) - np.r_[0, np.cumsum(n_total)[:-1]]
+    if reverse:
+        n_at_risk = n_at_risk - n_events
+        n_events = n_total - n_events
+    ratio = np.divide(
+        n_events, n_at_risk, out=np.zeros(len(times)), where=n_events != 0
+    )
+    return times, np.cumprod(1.0 - ratio)
+
+
+def step_function(times: np.ndarray, values: np.ndarray, at) -> np.ndarray:
+    """Evaluate a right continuous step function, 1 before its first step
+
+    :param times: sorted step times
+    :type times: np.ndarray
+    :param values: value from each step time on
+    :type values: np.ndarray
+    :param at: times to evaluate at
+    :type at: array-like
+    :return: values at `at`
+    :rtype: np.ndarray
+    """
+    index = np.searchsorted(times, np.asarray(at), side="right") - 1
+    return np.where(index >= 0, values[np.maximum(index, 0)], 1.0)
+
+
+def censoring_survival(event_train, time_train, at) -> np.ndarray:
+    """Probability of not being censored by each time, from the training set"""
+    times, probs = kaplan_meier(event_train, time_train, reverse=True)
+    return step_function(times, probs, at)
+
+
+def _risk_ranks(estimate: np.ndarray, tied_tol: float = TIED_TOL) -> np.ndarray:
+    """1 based dense ranks of the estimates, merging values within `tied_tol`"""
+    values, inverse = np.unique(estimate, return_inverse=True)
+    groups = np.r_[0, np.cumsum(np.diff(values) > tied_tol)]
+    return groups[inverse] + 1
+
+
+class _Fenwick:
+    """Fenwick tree of counts, vectorized over batches of positions"""
+
+    def __init__(self, size: int):
+        self.tree = np.zeros(size + 1, dtype=np.int64)
+        self.size = size
+
+    def add(self, positions: np.ndarray):
+        positions = positions.astype(np.int64)
+        while len(positions):
+            np.add.at(self.tree, positions, 1)
+            positions = positions + (positions & -positions)
+            positions = positions[positions <= self.size]
+
+    def prefix(self, positions: np.ndarray) -> np.ndarray:
+        positions = positions.astype(np.int64)
+        total = np.zeros(len(positions), dtype=np.int64)
+        while positions.any():
+            total += self.tree[positions]
+            positions = positions & (positions - 1)
+        return total
+
+
+def concordance_index_ipcw(
+    event_train, time_train, event, time, estimate, tau=None, tied_tol=TIED_TOL
+) -> Tuple[float, int, int, int, int]:
+    """Uno's IPCW concordance index in O(n log n)
+
+    Matches `sksurv.metrics.concordance_index_ipcw`: an event at time t is
+    compared with every row observed past t and every row censored at t,
+    weighted by the squared inverse probability of censoring at t, and only
+    events before `tau` carry weight.
+
+    :param event_train: training event indicator
+    :type event_train: array-like
+    :param time_train: training times, used for the censoring distribution
+    :type time_train: array-like
+    :param event: test event indicator
+    :type event: array-like
+    :param time: test times
+    :type time: array-like
+    :param estimate: predicted risk, higher for earlier events
+    :type estimate: array-like
+    :param tau: truncation time, defaults to None
+    :type tau: float, optional
+    :param tied_tol: tolerance of tied risks, defaults to 1e-8
+    :type tied_tol: float, optional
+    :return: concordance index, concordant, discordant, tied risk and tied
+     time pair counts
+    :rtype: Tuple[float, int, int, int, int]
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time)
+    ranks = _risk_ranks(np.asarray(estimate, dtype=np.float64), tied_tol)
+
+    weights = np.zeros(len(time))
+    weighted = event if tau is None else event & (time < tau)
+    g = censoring_survival(event_train, time_train, time[weighted])
+    if (g == 0).any():
+        raise ValueError("censoring survival function is zero at one or more times")
+    weights[weighted] = 1.0 / np.square(g)
+
+    tree = _Fenwick(int(ranks.max()) if len(ranks) else 0)
+    inserted = 0
+    numerator = denominator = 0.0
+    concordant = discordant = tied_risk = tied_time = 0
+    order = np.argsort(-time, kind="mergesort")
+    bounds = np.r_[0, np.flatnonzero(np.diff(time[order])) + 1, len(order)]
+    # descending times, so the tree holds every row observed after the group
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        group = order[start:end]
+        events, censored = group[event[group]], group[~event[group]]
+        tree.add(ranks[censored])
+        inserted += len(censored)
+        if len(events):
+            below = tree.prefix(ranks[events] - 1)
+            ties = tree.prefix(ranks[events]) - below
+            w = weights[events]
+            numerator += float((w * (below + 0.5 * ties)).sum())
+            denominator += float(w.sum() * inserted)
+            concordant += int(below.sum())
+            tied_risk += int(ties.sum())
+            discordant += int((inserted - below - ties).sum())
+            tied_time += len(events) * len(censored)
+        tree.add(ranks[events])
+        inserted += len(events)
+
+    if denominator == 0:
+        raise ValueError("Data has no comparable pairs, cannot estimate concordance")
+    return numerator / denominator, concordant, discordant, tied_risk, tied_time
+
+
+def time_grid(time, points: int = GRID_POINTS) -> np.ndarray:
+    """Evenly spaced quantiles of the test times, from the 10th to the 90th
+
+    :param time: test times
+    :type time: array-like
+    :param points: number of time points, defaults to 20
+    :type points: int, optional
+    :return: sorted unique time points within the follow-up time
+    :rtype: np.ndarray
+    """
+    return np.unique(np.percentile(np.asarray(time), np.linspace(10, 90, points)))
+
+
+def cumulative_dynamic_auc(
+    event_train, time_train, event, time, estimate, times, tied_tol=TIED_TOL
+) -> Tuple[np.ndarray, float]:
+    """Cumulative/dynamic AUC at every time point
+
+    Matches `sksurv.metrics.cumulative_dynamic_auc` for a risk score that
+    does not change with time: cases are events up to t weighted by their
+    inverse probability of censoring, controls are rows still observed
+    after t.
+
+    :param event_train: training event indicator
+    :type event_train: array-like
+    :param time_train: training times, used for the censoring distribution
+    :type time_train: array-like
+    :param event: test event indicator
+    :type event: array-like
+    :param time: test times
+    :type time: array-like
+    :param estimate: predicted risk, higher for earlier events
+    :type estimate: array-like
+    :param times: time points, see `time_grid`
+    :type times: array-like
+    :param tied_tol: tolerance of tied risks, defaults to 1e-8
+    :type tied_tol: float, optional
+    :return: AUC at each time and its mean weighted by the test
+     Kaplan-Meier survival function
+    :rtype: Tuple[np.ndarray, float]
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time)
+    times = np.asarray(times)
+    ranks = _risk_ranks(np.asarray(estimate, dtype=np.float64), tied_tol)
+    n_ranks = int(ranks.max()) + 1
+
+    # only events up to the last time point are ever cases
+    ipcw = np.zeros(len(time))
+    cases = event & (time <= times.max())
+    g = censoring_survival(event_train, time_train, time[cases])
+    if (g == 0).any():
+        raise ValueError("censoring survival function is zero at one or more times")
+    ipcw[cases] = 1.0 / g
+
+    scores = np.empty(len(times))
+    for k, t in enumerate(times):
+        cases = np.bincount(
+            ranks, weights=ipcw * (event & (time <= t)), minlength=n_ranks
+        )
+        controls = np.bincount(ranks, weights=time > t, minlength=n_ranks)
+        below = np.cumsum(controls) - controls
+        scores[k] = (cases * (below + 0.5 * controls)).sum() / (
+            cases.sum() * controls.sum()
+        )
+
+    if len(times) == 1:
+        return scores, float(scores[0])
+    km_times, km_probs = kaplan_meier(event, time)
+    survival = step_function(km_times, km_probs, times)
+    d = -np.diff(np.r_[1.0, survival])
+    return scores, float((scores * d).sum() / (1.0 - survival[-1]))
+
+
+def breslow_baseline(event, time, hazard_ratio) -> Tuple[np.ndarray, np.ndarray]:
+    """Breslow estimate of the baseline survival function of a Cox model
+
+    :param event: training event indicator
+    :type event: array-like
+    :param time: training times
+    :type time: array-like
+    :param hazard_ratio: predicted relative hazard of every training row,
+     what XGBoost's `survival:cox` objective predicts
+    :type hazard_ratio: array-like
+    :return: unique times and the baseline survival past each
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    event = np.asarray(event).astype(bool)
+    times, inverse = np.unique(np.asarray(time), return_inverse=True)
+    n_events = np.bincount(inverse, weights=event, minlength=len(times))
+    hazard = np.bincount(inverse, weights=hazard_ratio, minlength=len(times))
+    # sum of the hazard ratios still at risk at each time
+    at_risk = np.cumsum(hazard[::-1])[::-1]
+    return times, np.exp(-np.cumsum(n_events / at_risk))
+
+
+def brier_scores(event_train, time_train, event, time, survival, times) -> np.ndarray:
+    """IPCW Brier score at every time point
+
+    Matches `sksurv.metrics.brier_score`.
+
+    :param event_train: training event indicator
+    :type event_train: array-like
+    :param time_train: training times, used for the censoring distribution
+    :type time_train: array-like
+    :param event: test event indicator
+    :type event: array-like
+    :param time: test times
+    :type time: array-like
+    :param survival: callable returning the predicted probability of every
+     test row surviving past a time, or an array with one column per time
+    :type survival: Callable or np.ndarray
+    :param times: time points, see `time_grid`
+    :type times: array-like
+    :return: Brier score at each time
+    :rtype: np.ndarray
+    """
+    event = np.asarray(event).astype(bool)
+    time = np.asarray(time)
+    times = np.asarray(times)
+    g_t = censoring_survival(event_train, time_train, times)
+    g_y = censoring_survival(event_train, time_train, time)
+    g_t[g_t == 0] = np.inf
+    g_y[g_y == 0] = np.inf
+
+    scores = np.empty(len(times))
+    for k, t in enumerate(times):
+        est = survival(t) if callable(survival) else survival[:, k]
+        is_case = (time <= t) & event
+        is_control = time > t
+        scores[k] = np.mean(
+            np.square(est) * is_case / g_y + np.square(1.0 - est) * is_control / g_t[k]
+        )
+    return scores
+
+
+def integrated_brier_score(times: np.ndarray, scores: np.ndarray) -> float:
+    """Brier scores integrated over the time grid with the trapezoidal rule"""
+    if len(times) < 2:
+        raise ValueError("At least two time points must be given")
+    # np.trapz was removed in NumPy 2.4
+    area = (np.diff(times) * (scores[1:] + scores[:-1]) / 2).sum()
+    return float(area / (times[-1] - times[0]))
+
+
+def survival_report(
+    event_train,
+    time_train,
+    hazard_train,
+    event,
+    time,
+    hazard,
+    times,
+) -> Dict[str, object]:
+    """Time-dependent AUC and Brier scores of a Cox model over a time grid
+
+    Survival probabilities come from the Breslow baseline of the training
+    predictions, S(t | x) = S0(t) ** hazard_ratio(x).
+
+    :param event_train: training event indicator
+    :type event_train: array-like
+    :param time_train: training times
+    :type time_train: array-like
+    :param hazard_train: predicted hazard ratio of the training rows
+    :type hazard_train: array-like
+    :param event: test event indicator
+    :type event: array-like
+    :param time: test times
+    :type time: array-like
+    :param hazard: predicted hazard ratio of the test rows
+    :type hazard: array-like
+    :param times: time points, see `time_grid`
+    :type times: array-like
+    :return: JSON ready report
+    :rtype: Dict[str, object]
+    """
+    hazard = np.asarray(hazard, dtype=np.float64)
+    auc, mean_auc = cumulative_dynamic_auc(
+        event_train, time_train, event, time, hazard, times
+    )
+    base_times, base_survival = breslow_baseline(event_train, time_train, hazard_train)
+    brier = brier_scores(
+        event_train,
+        time_train,
+        event,
+        time,
+        lambda t: step_function(base_times, base_survival, t) ** hazard,
+        times,
+    )
+    report = {
+        "times": np.asarray(times).tolist(),
+        "auc": auc.tolist(),
+        "mean_auc": mean_auc,
+        "brier_score": brier.tolist(),
+    }
+    if len(times) > 1:
+        report["integrated_brier_score"] = integrated_brier_score(times, brier)
+    return report
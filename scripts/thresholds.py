@@ -0,0 +1,132 @@
+"""
+Classification metrics at every probability cut-off in a single pass.
+
+The predictions are sorted once; the confusion matrix at every distinct
+cut-off then follows from cumulative sums of the sorted labels, so the whole
+curve costs O(n log n) instead of one pass over the predictions per cut-off.
+A row is predicted positive when its probability is strictly above the
+cut-off, as in the evaluation reports, see `predict_positive`. The curve
+starts at the highest probability, where no row is predicted positive, so the
+cost optimum can choose to contact no one.
+"""
+
+from typing import Dict
+
+import numpy as np
+
+SWEEP_POINTS = 101
+
+
+def predict_positive(scores, threshold: float) -> np.ndarray:
+    """Rows predicted positive at a cut-off, the comparison of the curve
+
+    :param scores: predicted probability of the positive class
+    :type scores: array-like
+    :param threshold: cut-off
+    :type threshold: float
+    :return: True for the rows above the cut-off
+    :rtype: np.ndarray
+    """
+    return np.asarray(scores) > threshold
+
+
+def threshold_curve(y_true, scores) -> Dict[str, np.ndarray]:
+    """Confusion matrix and metrics at every distinct cut-off
+
+    :param y_true: binary labels, 1 for the positive class
+    :type y_true: array-like
+    :param scores: predicted probability of the positive class
+    :type scores: array-like
+    :return: arrays of `threshold`, `tp`, `fp`, `fn`, `tn`, `precision`,
+     `recall`, `f1`, `lift` and `rate` (share of rows predicted positive),
+     from the highest cut-off down, the first one at the highest score
+    :rtype: Dict[str, np.ndarray]
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    scores = np.asarray(scores)
+    order = np.argsort(-scores, kind="mergesort")
+    scores, y_true = scores[order], y_true[order]
+
+    # the last position of every run of equal scores ends a cut-off at the
+    # next lower score, so the run is above it; the highest score predicts no
+    # row positive and the last cut-off, just below the lowest, predicts all
+    ends = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    threshold = np.r_[
+        scores[:1], scores[ends[:-1] + 1], np.nextafter(scores[-1:], -np.inf)
+    ]
+    tp = np.r_[0, np.cumsum(y_true, dtype=np.int64)[ends]]
+    predicted = np.r_[0, ends + 1]
+    fp = predicted - tp
+    positives, n = int(y_true.sum()), len(y_true)
+    fn = positives - tp
+    tn = n - positives - fp
+
+    # precision and F1 are 0 without any row to divide by
+    precision = np.divide(tp, predicted, out=np.zeros(len(tp)), where=predicted > 0)
+    recall = tp / positives if positives else np.zeros(len(tp))
+    f1 = np.divide(2 * tp, 2 * tp + fp + fn, out=np.zeros(len(tp)), where=tp + fn > 0)
+    base_rate = positives / n if n else 0.0
+    lift = precision / base_rate if base_rate else np.zeros(len(tp))
+    return {
+        "threshold": threshold,
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "tn": tn,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "lift": lift,
+        "rate": predicted / n,
+    }
+
+
+def optimal_thresholds(
+    curve: Dict[str, np.ndarray], fp_cost: float = 1.0, fn_cost: float = 1.0
+) -> dict:
+    """Cut-offs with the best F1 and with the lowest misclassification cost
+
+    :param curve: output of `threshold_curve`
+    :type curve: Dict[str, np.ndarray]
+    :param fp_cost: cost of a false positive, e.g. an unneeded retention
+     offer, defaults to 1.0
+    :type fp_cost: float, optional
+    :param fn_cost: cost of a false negative, i.e. a missed churner,
+     defaults to 1.0
+    :type fn_cost: float, optional
+    :return: threshold and metrics at each optimum
+    :rtype: dict
+    """
+    cost = fp_cost * curve["fp"] + fn_cost * curve["fn"]
+    best_f1, best_cost = int(np.argmax(curve["f1"])), int(np.argmin(cost))
+    return {
+        "f1": {
+            "threshold": float(curve["threshold"][best_f1]),
+            "f1": float(curve["f1"][best_f1]),
+            "precision": float(curve["precision"][best_f1]),
+            "recall": float(curve["recall"][best_f1]),
+        },
+        "cost": {
+            "threshold": float(curve["threshold"][best_cost]),
+            "cost": float(cost[best_cost]),
+            "fp_cost": fp_cost,
+            "fn_cost": fn_cost,
+            "precision": float(curve["precision"][best_cost]),
+            "recall": float(curve["recall"][best_cost]),
+        },
+    }
+
+
+def curve_report(curve: Dict[str, np.ndarray], points: int = SWEEP_POINTS) -> dict:
+    """JSON ready curve, thinned to at most `points` evenly spaced cut-offs
+
+    :param curve: output of `threshold_curve`
+    :type curve: Dict[str, np.ndarray]
+    :param points: maximum number of cut-offs kept, defaults to 101
+    :type points: int, optional
+    :return: lists of every metric of the curve
+    :rtype: dict
+    """
+    n = len(curve["threshold"])
+    index = np.unique(np.linspace(0, n - 1, min(points, n)).round().astype(int))
+    return {name: values[index].tolist() for name, values in curve.items()}
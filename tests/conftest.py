@@ -0,0 +1,68 @@
+"""
+The scripts run as SageMaker Processing jobs with their sibling modules on
+the path, so the tests import them the same way.
+"""
+
+import os
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+SCRIPTS = os.path.join(ROOT, "scripts")
+sys.path.insert(0, SCRIPTS)
+
+CHURN = os.path.join(ROOT, "data", "churn.txt")
+CHURN_INFER = os.path.join(ROOT, "data", "infer", "churn_test.txt")
+
+
+def run_script(name: str, *args: str):
+    """Run a processing script as the job does, without installing packages"""
+    env = dict(os.environ, SKIP_DEPENDENCY_CHECK="1", PYTHONWARNINGS="ignore")
+    subprocess.run(
+        [sys.executable, os.path.join(SCRIPTS, name), *args], check=True, env=env
+    )
+
+
+def train_features(base_dir):
+    import numpy as np
+
+    train = np.loadtxt(
+        base_dir / "train" / "train_features.csv", delimiter=",", skiprows=1
+    )
+    return train[:, 1:], train[:, 0]
+
+
+def save_model(base_dir, booster):
+    """Save a booster as `model/model.tar.gz`, the way the training job does"""
+    model_file = base_dir / "xgboost-model.json"
+    booster.save_model(str(model_file))
+    os.makedirs(base_dir / "model", exist_ok=True)
+    with tarfile.open(base_dir / "model" / "model.tar.gz", "w:gz") as archive:
+        archive.add(model_file, arcname="xgboost-model.json")
+
+
+def train_model(features, labels):
+    import xgboost
+
+    return xgboost.train(
+        {"objective": "binary:logistic", "max_depth": 3},
+        xgboost.DMatrix(features, label=labels),
+        num_boost_round=10,
+    )
+
+
+@pytest.fixture(scope="session")
+def trained_dir(tmp_path_factory):
+    """Processing directory with the transformer of `data/churn.txt`, without
+    segments, and a small booster trained on its features in `model/`"""
+    base_dir = tmp_path_factory.mktemp("trained")
+    run_script(
+        "preprocessing.py",
+        *("--database", "local", "--region", "local", "--table", "train"),
+        *("--source-path", CHURN, "--base-dir", str(base_dir), "--cluster", ""),
+    )
+    save_model(base_dir, train_model(*train_features(base_dir)))
+    return base_dir
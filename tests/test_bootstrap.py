@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from bootstrap import bootstrap_auc, bootstrap_cindex, bootstrap_metric
+from sklearn.metrics import roc_auc_score
+from survival_metrics import concordance_index_ipcw
+
+
+def survival_data(rows: int, max_time: int, rng: np.random.Generator):
+    time = rng.integers(1, max_time, rows)
+    event = rng.random(rows) < 0.5
+    # rounded so that some risks are tied
+    estimate = np.round(rng.normal(size=rows) - 0.01 * time, 1)
+    return event, time, estimate
+
+
+@pytest.mark.parametrize("tau", [None, 60, 100])
+def test_bootstrap_cindex_matches_every_resample(tau):
+    rng = np.random.default_rng(0)
+    event_train, time_train, _ = survival_data(2000, 150, rng)
+    # the censoring distribution is positive at every test time
+    event_train[time_train >= 120] = True
+    event, time, estimate = survival_data(300, 120, rng)
+
+    expected = bootstrap_metric(
+        lambda *arrays: concordance_index_ipcw(
+            event_train, time_train, *arrays, tau=tau
+        )[0],
+        (event, time, estimate),
+        n_resamples=50,
+        random_state=7,
+        n_jobs=1,
+    )
+    values = bootstrap_cindex(
+        event_train,
+        time_train,
+        event,
+        time,
+        estimate,
+        tau=tau,
+        n_resamples=50,
+        random_state=7,
+        n_jobs=1,
+    )
+    np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+
+def test_bootstrap_cindex_without_comparable_pairs_is_nan():
+    values = bootstrap_cindex(
+        [1, 0, 1], [1, 2, 3], [0, 0], [1, 2], [0.5, 0.1], n_resamples=3, n_jobs=1
+    )
+    assert np.isnan(values).all()
+
+
+def test_bootstrap_auc_matches_every_resample():
+    rng = np.random.default_rng(1)
+    y = rng.random(500) < 0.3
+    scores = np.round(rng.random(500) + 0.3 * y, 2)
+    # bootstrap_auc resamples the rows sorted by score, the same resamples
+    # of the rows in that order
+    order = np.argsort(scores, kind="mergesort")
+    expected = bootstrap_metric(
+        roc_auc_score,
+        (y[order], scores[order]),
+        n_resamples=20,
+        random_state=3,
+        n_jobs=1,
+    )
+    values = bootstrap_auc(y, scores, n_resamples=20, random_state=3, n_jobs=1)
+    np.testing.assert_allclose(values, expected, rtol=1e-12)
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from compiled_transform import CompiledTransform, export_transform, load_transform
+from preprocessing import build_preprocessor
+
+CHURN = os.path.join(os.path.dirname(__file__), "..", "data", "churn.txt")
+NUMERICAL = ["day mins", "day calls", "custserv calls"]
+CATEGORICAL = ["state", "int'l plan", "segments"]
+# not listed in either block, so left to the passthrough remainder
+PASSTHROUGH = "account length"
+
+# the lookup of integer categories loaded as objects must not infer its dtype
+pytestmark = pytest.mark.filterwarnings(
+    "error:In a future version, the Index constructor:FutureWarning"
+)
+
+
+@pytest.fixture(scope="module")
+def churn():
+    churn = pd.read_csv(CHURN, nrows=1000)
+    churn.columns = churn.columns.str.lower()
+    churn["segments"] = np.arange(len(churn)) % 4
+    return churn[NUMERICAL + CATEGORICAL + [PASSTHROUGH]]
+
+
+@pytest.fixture(scope="module")
+def preprocessor(churn):
+    return build_preprocessor(NUMERICAL, CATEGORICAL).fit(churn)
+
+
+def with_gaps(df: pd.DataFrame, dtype: str) -> pd.DataFrame:
+    """Rows with missing numbers and categories and unseen categories"""
+    df = df.iloc[:200].copy()
+    df.loc[df.index[::7], "day mins"] = np.nan
+    df.loc[df.index[1::7], "day calls"] = np.nan
+    df.loc[df.index[2::7], "state"] = np.nan
+    df.loc[df.index[3::7], "state"] = "unseen"
+    df.loc[df.index[4::7], "int'l plan"] = np.nan
+    df.loc[df.index[5::7], "segments"] = 99
+    return df.astype({name: dtype for name in CATEGORICAL})
+
+
+def round_trip(preprocessor, directory) -> CompiledTransform:
+    export_transform(preprocessor, str(directory))
+    return load_transform(str(directory))
+
+
+@pytest.mark.parametrize("dtype", ["object", "category"])
+@pytest.mark.parametrize("saved", [False, True])
+def test_matches_sklearn(churn, preprocessor, tmp_path, dtype, saved):
+    compiled = (
+        round_trip(preprocessor, tmp_path)
+        if saved
+        else CompiledTransform.from_preprocessor(preprocessor)
+    )
+    df = with_gaps(churn, dtype)
+    expected = preprocessor.transform(df).astype(np.float32)
+    np.testing.assert_array_equal(compiled.transform(df), expected)
+
+
+def test_unseen_categories_are_zeros(churn, preprocessor):
+    df = with_gaps(churn, "object")
+    compiled = CompiledTransform.from_preprocessor(preprocessor)
+    states = preprocessor.named_transformers_["categorical"]["onehot"].categories_[0]
+    start = len(NUMERICAL)
+    one_hot = compiled.transform(df)[:, start : start + len(states)]
+    assert (one_hot[(df["state"] == "unseen").values] == 0).all()
+    assert (
+        one_hot[df["state"].notna().values & (df["state"] != "unseen")].sum(1) == 1
+    ).all()
+
+
+def test_passthrough_and_types_survive_the_archive(churn, preprocessor, tmp_path):
+    loaded = round_trip(preprocessor, tmp_path)
+    assert [block["kind"] for block in loaded.blocks] == [
+        "numerical",
+        "categorical",
+        "passthrough",
+    ]
+    assert (
+        loaded.n_features
+        == CompiledTransform.from_preprocessor(preprocessor).n_features
+    )
+    segments = loaded.blocks[1]["categories"][CATEGORICAL.index("segments")]
+    assert segments.tolist() == [0, 1, 2, 3]
+    assert loaded.blocks[1]["fill"].tolist() == ["missing"] * len(CATEGORICAL)
+    np.testing.assert_array_equal(
+        loaded.transform(churn)[:, -1], churn[PASSTHROUGH].to_numpy(np.float32)
+    )
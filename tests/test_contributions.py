@@ -0,0 +1,26 @@
+import json
+import os
+
+import numpy as np
+import xgboost
+from contributions import iter_contributions
+
+
+def nthread(booster):
+    return json.loads(booster.save_config())["learner"]["generic_param"]["nthread"]
+
+
+def test_contributions_leave_the_booster_unchanged():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 4))
+    # a setting iter_contributions would not pick itself
+    threads = (os.cpu_count() or 1) + 1
+    booster = xgboost.train(
+        {"objective": "binary:logistic", "max_depth": 2, "nthread": threads},
+        xgboost.DMatrix(X, label=X[:, 0] > 0),
+        num_boost_round=5,
+    )
+    contributions = np.vstack(list(iter_contributions(booster, X, batch_size=64)))
+    margin = booster.predict(xgboost.DMatrix(X), output_margin=True)
+    np.testing.assert_allclose(contributions.sum(axis=1), margin, atol=1e-5)
+    assert nthread(booster) == str(threads)
@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+import pytest
+from data_cache import FRAME_FILE, LocalCache, _evict, cached_batches, cached_frame
+
+
+def frame(n=10):
+    return pd.DataFrame({"a": range(n), "b": [f"x{i}" for i in range(n)]})
+
+
+def test_evict_least_recently_used():
+    entries = [("old", 40, 1.0), ("new", 40, 3.0), ("mid", 40, 2.0)]
+    assert _evict(entries, max_bytes=120) == []
+    assert _evict(entries, max_bytes=80) == ["old"]
+    assert _evict(entries, max_bytes=50) == ["old", "mid"]
+
+
+def test_local_cache_evicts_on_put(tmp_path):
+    cache = LocalCache(str(tmp_path), max_bytes=150)
+
+    def put(key):
+        with cache.put(key) as staging:
+            with open(os.path.join(staging, "data"), "wb") as f:
+                f.write(b"0" * 60)
+
+    for i, key in enumerate(["a", "b"]):
+        put(key)
+        os.utime(tmp_path / key, (i, i))
+    # a hit marks "a" as just used, so "b" is the oldest entry
+    assert cache.get("a")
+    put("c")
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_local_put_is_atomic(tmp_path):
+    cache = LocalCache(str(tmp_path))
+    with cache.put("key") as staging:
+        with open(os.path.join(staging, "data"), "w") as f:
+            f.write("rows")
+        assert cache.get("key") is None
+    assert open(os.path.join(cache.get("key"), "data")).read() == "rows"
+
+    with pytest.raises(ValueError), cache.put("failed"):
+        raise ValueError
+    assert cache.get("failed") is None
+    # no staging directory is left behind
+    assert os.listdir(tmp_path) == ["key"]
+
+
+def test_cached_frame_restores_files(tmp_path):
+    cache = LocalCache(str(tmp_path / "cache"))
+    clusterer = tmp_path / "clusterer.joblib"
+    builds = []
+
+    def build():
+        builds.append(1)
+        clusterer.write_text("fitted")
+        return frame()
+
+    first = cached_frame(cache, "key", build, files=[str(clusterer)])
+    clusterer.unlink()
+    second = cached_frame(cache, "key", build, files=[str(clusterer)])
+    assert len(builds) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert clusterer.read_text() == "fitted"
+
+
+def test_cached_batches_stopped_early_leave_no_entry(tmp_path):
+    cache = LocalCache(str(tmp_path))
+
+    def build():
+        for start in range(0, 30, 10):
+            yield frame(30).iloc[start : start + 10]
+
+    batches = cached_batches(cache, "key", build, batch_size=10)
+    next(batches)
+    batches.close()
+    assert cache.get("key") is None
+    assert not os.listdir(tmp_path)
+
+    built = pd.concat(cached_batches(cache, "key", build, batch_size=10))
+    assert os.path.exists(os.path.join(cache.get("key"), FRAME_FILE))
+    read = list(cached_batches(cache, "key", build, batch_size=10))
+    assert [len(batch) for batch in read] == [10, 10, 10]
+    pd.testing.assert_frame_equal(
+        pd.concat(read, ignore_index=True), built.reset_index(drop=True)
+    )
@@ -0,0 +1,68 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost
+from conftest import save_model
+from coxph_evaluation import read_labelled
+from evaluation import read_test_features
+from features_io import features_path, write_features
+from models import load_model
+from scipy import sparse
+
+
+@pytest.fixture(scope="module", params=["csv", "parquet", "libsvm"])
+def artifacts(request, tmp_path_factory):
+    base_dir = tmp_path_factory.mktemp(request.param)
+    rng = np.random.default_rng(0)
+    X = np.round(rng.normal(size=(500, 6)), 4)
+    # LibSVM does not store the trailing all zero column
+    X[:, -1] = 0
+    y = (X[:, 0] > 0).astype(float)
+    save_model(
+        base_dir,
+        xgboost.train({"max_depth": 2}, xgboost.DMatrix(X, label=y), 3),
+    )
+    path = features_path(str(base_dir), "test_features", request.param)
+    names = ["churn"] + [f"x{i}" for i in range(X.shape[1])]
+    write_features(path, np.column_stack([y, X]), names, request.param)
+    return str(base_dir / "model" / "model.tar.gz"), path, base_dir / "cache"
+
+
+def dense(X):
+    return X.toarray() if sparse.issparse(X) else np.asarray(X)
+
+
+def resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+@pytest.mark.parametrize("read", [read_test_features, read_labelled])
+def test_concurrent_loading_matches_sequential(artifacts, read):
+    model_path, path, cache_dir = artifacts
+    booster = load_model(model_path, cache_dir=str(cache_dir / "sequential"))
+    sequential = read(path, resolved(booster))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        model_future = executor.submit(
+            load_model, model_path, cache_dir=str(cache_dir / "concurrent")
+        )
+        concurrent = executor.submit(read, path, model_future).result()
+
+    for expected, actual in zip(sequential, concurrent):
+        if isinstance(expected, list):
+            assert actual == expected
+        else:
+            np.testing.assert_array_equal(dense(actual), dense(expected))
+    # the Arrow CSV reader parses the same values as pandas
+    X = dense(concurrent[0])
+    if path.endswith(".csv"):
+        expected = pd.read_csv(path).values
+        if read is read_test_features:
+            expected = expected[:, 1:]
+        np.testing.assert_array_equal(X, expected)
+    width = model_future.result().num_features()
+    assert X.shape[1] == width + (read is read_labelled)
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+import pytest
+from features_io import shard_lines, write_manifest
+
+
+@pytest.fixture
+def feature_file(tmp_path):
+    rng = np.random.default_rng(0)
+    # rows of uneven length, as one hot rows in LibSVM are
+    lines = [
+        ",".join(f"{v:.{rng.integers(1, 9)}f}" for v in rng.random(rng.integers(1, 30)))
+        for _ in range(2000)
+    ]
+    path = tmp_path / "infer_features.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.mark.parametrize(
+    "num_shards,max_shard_bytes", [(1, None), (3, None), (7, 4096), (None, 1000)]
+)
+def test_shards_concatenate_to_the_file(feature_file, num_shards, max_shard_bytes):
+    original = feature_file.read_bytes()
+    shards = shard_lines(str(feature_file), num_shards, max_shard_bytes)
+    parts = [open(shard, "rb").read() for shard in shards]
+    assert b"".join(parts) == original
+    assert not feature_file.exists()
+    assert len(shards) >= (num_shards or 1)
+    assert all(part.endswith(b"\n") for part in parts)
+    if max_shard_bytes:
+        assert max(len(part) for part in parts) <= max_shard_bytes
+
+
+def test_empty_file_writes_an_empty_manifest(tmp_path):
+    path = tmp_path / "infer_features.csv"
+    path.write_text("")
+    shards = shard_lines(str(path), num_shards=4)
+    assert shards == [] and not list(tmp_path.iterdir())
+
+    manifest = tmp_path / "infer_features.manifest"
+    write_manifest(str(manifest), shards, "s3://bucket/infer_data")
+    assert json.loads(manifest.read_text()) == [{"prefix": "s3://bucket/infer_data/"}]
@@ -0,0 +1,73 @@
+import os
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import CHURN_INFER, run_script
+from inferpreprocessing import incremental_model_path, load_index
+from row_index import INDEX_FILE, row_keys
+
+
+def write_files(base_dir, model: bytes):
+    os.makedirs(base_dir / "transformer", exist_ok=True)
+    os.makedirs(base_dir / "model", exist_ok=True)
+    (base_dir / "transformer" / "preprocessor.joblib").write_bytes(b"preprocessor")
+    (base_dir / "model" / "model.tar.gz").write_bytes(model)
+
+
+def indexed_run(base_dir, previous_dir=None):
+    args = SimpleNamespace(base_dir=str(base_dir), model_path=None)
+    index, stamp = load_index(
+        str(base_dir),
+        previous_dir,
+        cluster=False,
+        paths=[incremental_model_path(args)],
+    )
+    rows = pd.DataFrame({"area code": ["415", "415"], "phone": ["1", "2"]})
+    changed = index.update(row_keys(rows), np.array([1, 2], dtype=np.uint64))
+    index.write(str(base_dir / INDEX_FILE), stamp)
+    return changed
+
+
+@pytest.mark.parametrize("model,changed", [(b"model", 0), (b"retrained", 2)])
+def test_index_is_stamped_with_the_model(tmp_path, model, changed):
+    write_files(tmp_path / "first", b"model")
+    assert indexed_run(tmp_path / "first").sum() == 2
+
+    write_files(tmp_path / "second", model)
+    assert indexed_run(tmp_path / "second", str(tmp_path / "first")).sum() == changed
+
+
+def test_incremental_run_needs_the_model(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        incremental_model_path(SimpleNamespace(base_dir=str(tmp_path), model_path=None))
+
+
+def infer_features(trained_dir, base_dir, *args):
+    shutil.copytree(trained_dir / "transformer", base_dir / "transformer")
+    run_script(
+        "inferpreprocessing.py",
+        *("--database", "local", "--region", "local", "--table", "churn"),
+        *("--source-path", CHURN_INFER, "--base-dir", str(base_dir)),
+        *("--cluster", "", *args),
+    )
+    infer_dir = base_dir / "infer"
+    return {path.name: path.read_bytes() for path in sorted(infer_dir.iterdir())}
+
+
+@pytest.mark.parametrize("output_format", ["csv", "libsvm"])
+def test_chunks_match_a_single_batch(trained_dir, tmp_path, output_format):
+    single = infer_features(
+        trained_dir, tmp_path / "single", "--output-format", output_format
+    )
+    chunked = infer_features(
+        trained_dir,
+        tmp_path / "chunked",
+        *("--output-format", output_format, "--chunksize", "37"),
+    )
+    # the metrics of the phases differ in their timings only
+    single.pop("metrics.json", None)
+    chunked.pop("metrics.json", None)
+    assert single == chunked
@@ -0,0 +1,86 @@
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from features_io import shard_lines, write_manifest
+from inferpreprocessing import KEYS_FILE
+from merge_predictions import main
+from row_index import INDEX_FILE, RowIndex, row_hashes, row_keys
+
+
+def customers(phones, values):
+    return pd.DataFrame({"area code": "415", "phone": phones, "value": values})
+
+
+def transform_run(base_dir, table, previous_index, sharded):
+    """What the incremental inference preprocessing and Batch Transform write:
+    the keys and features of the changed rows, the index and the predictions,
+    here the value of every row"""
+    infer_dir = os.path.join(base_dir, "infer")
+    results_dir = os.path.join(base_dir, "inference_result")
+    os.makedirs(infer_dir)
+    os.makedirs(results_dir)
+    index = RowIndex(previous_index)
+    changed = table[index.update(row_keys(table), row_hashes(table[["value"]]))]
+    changed[["area code", "phone"]].to_csv(
+        os.path.join(infer_dir, KEYS_FILE), index=False
+    )
+    index.write(os.path.join(infer_dir, INDEX_FILE), "stamp")
+
+    features = os.path.join(infer_dir, "infer_features.csv")
+    changed[["value"]].to_csv(features, index=False, header=False)
+    shards = [features]
+    if sharded:
+        shards = shard_lines(features, num_shards=3)
+        write_manifest(os.path.join(infer_dir, "infer_features.manifest"), shards)
+    for shard in shards:
+        name = os.path.basename(shard)
+        with open(shard) as src, open(
+            os.path.join(results_dir, f"{name}.out"), "w"
+        ) as dst:
+            dst.write(src.read())
+    return pd.read_parquet(os.path.join(infer_dir, INDEX_FILE))
+
+
+def merge(base_dir, previous_dir=None):
+    main(
+        SimpleNamespace(
+            coxph=False,
+            chunksize=2,
+            base_dir=str(base_dir),
+            infer_dir=None,
+            results_dir=None,
+            previous_dir=previous_dir,
+            output_name="scores.csv",
+        )
+    )
+    scores = pd.read_csv(
+        os.path.join(base_dir, "scores", "scores.csv"), dtype={"phone": str}
+    )
+    return scores.set_index("phone")["probability"].sort_index()
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_scores_cover_the_table(tmp_path, sharded):
+    first = customers(["1", "2", "3", "4"], [0.1, 0.2, 0.3, 0.4])
+    index = transform_run(tmp_path / "first", first, None, sharded)
+    assert merge(tmp_path / "first").to_dict() == {
+        "1": 0.1,
+        "2": 0.2,
+        "3": 0.3,
+        "4": 0.4,
+    }
+
+    # 2 changes, 4 leaves and 5 joins, only those two rows are transformed
+    second = customers(["1", "2", "3", "5"], [0.1, 0.25, 0.3, 0.5])
+    transform_run(tmp_path / "second", second, index, sharded)
+    scores = merge(tmp_path / "second", str(tmp_path / "first" / "scores"))
+    assert scores.to_dict() == {"1": 0.1, "2": 0.25, "3": 0.3, "5": 0.5}
+
+
+def test_missing_predictions_are_an_error(tmp_path):
+    transform_run(tmp_path, customers(["1", "2"], [0.1, 0.2]), None, False)
+    os.remove(tmp_path / "inference_result" / "infer_features.csv.out")
+    with pytest.raises(FileNotFoundError):
+        merge(tmp_path)
@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+from metrics import METRICS_FILE, Metrics
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_nested_spans(tmp_path):
+    metrics = Metrics(str(tmp_path / METRICS_FILE))
+    with metrics.span("load", rows=10) as load:
+        with metrics.span("read") as read_span:
+            read_span["rows"] = 5
+        load["files"] = 2
+    with metrics.span("write"):
+        pass
+
+    spans = read(tmp_path / METRICS_FILE)["spans"]
+    assert [span["name"] for span in spans] == ["load", "read", "write"]
+    assert [span.get("parent") for span in spans] == [None, "load", None]
+    assert (spans[0]["rows"], spans[0]["files"], spans[1]["rows"]) == (10, 2, 5)
+    assert spans[0]["wall_seconds"] >= spans[1]["wall_seconds"]
+    assert all("error" not in span for span in spans)
+
+
+def test_failed_phase_is_written(tmp_path):
+    metrics = Metrics(str(tmp_path / "evaluation" / METRICS_FILE))
+    with pytest.raises(KeyError):
+        with metrics.span("load"):
+            with metrics.span("predict", rows=3):
+                raise KeyError("model")
+
+    spans = read(tmp_path / "evaluation" / METRICS_FILE)["spans"]
+    assert [(span["name"], span["error"]) for span in spans] == [
+        ("load", "KeyError"),
+        ("predict", "KeyError"),
+    ]
+    assert all("wall_seconds" in span for span in spans)
+    # a later phase is no longer nested in the failed one
+    with metrics.span("retry"):
+        pass
+    assert "parent" not in read(metrics.path)["spans"][-1]
+
+
+def test_profile_span(tmp_path):
+    metrics = Metrics(str(tmp_path / METRICS_FILE), profile_span="fit")
+    with metrics.span("fit"):
+        sum(range(1000))
+    with metrics.span("transform"):
+        pass
+    spans = read(metrics.path)["spans"]
+    assert os.path.exists(spans[0]["profile"])
+    assert "profile" not in spans[1]
@@ -0,0 +1,64 @@
+import io
+import tarfile
+
+import models
+import numpy as np
+import pytest
+import xgboost
+from models import _extract, load_model
+
+
+@pytest.fixture(autouse=True)
+def no_loaded_boosters(monkeypatch):
+    monkeypatch.setattr(models, "_boosters", {})
+
+
+def model_archive(path, rounds):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(100, 3))
+    booster = xgboost.train(
+        {"objective": "binary:logistic"},
+        xgboost.DMatrix(X, label=X[:, 0] > 0),
+        num_boost_round=rounds,
+    )
+    model_file = path.parent / f"{path.stem}-xgboost-model.json"
+    booster.save_model(str(model_file))
+    with tarfile.open(path, "w:gz") as archive:
+        archive.add(model_file, arcname="xgboost-model.json")
+    return str(path)
+
+
+def test_load_model_cache(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    archive = model_archive(tmp_path / "model.tar.gz", rounds=2)
+    booster = load_model(archive, cache_dir=str(cache_dir))
+    assert load_model(archive, cache_dir=str(cache_dir)) is booster
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # a new process reads the extracted model without extracting again
+    monkeypatch.setattr(models, "_boosters", {})
+    monkeypatch.setattr(models, "_extract", pytest.fail)
+    reloaded = load_model(archive, cache_dir=str(cache_dir))
+    assert reloaded is not booster
+    assert reloaded.save_raw() == booster.save_raw()
+
+    # another artifact misses the cache
+    monkeypatch.setattr(models, "_extract", _extract)
+    other = model_archive(tmp_path / "other.tar.gz", rounds=3)
+    assert load_model(other, cache_dir=str(cache_dir)).num_boosted_rounds() == 3
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+@pytest.mark.parametrize("name", ["../outside", "/tmp/absolute", "a/../../outside"])
+def test_extract_rejects_paths_outside(tmp_path, name):
+    archive = tmp_path / "model.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        member = tarfile.TarInfo(name)
+        member.size = 4
+        tar.addfile(member, io.BytesIO(b"evil"))
+    target = tmp_path / "cache" / "digest"
+    with pytest.raises(ValueError, match="outside of the archive"):
+        _extract(str(archive), str(target))
+    # nothing extracted and no staging directory left
+    assert not list((tmp_path / "cache").iterdir())
+    assert not (tmp_path / "outside").exists()
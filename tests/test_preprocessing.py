@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import SCRIPTS
+from preprocessing import read_partition, row_partitions, spill_partitions
+
+CHURN = os.path.join(os.path.dirname(__file__), "..", "data", "churn.txt")
+
+
+def source_chunks(seed=0):
+    rng = np.random.default_rng(seed)
+    churn = pd.read_csv(CHURN, nrows=300)
+    churn.columns = churn.columns.str.lower()
+    # every row again in a later chunk, and duplicates within a chunk
+    rows = pd.concat([churn, churn.iloc[rng.permutation(len(churn))[:200]]])
+    rows = pd.concat([rows.iloc[:50], rows], ignore_index=True)
+    return [rows.iloc[start : start + 120] for start in range(0, len(rows), 120)]
+
+
+def test_partitions_drop_every_duplicate(tmp_path):
+    args = SimpleNamespace(dedupe_partitions=8, compact_dtypes=False, split="random")
+    partitions = spill_partitions(iter(source_chunks()), args, str(tmp_path))
+    rows = pd.concat([read_partition(files) for files in partitions if files])
+    assert len(rows) == 300
+    assert not rows.duplicated().any()
+    assert not list(tmp_path.iterdir())
+
+
+def test_equal_hashes_keep_distinct_rows(tmp_path):
+    rows = pd.DataFrame({"a": [1.0, 2.0, 1.0, 3.0], "b": ["x", "y", "x", "z"]})
+    # a single partition holds every row, as rows with colliding hashes would
+    assert (row_partitions(rows, 1) == 0).all()
+    path = str(tmp_path / "partition.parquet")
+    rows.to_parquet(path, index=False)
+    assert read_partition([path]).values.tolist() == [
+        [1.0, "x"],
+        [2.0, "y"],
+        [3.0, "z"],
+    ]
+
+
+def preprocess_tables(tmp_path, tables):
+    source_path = str(tmp_path / "source" / "{table}.csv")
+    return subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS, "preprocessing.py"),
+            *("--database", "local", "--region", "local", "--table", tables),
+            *("--source-path", source_path, "--base-dir", str(tmp_path / "out")),
+            *("--cluster", ""),
+        ],
+        env=dict(os.environ, SKIP_DEPENDENCY_CHECK="1", PYTHONWARNINGS="ignore"),
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.fixture
+def table_sources(tmp_path):
+    os.makedirs(tmp_path / "source")
+    churn = pd.read_csv(CHURN, nrows=300)
+    for table in ("a1", "a2", "b", "c"):
+        churn.to_csv(tmp_path / "source" / f"{table}.csv", index=False)
+    # a table without the target column fails
+    churn.drop(columns="Churn?").to_csv(tmp_path / "source" / "a3.csv", index=False)
+    return tmp_path
+
+
+def test_tables_write_their_own_outputs(table_sources):
+    run = preprocess_tables(table_sources, "a[12],b")
+    assert run.returncode == 0, run.stderr
+    out = table_sources / "out"
+    for table in ("a1", "a2", "b"):
+        assert (out / "train" / table / "train_features.csv").exists()
+        assert (out / "test" / table / "test_features.csv").exists()
+        assert (out / "transformer" / table / "preprocessor.joblib").exists()
+    assert not (out / "train" / "c").exists()
+
+
+def test_failed_table_fails_the_run(table_sources):
+    run = preprocess_tables(table_sources, "a*,b")
+    assert run.returncode != 0
+    assert "RuntimeError: Preprocessing failed for tables ['a3']" in run.stderr
+    # the other tables still ran
+    out = table_sources / "out"
+    for table in ("a1", "a2", "b"):
+        assert (out / "train" / table / "train_features.csv").exists()
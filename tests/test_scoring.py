@@ -0,0 +1,101 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost
+from conftest import (
+    CHURN_INFER,
+    run_script,
+    save_model,
+    train_features,
+    train_model,
+)
+from row_index import KEY_COLUMNS, row_keys
+from scoring import merge_previous
+
+SOURCE = ("--database", "local", "--region", "local", "--table", "infer")
+
+
+def score(base_dir, *args):
+    run_script(
+        "scoring.py",
+        *SOURCE,
+        *("--source-path", CHURN_INFER, "--base-dir", str(base_dir)),
+        *("--cluster", "", "--chunksize", "100"),
+        *("--model-cache-dir", str(base_dir / "cache"), *args),
+    )
+    return pd.read_csv(
+        base_dir / "scores" / "scores.csv", dtype={c: str for c in KEY_COLUMNS}
+    )
+
+
+@pytest.fixture(scope="module")
+def batch_features(trained_dir, tmp_path_factory):
+    """Features of the Batch Transform path, from the inference preprocessing"""
+    base_dir = tmp_path_factory.mktemp("batch")
+    shutil.copytree(trained_dir / "transformer", base_dir / "transformer")
+    run_script(
+        "inferpreprocessing.py",
+        *SOURCE,
+        *("--source-path", CHURN_INFER, "--base-dir", str(base_dir)),
+        "--cluster",
+        "",
+    )
+    return np.loadtxt(base_dir / "infer" / "infer_features.csv", delimiter=",")
+
+
+@pytest.fixture(scope="module")
+def booster(trained_dir):
+    return xgboost.Booster(model_file=str(trained_dir / "xgboost-model.json"))
+
+
+def test_pool_scores_match_batch_transform(trained_dir, batch_features, booster):
+    scores = score(trained_dir, "--n-jobs", "2")
+    # the chunks come back from the pool in source order
+    source = pd.read_csv(CHURN_INFER, dtype=str)
+    source.columns = source.columns.str.lower()
+    assert row_keys(scores).tolist() == row_keys(source.dropna()).tolist()
+    np.testing.assert_allclose(
+        scores["probability"],
+        booster.predict(xgboost.DMatrix(batch_features)),
+        rtol=0,
+        atol=1e-6,
+    )
+
+
+def test_zero_is_missing_when_asked(trained_dir, batch_features, tmp_path):
+    shutil.copytree(trained_dir / "transformer", tmp_path / "transformer")
+    features, labels = train_features(trained_dir)
+    # a model whose missing branch of a one hot column is not the zero branch
+    rng = np.random.default_rng(0)
+    gaps = (features[:, -1] == 0) & (rng.random(len(features)) < 0.3)
+    features[gaps, -1], labels[gaps] = np.nan, 1
+    booster = train_model(features, labels)
+    save_model(tmp_path, booster)
+    expected = booster.predict(xgboost.DMatrix(batch_features, missing=0.0))
+    assert np.abs(booster.predict(xgboost.DMatrix(batch_features)) - expected).max()
+
+    scores = score(tmp_path, "--n-jobs", "1", "--missing", "0")
+    np.testing.assert_allclose(scores["probability"], expected, rtol=0, atol=1e-6)
+
+
+def test_merge_previous_keeps_unchanged_customers(tmp_path):
+    previous = pd.DataFrame(
+        {"area code": "415", "phone": ["1", "2", "3"], "probability": [0.1, 0.2, 0.3]}
+    )
+    previous.to_csv(tmp_path / "previous.csv", index=False)
+    scores_path = tmp_path / "scores.csv"
+    pd.DataFrame({"area code": ["415"], "phone": ["4"], "probability": [0.4]}).to_csv(
+        scores_path, index=False
+    )
+    rows = merge_previous(
+        str(tmp_path / "previous.csv"),
+        str(scores_path),
+        pd.Index(["415|1", "415|3"]),
+        chunksize=1,
+        header=False,
+    )
+    assert rows == 2
+    merged = pd.read_csv(scores_path, dtype={"phone": str})
+    assert merged["phone"].tolist() == ["4", "1", "3"]
@@ -0,0 +1,52 @@
+import joblib
+import numpy as np
+import pandas as pd
+from segments import CLUSTERER_FILE, SegmentAssigner, sample_index
+
+
+def clustered_rows(n=600, seed=0):
+    """Rows of three well separated segments, as DenseClus would label them"""
+    rng = np.random.default_rng(seed)
+    segments = rng.integers(0, 3, size=n)
+    df = pd.DataFrame(
+        {
+            "minutes": rng.normal(100 + 200 * segments, 10),
+            "calls": rng.poisson(5 + 40 * segments).astype(float),
+            "plan": np.array(["basic", "plus", "pro"])[segments],
+            "state": rng.choice(["CA", "NY", "TX"], size=n),
+        }
+    )
+    return df, segments.astype(str)
+
+
+def test_reloaded_assigner_reproduces_training_segments(tmp_path):
+    df, segments = clustered_rows()
+    path = tmp_path / CLUSTERER_FILE
+    joblib.dump(SegmentAssigner(batch_size=128).fit(df, segments), path)
+    assigner = joblib.load(path)
+    assert (assigner.predict(df) == segments).all()
+    # batches of new rows, with a category never seen in training
+    new, new_segments = clustered_rows(300, seed=1)
+    new.loc[::7, "state"] = "WA"
+    assert (assigner.predict(new) == new_segments).all()
+    assert assigner.predict(new.iloc[:0]).shape == (0,)
+
+
+def test_sample_keeps_class_shares():
+    labels = np.repeat([0, 1, 2], [900, 90, 10])
+    index = sample_index(len(labels), 200, stratify=labels, random_state=0)
+    assert len(index) == 200
+    assert (np.diff(index) > 0).all()
+    assert np.bincount(labels[index]).tolist() == [180, 18, 2]
+    assert (sample_index(50, 200) == np.arange(50)).all()
+
+
+def test_assigner_fit_on_a_sample(tmp_path):
+    df, segments = clustered_rows(2000)
+    index = sample_index(len(df), 300, stratify=segments, random_state=0)
+    path = tmp_path / CLUSTERER_FILE
+    joblib.dump(SegmentAssigner().fit(df.iloc[index], segments[index]), path)
+    assigner = joblib.load(path)
+    # the sample keeps its own segments and the rest is assigned in batches
+    assert (assigner.predict(df.iloc[index]) == segments[index]).all()
+    assert (assigner.predict(df) == segments).all()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from shap_plot import shap_density, stratified_rows
+
+
+@pytest.mark.parametrize("sample_size", [1, 3, 50, 200])
+def test_sample_keeps_every_class(sample_size):
+    # a class of a single row and a class far below one row of the sample
+    strata = np.repeat(["retained", "churned", "rare"], [980, 19, 1])
+    rows = stratified_rows(strata, sample_size, random_state=0)
+    assert (np.diff(rows) > 0).all()
+    # every class keeps its share, rounded down, and at least one row
+    for label, count in zip(*np.unique(strata, return_counts=True)):
+        expected = max(count * sample_size // len(strata), 1)
+        assert (strata[rows] == label).sum() == expected
+
+
+def test_sample_of_every_row():
+    assert (stratified_rows([0, 1, 1], sample_size=None) == np.arange(3)).all()
+    assert (stratified_rows([0, 1, 1], sample_size=5) == np.arange(3)).all()
+
+
+@pytest.mark.parametrize("block_rows", [7, 1000])
+def test_density_counts_every_row(block_rows):
+    rng = np.random.default_rng(0)
+    shap_values = rng.normal(size=(500, 4))
+    shap_values[:, 3] = 0.25  # a feature without any effect
+    rows = stratified_rows(rng.integers(0, 2, 500), 50, random_state=0)
+    features = rng.random((len(rows), 4))
+    density = shap_density(shap_values, rows, features, bins=10, block_rows=block_rows)
+    assert density["counts"].shape == (4, 10)
+    assert (density["counts"].sum(axis=1) == 500).all()
+    assert density["edges"].shape == (4, 11)
+    np.testing.assert_allclose(density["edges"][:3, 0], shap_values[:, :3].min(axis=0))
+    np.testing.assert_allclose(density["edges"][:3, -1], shap_values[:, :3].max(axis=0))
+    np.testing.assert_allclose(density["importance"], np.abs(shap_values).mean(axis=0))
+    # only bins holding a sampled row are colored, within the color range
+    color = density["color"]
+    assert (np.isnan(color) | ((color >= 0) & (color <= 1))).all()
+    assert np.isnan(color[density["counts"] == 0]).all()
@@ -0,0 +1,26 @@
+import pytest
+from sources import _path_tables, resolve_tables
+
+
+@pytest.fixture
+def source_path(tmp_path):
+    for name in ("a1", "a2", "ab", "b", "c"):
+        (tmp_path / f"{name}.csv").write_text("x\n1\n")
+    (tmp_path / "a3.parquet").write_text("")
+    return str(tmp_path / "{table}.csv")
+
+
+def test_path_tables(source_path):
+    assert sorted(_path_tables(source_path)) == ["a1", "a2", "ab", "b", "c"]
+
+
+def test_resolve_tables(source_path):
+    def resolve(tables):
+        return resolve_tables("db", tables, "local", source_path)
+
+    assert resolve("a*,b") == ["a1", "a2", "ab", "b"]
+    assert resolve("c, a?") == ["c", "a1", "a2", "ab"]
+    # names are kept as given and a table named twice is processed once
+    assert resolve("z,b,b*") == ["z", "b"]
+    with pytest.raises(ValueError, match="d\\*"):
+        resolve("a1,d*")
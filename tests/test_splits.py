@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import CHURN, run_script
+from splits import hash_split, key_fractions
+
+
+def customers(n, seed=0):
+    rng = np.random.default_rng(seed)
+    phones = rng.choice(10_000_000, size=n, replace=False)
+    return pd.DataFrame(
+        {
+            "area code": rng.choice([408, 415, 510], size=n),
+            "phone": [f"{p // 10_000:03d}-{p % 10_000:04d}" for p in phones],
+            "churn?": rng.integers(0, 2, size=n),
+        }
+    )
+
+
+def test_split_is_stable_by_customer():
+    df = customers(2000)
+    train, test = hash_split(df, fractions=key_fractions(df), test_size=0.25)
+    assert 0.2 < len(test) / len(df) < 0.3
+    # remove some customers, add new ones and shuffle the rows
+    grown = pd.concat([df.iloc[300:], customers(500, seed=1)]).sample(frac=1)
+    grown_train, grown_test = hash_split(
+        grown,
+        fractions=key_fractions(grown),
+        test_size=0.25,
+        log_classes=grown["churn?"],
+    )
+    kept = set(df.iloc[300:]["phone"])
+    assert set(test["phone"]) & kept == set(grown_test["phone"]) & kept
+    assert set(train["phone"]) & kept == set(grown_train["phone"]) & kept
+
+
+@pytest.fixture(scope="module")
+def split_runs(tmp_path_factory):
+    runs = {}
+    for mode, args in (("memory", ()), ("chunked", ("--chunksize", "500"))):
+        base_dir = tmp_path_factory.mktemp(mode)
+        run_script(
+            "preprocessing.py",
+            *("--database", "local", "--region", "local", "--table", "churn"),
+            *("--source-path", CHURN, "--base-dir", str(base_dir), "--cluster", ""),
+            *("--split", "hash", *args),
+        )
+        runs[mode] = base_dir
+    return runs
+
+
+@pytest.mark.parametrize("name", ["train", "test"])
+def test_chunked_split_matches_memory(split_runs, name):
+    features = []
+    for base_dir in split_runs.values():
+        rows = pd.read_csv(base_dir / name / f"{name}_features.csv").values
+        # the chunked mode writes the rows by hash partition
+        rows = np.round(rows, 6)
+        features.append(rows[np.lexsort(rows.T[::-1])])
+    np.testing.assert_allclose(*features, rtol=0, atol=1e-6)
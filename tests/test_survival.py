@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from survival import decode_survival_target, encode_survival_target, survival_frame
+
+
+def test_round_trip():
+    rng = np.random.default_rng(0)
+    event = rng.integers(0, 2, 1000)
+    duration = rng.integers(1, 250, 1000)
+    decoded_event, decoded_duration = decode_survival_target(
+        encode_survival_target(event, duration)
+    )
+    np.testing.assert_array_equal(decoded_event, event)
+    np.testing.assert_array_equal(decoded_duration, duration)
+
+
+def test_censored_rows_are_negative():
+    y = encode_survival_target([1, 0, True, False], [5, 5, 7, 7])
+    assert y.tolist() == [5, -5, 7, -7]
+    frame = survival_frame(y)
+    pd.testing.assert_frame_equal(
+        frame,
+        pd.DataFrame(
+            {
+                "event": np.array([1, 0, 1, 0], dtype=np.int32),
+                "duration": np.array([5, 5, 7, 7], dtype=np.int32),
+            }
+        ),
+    )
+
+
+def test_duration_zero_decodes_as_censored():
+    # a label of 0 has no sign, XGBoost's survival:cox treats it as censored
+    y = encode_survival_target([1, 0], [0, 0])
+    assert y.tolist() == [0, 0]
+    event, duration = decode_survival_target(y)
+    assert event.tolist() == [0, 0]
+    assert duration.tolist() == [0, 0]
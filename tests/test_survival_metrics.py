@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import survival_metrics
+from sksurv import metrics as sksurv_metrics
+from sksurv.util import Surv
+
+CHURN = os.path.join(os.path.dirname(__file__), "..", "data", "churn.txt")
+# the metrics sum the same terms as scikit-survival in another order
+TOLERANCE = 1e-10
+
+
+@pytest.fixture(scope="module")
+def churn_split():
+    """Train and test split of `data/churn.txt` with a hazard that follows
+    customer service calls and the international plan"""
+    churn = pd.read_csv(CHURN)
+    event = (churn["Churn?"] != "False.").values
+    duration = churn["Account Length"].values
+    rng = np.random.default_rng(0)
+    hazard = np.round(
+        np.exp(
+            0.3 * churn["CustServ Calls"].values
+            + 0.5 * (churn["Int'l Plan"] == "yes").values
+            + rng.normal(0, 0.5, len(churn))
+        ),
+        2,
+    )
+    train = rng.random(len(churn)) < 0.75
+    # scikit-survival rejects test times past the last training censoring
+    test = ~train & (duration < duration[train & ~event].max())
+    return {
+        "fit": (event[train], duration[train]),
+        "data": (event[test], duration[test]),
+        "hazard_train": hazard[train],
+        "hazard": hazard[test],
+        "y_train": Surv.from_arrays(event[train], duration[train]),
+        "y_test": Surv.from_arrays(event[test], duration[test]),
+    }
+
+
+@pytest.mark.parametrize("tau", [None, 100, 150])
+def test_concordance_index_ipcw(churn_split, tau):
+    s = churn_split
+    expected = sksurv_metrics.concordance_index_ipcw(
+        s["y_train"], s["y_test"], s["hazard"], tau=tau
+    )
+    result = survival_metrics.concordance_index_ipcw(
+        *s["fit"], *s["data"], s["hazard"], tau
+    )
+    assert result[0] == pytest.approx(expected[0], abs=TOLERANCE)
+    assert result[1:] == tuple(expected[1:])
+
+
+def test_cumulative_dynamic_auc(churn_split):
+    s = churn_split
+    times = survival_metrics.time_grid(s["data"][1])
+    expected, expected_mean = sksurv_metrics.cumulative_dynamic_auc(
+        s["y_train"], s["y_test"], s["hazard"], times
+    )
+    auc, mean_auc = survival_metrics.cumulative_dynamic_auc(
+        *s["fit"], *s["data"], s["hazard"], times
+    )
+    np.testing.assert_allclose(auc, expected, rtol=0, atol=TOLERANCE)
+    assert mean_auc == pytest.approx(expected_mean, abs=TOLERANCE)
+
+
+def test_brier_scores(churn_split):
+    s = churn_split
+    times = survival_metrics.time_grid(s["data"][1])
+    report = survival_metrics.survival_report(
+        *s["fit"], s["hazard_train"], *s["data"], s["hazard"], times
+    )
+    base_times, base_survival = survival_metrics.breslow_baseline(
+        *s["fit"], s["hazard_train"]
+    )
+    survival = np.column_stack(
+        [
+            survival_metrics.step_function(base_times, base_survival, t) ** s["hazard"]
+            for t in times
+        ]
+    )
+    _, expected = sksurv_metrics.brier_score(s["y_train"], s["y_test"], survival, times)
+    expected_integrated = sksurv_metrics.integrated_brier_score(
+        s["y_train"], s["y_test"], survival, times
+    )
+    np.testing.assert_allclose(report["brier_score"], expected, rtol=0, atol=TOLERANCE)
+    assert report["integrated_brier_score"] == pytest.approx(
+        expected_integrated, abs=TOLERANCE
+    )
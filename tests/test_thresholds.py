@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from sklearn.metrics import confusion_matrix
+from thresholds import optimal_thresholds, predict_positive, threshold_curve
+
+
+def scored_labels(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.random(n) < 0.2
+    # rounded, so many rows share a score
+    scores = np.round(np.clip(0.3 * y + rng.random(n) * 0.7, 0, 1), 2)
+    return y.astype(int), scores
+
+
+def test_curve_matches_the_report_comparison():
+    y, scores = scored_labels()
+    curve = threshold_curve(y, scores)
+    for k, threshold in enumerate(curve["threshold"]):
+        tn, fp, fn, tp = confusion_matrix(
+            y, predict_positive(scores, threshold), labels=[0, 1]
+        ).ravel()
+        assert (curve["tp"][k], curve["fp"][k]) == (tp, fp)
+        assert (curve["fn"][k], curve["tn"][k]) == (fn, tn)
+
+
+def test_curve_starts_with_no_row_positive():
+    y, scores = scored_labels()
+    curve = threshold_curve(y, scores)
+    assert curve["threshold"][0] == scores.max()
+    assert curve["threshold"][-1] < scores.min()
+    assert curve["tp"][0] == curve["fp"][0] == 0
+    assert curve["precision"][0] == curve["f1"][0] == curve["rate"][0] == 0
+    assert curve["tn"][-1] == curve["fn"][-1] == 0
+
+
+@pytest.mark.parametrize("fp_cost,contacts", [(0.2, True), (5.0, False)])
+def test_cost_optimum_can_contact_no_one(fp_cost, contacts):
+    y, scores = np.array([0, 1, 0, 1, 0]), np.array([0.9, 0.8, 0.7, 0.6, 0.1])
+    curve = threshold_curve(y, scores)
+    optimum = optimal_thresholds(curve, fp_cost=fp_cost, fn_cost=1.0)["cost"]
+    assert predict_positive(scores, optimum["threshold"]).any() == contacts
+    if not contacts:
+        # every churner missed
+        assert optimum["cost"] == y.sum()